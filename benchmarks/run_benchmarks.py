@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""Script to benchmark the PyINETA steps on synthetic spectra.
+
+This script builds synthetic INADEQUATE spectra of increasing size with peaks at the network points of INETA database entries,
+runs the peak picking, clustering, network finding, database matching and 1D overlay steps on each of them and records the time of every step.
+The results are written to a json file that can be given back with -b as the baseline of a later run to flag the steps that got slower.
+
+Use run_benchmarks.py -h for options.
+
+"""
+
+import os
+import io
+import sys
+import json
+import shutil
+import platform
+import tempfile
+import argparse
+import contextlib
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))	# Run from a source checkout without installing
+import pyineta.pyineta as pyineta
+import pyineta.matching as matching
+import pyineta.overlays as overlays
+import pyineta.database as database
+import pyineta.instrument as instrument
+import synthetic
+
+# Steps recorded for every spectrum size, as named in the PyINETA timings report
+stageNames=['pick','cluster','mergeLevels','horzAlign','linkNetworks','find','match','overlay']
+
+# Parameters of the example config file
+pickParams=(1.4e11,7e11,6)
+clusterParams=(1,2)
+findParams=(0.5,0.3,1,0.5,0.02)
+matchParams=(1,1,2,2,0.2,0.5)
+overlayParams=(1,0.2,10000)
+
+def parseSizes (sizes):
+	"""Parse the spectrum sizes given as 13CxDQ strings.
+
+	Args:
+		sizes (str): Comma-separated list of sizes, eg 1024x512,2048x1024.
+
+	Returns:
+		list : List of (13C size, DQ size) tuples.
+	"""
+
+	shapes=[]
+	for size in sizes.split(','):
+		try:
+			(n13,ndq)=[int(v) for v in size.lower().split('x')]
+		except ValueError:
+			exit("ERROR: Spectrum size %s should look like 2048x1024." % (size))
+		shapes.append((n13,ndq))
+	return(shapes)
+
+def runOnce (In,Cppm,DQppm,index,files1D,outdir):
+	"""Run the PyINETA steps once on a synthetic spectrum.
+
+	Args:
+		In (ndarray): The (13C, DQ) intensity matrix.
+		Cppm (1D-array): A 1D array with the 13C ppm values.
+		DQppm (1D-array): A 1D array with the double quantum ppm values.
+		index (MatchIndex): The database index to match against.
+		files1D (list): 1D ft filenames to overlay the matched networks on.
+		outdir (str): Folder for the overlay output.
+
+	Returns:
+		dict : A dict mapping the step names to their wall time, CPU time and counts.
+	"""
+
+	instrument.reset()
+	spec=pyineta.Pyineta()
+	(spec.In,spec.Cppm,spec.DQppm)=(In.copy(),Cppm,DQppm)
+	with contextlib.redirect_stdout(io.StringIO()):	# Keep the step reports out of the benchmark output
+		spec.pickPeak(*pickParams)
+		spec.clusterPoints(*clusterParams)
+		spec.findNetwork(*findParams)
+		spec.matchDb(index,*matchParams)
+		overlays.overlaySpec(spec,','.join(files1D),*overlayParams,os.path.join(outdir,"overlay.txt"),None,None,plot=False)
+	steps={}
+	for rec in instrument.records:
+		step=steps.setdefault(rec['step'],{'wall':0.0,'cpu':0.0,'counts':{}})
+		step['wall']+=rec['wall']
+		step['cpu']+=rec['cpu']
+		step['counts'].update(rec['counts'])
+	return(steps)
+
+def benchmarkSize (shape,db,args,tmpdir):
+	"""Benchmark the PyINETA steps on a synthetic spectrum of one size.
+
+	The steps are run once more before the timed repeats so that first-call costs are not counted.
+
+	Args:
+		shape (tuple): The (13C size, DQ size) of the spectrum.
+		db (dict or CompiledDb): The INETA database the networks are taken from.
+		args (Namespace): The command line options.
+		tmpdir (str): Folder for the synthetic 1D spectra and the overlay output.
+
+	Returns:
+		dict : The best wall and CPU time of every step over the repeats, with the counts of the last repeat.
+	"""
+
+	rng=np.random.default_rng(args.seed)
+	keys=sorted(db)
+	keys=[keys[i] for i in rng.choice(len(keys),min(args.entries,len(keys)),replace=False)]
+	peaks=synthetic.entryPeaks(db,keys)
+	(In,Cppm,DQppm)=synthetic.makeSpectrum(peaks,shape[0],shape[1],args.extra,args.noise,seed=args.seed)
+	shifts=np.unique(peaks[:,0])
+	files1D=[]
+	for i in range(args.spectra):
+		filename=os.path.join(tmpdir,"spectrum%d.ft" % (i+1))
+		synthetic.writeFt(filename,synthetic.make1D(shifts,seed=args.seed+i),[200.0])
+		files1D.append(filename)
+	index=matching.MatchIndex(db,matchParams[0])
+	result={'entries':len(keys),'network_points':len(peaks),'steps':{}}
+	runOnce(In,Cppm,DQppm,index,files1D,tmpdir)	# Warm up the imports and caches outside the timed runs
+	for r in range(args.repeat):
+		steps=runOnce(In,Cppm,DQppm,index,files1D,tmpdir)
+		for name in stageNames:
+			if name not in steps:
+				continue
+			best=result['steps'].setdefault(name,{'wall':steps[name]['wall'],'cpu':steps[name]['cpu']})
+			best['wall']=round(min(best['wall'],steps[name]['wall']),6)
+			best['cpu']=round(min(best['cpu'],steps[name]['cpu']),6)
+			best['counts']=steps[name]['counts']
+	result['peak_rss_mb']=instrument.peakRss()
+	return(result)
+
+def compareBaseline (results,baseline,tolerance,minTime):
+	"""Find the steps that got slower than in a baseline run.
+
+	A step is flagged when its wall time is more than 1+tolerance times the baseline and longer by more than minTime seconds, so very short steps are not flagged for timer noise.
+
+	Args:
+		results (dict): The benchmark results of this run.
+		baseline (dict): The benchmark results of the baseline run.
+		tolerance (float): Allowed relative slowdown.
+		minTime (float): Allowed absolute slowdown in seconds.
+
+	Returns:
+		list : List of (size, step, baseline wall time, wall time) tuples for the flagged steps.
+	"""
+
+	regressions=[]
+	for size, res in results['sizes'].items():
+		base=baseline.get('sizes',{}).get(size)
+		if base is None:
+			continue
+		for name, step in res['steps'].items():
+			if name not in base['steps']:
+				continue
+			(old,new)=(base['steps'][name]['wall'],step['wall'])
+			if new > old*(1+tolerance) and new-old > minTime:
+				regressions.append((size,name,old,new))
+	return(regressions)
+
+def main(args):
+
+	if args.database is not None:
+		db=database.loadDatabase(args.database)
+	else:
+		db=synthetic.randomDb(args.dbsize,args.seed)
+	results={}
+	results['machine']={'python':platform.python_version(),'numpy':np.__version__,'platform':platform.platform(),'processor':platform.processor(),'cpus':os.cpu_count()}
+	results['options']={k:v for k, v in vars(args).items() if k not in ('output','baseline')}
+	results['sizes']={}
+	tmpdir=tempfile.mkdtemp(prefix="pyineta_bench_")
+	try:
+		for shape in parseSizes(args.sizes):
+			size="%dx%d" % shape
+			print("Benchmarking %s spectrum..." % (size), end=" ", flush=True)
+			res=benchmarkSize(shape,db,args,tmpdir)
+			results['sizes'][size]=res
+			print("..Done. %s" % (", ".join("%s %.3fs" % (k,v['wall']) for k, v in res['steps'].items())))
+	finally:
+		shutil.rmtree(tmpdir,ignore_errors=True)
+	with open(args.output, 'w') as out_file:
+		json.dump(results, out_file, indent=1)
+	print("Wrote benchmark results to %s" % (args.output))
+	if args.baseline is None:
+		return
+	with open(args.baseline, 'r') as base_file:
+		baseline=json.load(base_file)
+	regressions=compareBaseline(results,baseline,args.tolerance,args.min_time)
+	for (size,name,old,new) in regressions:
+		print("REGRESSION: %s on %s spectrum took %.3fs, baseline %.3fs (%.0f%% slower)" % (name,size,new,old,100*(new/old-1) if old > 0 else float('inf')))
+	if regressions:
+		sys.exit(1)
+	print("No regressions against %s" % (args.baseline))
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description="Script to benchmark the PyINETA steps on synthetic spectra.")
+	parser.add_argument('-s', '--sizes', default="1024x512,2048x1024,4096x2048",
+		help='Optional: Comma-separated sizes of the synthetic spectra as 13CxDQ points. Default: 1024x512,2048x1024,4096x2048')
+	parser.add_argument('-n', '--entries', type=int, default=50,
+		help='Optional: Number of database entries whose networks are placed in the spectra. Default: 50')
+	parser.add_argument('-e', '--extra', type=int, default=200,
+		help='Optional: Number of peaks added outside any network. Default: 200')
+	parser.add_argument('--noise', type=float, default=0.002,
+		help='Optional: Standard deviation of the noise relative to the peak height. Default: 0.002')
+	parser.add_argument('-d', '--database', default=None,
+		help='Optional: INETA database (json or compiled) to take the networks from and match against. A random database is generated if not given.')
+	parser.add_argument('--dbsize', type=int, default=1000,
+		help='Optional: Number of entries of the random database. Default: 1000')
+	parser.add_argument('--spectra', type=int, default=4,
+		help='Optional: Number of synthetic 1D spectra to overlay the matched networks on. Default: 4')
+	parser.add_argument('-r', '--repeat', type=int, default=3,
+		help='Optional: Number of runs per size. The best time of every step is kept. Default: 3')
+	parser.add_argument('--seed', type=int, default=0,
+		help='Optional: Seed of the random generator. Default: 0')
+	parser.add_argument('-o', '--output', default="benchmark.json",
+		help='Optional: Output json file with the benchmark results. Default: benchmark.json')
+	parser.add_argument('-b', '--baseline', default=None,
+		help='Optional: Benchmark results of an earlier run to compare against. Exits with status 1 if a step got slower.')
+	parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+		help='Optional: Allowed relative slowdown against the baseline. Default: 0.25')
+	parser.add_argument('--min-time', type=float, default=0.01,
+		help='Optional: Allowed absolute slowdown against the baseline in seconds. Default: 0.01')
+	args = parser.parse_args()
+	main(args)
@@ -0,0 +1,157 @@
+"""Functions for generating synthetic INADEQUATE spectra for the benchmarks.
+
+This includes the functions used by the benchmarks to build INADEQUATE spectra of any size with peaks at the network points of INETA database entries.
+Entries come from the INETA database when one is given, or are random chains of carbons in the same format.
+Includes the following functions:
+	* randomEntry - Generate a random database entry for a chain of carbons.
+	* randomDb - Generate a random INETA database.
+	* entryPeaks - List the network points of database entries.
+	* makeSpectrum - Build a synthetic INADEQUATE intensity matrix.
+	* make1D - Build a synthetic 1D 13C spectrum.
+	* writeFt - Write an intensity array as an NMRPipe ft file.
+"""
+
+import numpy as np
+import nmrglue as ng
+
+def randomEntry (rng,name,nCarbons):
+	"""Generate a random database entry for a chain of carbons.
+
+	Every bond of the chain is a network with one peak for each carbon at the sum of their shifts on the DQ axis.
+
+	Args:
+		rng (Generator): The numpy random generator.
+		name (str): Name of the entry.
+		nCarbons (int): Number of carbons in the chain.
+
+	Returns:
+		dict : The entry in the INETA database json format.
+	"""
+
+	atoms=["C%d" % (i+1) for i in range(nCarbons)]
+	shifts=np.around(rng.uniform(10,190,nCarbons),decimals=2).tolist()
+	bonds=[[atoms[i],atoms[i+1]] for i in range(nCarbons-1)]
+	networks=[]
+	for i in range(nCarbons-1):
+		dq=round(shifts[i]+shifts[i+1],2)
+		networks.append([[atoms[i],[[shifts[i],dq]]],[atoms[i+1],[[shifts[i+1],dq]]]])
+	dbEntry={}
+	dbEntry["BMRBName"]=name
+	dbEntry["InternalID"]="%s::%s::%s::1::D2O" % (name,name,name)
+	dbEntry["Version"]="1"
+	dbEntry["Solvent"]="D2O"
+	dbEntry["ChemicalShifts"]={a:[s] for a, s in zip(atoms,shifts)}
+	dbEntry["Bonds"]=bonds
+	dbEntry["Networks"]=networks
+	dbEntry["Ambiguity"]=0.0
+	return(dbEntry)
+
+def randomDb (nEntries,seed=0,minCarbons=2,maxCarbons=8):
+	"""Generate a random INETA database.
+
+	Args:
+		nEntries (int): Number of entries.
+		seed (int, optional): Seed of the random generator. Defaults to 0.
+		minCarbons (int, optional): Smallest number of carbons in an entry. Defaults to 2.
+		maxCarbons (int, optional): Largest number of carbons in an entry. Defaults to 8.
+
+	Returns:
+		dict : The database in the INETA json format.
+	"""
+
+	rng=np.random.default_rng(seed)
+	db={}
+	for i in range(nEntries):
+		dbEntry=randomEntry(rng,"rnd%d" % (i+1),int(rng.integers(minCarbons,maxCarbons+1)))
+		db[dbEntry["InternalID"]]=dbEntry
+	return(db)
+
+def entryPeaks (db,keys):
+	"""List the network points of database entries.
+
+	Args:
+		db (dict or CompiledDb): The INETA database.
+		keys (list): IDs of the entries.
+
+	Returns:
+		ndarray : A 2D array with the 13C and DQ ppm values of all the network points.
+	"""
+
+	pts=[pt[:2] for k in keys for net in db[k]['Networks'] for side in net for pt in side[1]]
+	return(np.asarray(pts,dtype=float).reshape(-1,2))
+
+def makeSpectrum (peaks,n13=2048,ndq=1024,extraPeaks=0,noise=0.002,amp=5e11,width=1.5,seed=0):
+	"""Build a synthetic INADEQUATE intensity matrix.
+
+	Peaks are gaussians with a random height between 0.5 and 1.5 times amp on top of gaussian noise.
+	The 13C axis runs from 200 to 0 ppm and the DQ axis from 400 to 0 ppm, as in the ft files read by PyINETA.
+
+	Args:
+		peaks (ndarray): A 2D array with the 13C and DQ ppm values of the peaks.
+		n13 (int, optional): Size of the 13C axis. Defaults to 2048.
+		ndq (int, optional): Size of the DQ axis. Defaults to 1024.
+		extraPeaks (int, optional): Number of peaks added at random positions, outside any network. Defaults to 0.
+		noise (float, optional): Standard deviation of the noise, relative to amp. Defaults to 0.002.
+		amp (float, optional): Typical peak height. Defaults to 5e11.
+		width (float, optional): Standard deviation of the peaks in cells. Defaults to 1.5.
+		seed (int, optional): Seed of the random generator. Defaults to 0.
+
+	Returns:
+		ndarray : The (13C, DQ) intensity matrix.
+		1D-array : A 1D array with the 13C ppm values.
+		1D-array : A 1D array with the double quantum ppm values.
+	"""
+
+	rng=np.random.default_rng(seed)
+	Cppm=200.0*(1-np.arange(n13)/n13)
+	DQppm=400.0*(1-np.arange(ndq)/ndq)
+	In=rng.normal(0,amp*noise,(n13,ndq)).astype(np.float32)
+	extra=np.column_stack((rng.uniform(5,195,extraPeaks),rng.uniform(10,390,extraPeaks)))
+	half=int(np.ceil(4*width))
+	for c, dq in np.vstack((np.asarray(peaks,dtype=float).reshape(-1,2),extra)):
+		(i,j)=((200-c)/200*n13,(400-dq)/400*ndq)
+		(si,sj)=(slice(max(int(i)-half,0),min(int(i)+half+1,n13)),slice(max(int(j)-half,0),min(int(j)+half+1,ndq)))
+		(ii,jj)=np.ogrid[si,sj]
+		In[si,sj]+=(amp*rng.uniform(0.5,1.5)*np.exp(-((ii-i)**2+(jj-j)**2)/(2*width**2))).astype(np.float32)
+	return(In,Cppm,DQppm)
+
+def make1D (shifts,n=65536,noise=0.01,amp=1e7,width=4.0,seed=0):
+	"""Build a synthetic 1D 13C spectrum.
+
+	Args:
+		shifts (1D-array): The 13C ppm values of the peaks.
+		n (int, optional): Size of the 13C axis. Defaults to 65536.
+		noise (float, optional): Standard deviation of the noise, relative to amp. Defaults to 0.01.
+		amp (float, optional): Typical peak height. Defaults to 1e7.
+		width (float, optional): Standard deviation of the peaks in points. Defaults to 4.0.
+		seed (int, optional): Seed of the random generator. Defaults to 0.
+
+	Returns:
+		ndarray : A 1D array with the intensities.
+	"""
+
+	rng=np.random.default_rng(seed)
+	In=rng.normal(0,amp*noise,n).astype(np.float32)
+	half=int(np.ceil(4*width))
+	for c in np.asarray(shifts,dtype=float):
+		i=(200-c)/200*n
+		si=slice(max(int(i)-half,0),min(int(i)+half+1,n))
+		ii=np.arange(si.start,si.stop)
+		In[si]+=(amp*rng.uniform(0.5,1.5)*np.exp(-(ii-i)**2/(2*width**2))).astype(np.float32)
+	return(In)
+
+def writeFt (filename,data,widths):
+	"""Write an intensity array as an NMRPipe ft file.
+
+	Every axis runs from its width down to 0 ppm at a 150 MHz observe frequency.
+
+	Args:
+		filename (str): Output ft filename.
+		data (ndarray): The intensities in file order, the DQ axis first for 2D spectra.
+		widths (list): Width in ppm of every axis, in file order.
+	"""
+
+	udic=ng.fileiobase.create_blank_udic(data.ndim)
+	for d, (size, ppm) in enumerate(zip(data.shape,widths)):
+		udic[d].update(size=size,complex=False,sw=ppm*150.0,obs=150.0,car=ppm/2*150.0,label="C%d" % (d),encoding='states' if d < data.ndim-1 else 'direct',time=False,freq=True)
+	ng.pipe.write(filename,ng.pipe.create_dic(udic),np.ascontiguousarray(data,dtype=np.float32),overwrite=True)
@@ -11,14 +11,20 @@ Use gen_pyINETAdb.py -h for options.
 """
 import os
 import re
+import hashlib
 import sys
 import json
 from random import *
+import matplotlib
+matplotlib.use('Agg')	# Images are only written to files
 import matplotlib.pyplot as plt
 import matplotlib.lines as lines
 from argparse import ArgumentParser
 from argparse import FileType
+from functools import partial
+from multiprocessing import Pool
 import pynmrstar
+import pyineta.database as database
 
 def list_files(directory, extension):
     filelist=list(f for f in os.listdir(directory) if f.endswith('.' + extension))
@@ -155,113 +161,235 @@ def compileEntry(dbObj,num,ct,bugreport):
 	
 	return(uniqID,dbEntry)
 
-def plot_db(path,dbfile,file=False):
+_figure=None
+
+# Default (size in inches, dpi) of the database images. Vector images keep the original large canvas, png images use a canvas Agg can rasterize
+imageDefaults={'eps':(70,1800),'svg':(70,1800),'png':(8,300)}
+maxPixels=2**16	# Agg cannot draw images this wide or wider
+
+def init_figure(size=70):
+	# Build the figure template once per process; entries only replace the plotted lines and the title
+	global _figure
+	scale=size/70.0
+	fig=plt.figure(figsize=(size, size)) # This increases resolution
+	ax = fig.add_subplot(111)
+	ax.set_xlim([0,200])
+	ax.set_ylim([0,400])
+	ax.set_ylabel('Double Quantum', fontsize=80*scale)
+	ax.set_xlabel('13C', fontsize=80*scale)
+	title=ax.set_title('Title', fontsize=80*scale)	# Placeholder so the layout leaves room for the entry names
+	ax.tick_params(axis='both', which='major', labelsize=60*scale)
+	ax.invert_xaxis()
+	ax.invert_yaxis()
+	plt.tight_layout(pad=5*scale, w_pad=0.5, h_pad=1.0)
+	_figure=(fig,ax,title,scale)
+
+def plot_entry(item,dirname,imgformat='eps',dpi=1800):
+	# Draw the networks of a single database entry on the figure template
+	(key,networks)=item
+	(fig,ax,title,scale)=_figure
+	for line in list(ax.lines):
+		line.remove()
+	sname=image_name(key)
+	imgname=dirname+sname+'.'+imgformat
+	X=[]
+	Y=[]
+	for Net in networks:
+		for j in range(0,len(Net[0][1])):
+			x1=Net[0][1][j][0]
+			x2=Net[1][1][j][0]
+			y1=Net[0][1][j][1]
+			y2=Net[1][1][j][1]
+			if x1 in X:
+				x3=x1
+				y3=Y[X.index(x1)]
+				ax.plot([x1,x3],[y1,y3],color='0.45', linestyle='--', linewidth=2*scale)
+				#get x1,y1
+			X.append(x1)
+			Y.append(y1)
+			if x2 in X:
+				x3=x2
+				y3=Y[X.index(x2)]
+				ax.plot([x2,x3],[y2,y3],color='0.45', linestyle='--', linewidth=2*scale)
+				#get x2,y2
+			X.append(x2)
+			Y.append(y2)
+			ax.plot([x1,x2],[y1,y2],color='0.45', linestyle='--', linewidth=2*scale)
+	ax.plot(X,Y,'bo', markersize=20*scale)
+	title.set_text(sname)
+	fig.savefig(imgname,format=imgformat,dpi=dpi)
+	return(imgname)
+
+def plot_db(path,dbfile,file=False,imgformat='eps',size=None,dpi=None,procs=1):
+	# Draw the images of all database entries; size and dpi default to the imageDefaults of the image format
+	(size,dpi)=(size or imageDefaults[imgformat][0],dpi or imageDefaults[imgformat][1])
+	if imgformat == 'png' and size*dpi >= maxPixels:
+		exit("ERROR: Image size %g in at %d dpi is %d pixels wide. png images must be less than %d pixels wide." % (size,dpi,size*dpi,maxPixels))
 	if (file):
-		with open(dbfile, 'r') as json_file:
-			json_data = json.load(json_file)
+		json_data = database.loadDatabase(dbfile)
 	else:
 		json_data=dbfile
-	ct=0
 	dirname=path+"/db_images_constXYlim/"
 	if not os.path.exists(dirname):
 		os.makedirs(dirname)
-	for i in json_data:
-		ct+=1
-		name=i.replace('::','-')
-		sname=name.replace('/','-')
-		imgname=dirname+sname
-		imgname+='.eps'
-		X=[]
-		Y=[]
-		fig=plt.figure(figsize=(70, 70)) # This increases resolution
-		ax = fig.add_subplot(111)
-		ax.set_xlim([0,200])
-		ax.set_ylim([0,400])
-		for Net in json_data[i]['Networks']:
-			Id1=Net[0].pop(0)
-			Id2=Net[1].pop(0)
-			for j in range(0,len(Net[0][0])):
-				x1=Net[0][0][j][0]
-				x2=Net[1][0][j][0]
-				y1=Net[0][0][j][1]
-				y2=Net[1][0][j][1]
-				if x1 in X:
-					x3=x1
-					y3=Y[X.index(x1)]
-					ax.plot([x1,x3],[y1,y3],color='0.45', linestyle='--', linewidth=2)
-					#get x1,y1
-				X.append(x1)
-				Y.append(y1)
-				if x2 in X:
-					x3=x2
-					y3=Y[X.index(x2)]
-					ax.plot([x2,x3],[y2,y3],color='0.45', linestyle='--', linewidth=2)
-					#get x2,y2
-				X.append(x2)
-				Y.append(y2)
-				ax.plot([x1,x2],[y1,y2],color='0.45', linestyle='--', linewidth=2)
-		ax.plot(X,Y,'bo', markersize=20)
-		ax.set_ylabel('Double Quantum', fontsize=80)
-		ax.set_xlabel('13C', fontsize=80)
-		ax.set_title(sname, fontsize=80)
-		ax.tick_params(axis='both', which='major', labelsize=60)
-		ax.invert_xaxis()
-		ax.invert_yaxis()
-		plt.tight_layout(pad=5, w_pad=0.5, h_pad=1.0)
-		fig.savefig(imgname,format='eps',dpi=1800)
-		plt.close(fig)
+	items=((i,json_data[i]['Networks']) for i in json_data)
+	draw=partial(plot_entry,dirname=dirname,imgformat=imgformat,dpi=dpi)
+	if procs > 1:
+		with Pool(procs,initializer=init_figure,initargs=(size,)) as pool:
+			for imgname in pool.imap_unordered(draw,items,chunksize=8):
+				pass
+	else:
+		init_figure(size)
+		for item in items:
+			draw(item)
+		plt.close(_figure[0])
 
-def main(args):	
-	files=list_files(args.targetdir,"str")
-	inetadb={}
-	ct=0
-	for file in files:
+def parse_entry(fileloc,debug=False):
+	# Parse a single NMR star file; returns the parsed entry or the failed stage and its reason
+	stage="read"
+	if (debug):
+		print("#########################")
+		print("###   Entry details   ###")
+		print("#########################")
+		print("##File name:",fileloc)
+	try:
+		entry=pyinetadb(fileloc)
+		stage="get_entry_info"
+		entry.get_entry_info()
+		if (debug):
+			print("#Entry info:",entry.entryID,entry.entryTitle,entry.entryVersion)
+			print("#Solvents:",len(entry.entrySolvent),"==>",entry.entrySolvent)
+		stage="get_shifts"
+		entry.get_shifts()
+		if (debug):
+			print("#Shifts:",len(entry.shifts),"==>",entry.shifts)
+		stage="get_bonds"
+		entry.get_bonds()
+		if (debug):
+			print("#Bonds:",len(entry.bonds),"==>",entry.bonds)
+		stage="build_network"
+		entry.build_network()
+		if (debug):
+			print("#Networks:",len(entry.networks),"==>",entry.networks)
+			for i,val in enumerate(entry.networks):
+				print("\t",i,"==========")
+				print("\t",entry.shifts[i])
+				print("\t",entry.bonds[i])
+				print("\t",entry.networks[i])
+		stage="get_ambig"
+		entry.get_ambig()
+		if (debug):
+			print("#Ambiguity:",len(entry.ambiguity),"==>",entry.ambiguity)
+	except Exception as err:
+		return(None,(stage,repr(err)))
+	entry.pynmrEntry=None	# Only the extracted values are sent back to the main process
+	return(entry,None)
+
+def parse_entries(filelocs,procs=1,debug=False):
+	# Parse NMR star files in order, on a process pool if procs > 1
+	if procs>1:
+		with Pool(procs) as pool:
+			for res in pool.imap(partial(parse_entry,debug=debug),filelocs,chunksize=4):
+				yield res
+	else:
+		for fileloc in filelocs:
+			yield parse_entry(fileloc,debug)
+
+def file_hash(fileloc):
+	# Content hash of a source file for the incremental build manifest
+	sha=hashlib.sha256()
+	with open(fileloc, 'rb') as inf:
+		for block in iter(lambda: inf.read(1<<20), b''):
+			sha.update(block)
+	return(sha.hexdigest())
+
+def image_name(key):
+	# Image filename (without extension) used for a database entry
+	name=key.replace('::','-')
+	return(name.replace('/','-'))
+
+def compile_files(files,targetdir,ct,procs=1,debug=False):
+	# Parse and compile NMR star files into per-file records, numbering entries from ct+1
+	records={}
+	filelocs=[targetdir+"/"+file for file in files]
+	for file,(entry,failed) in zip(files,parse_entries(filelocs,procs,debug)):
 		ct+=1
-		if (args.debug):
-			print("#########################")
-			print("###   Entry details   ###")
-			print("#########################")
-			print("##Entry number:",ct," || File name:",file)
-		fileloc=args.targetdir+"/"+file
+		record={"sha256":file_hash(targetdir+"/"+file),"entries":{},"failed":None}
+		records[file]=record
+		if failed is not None:
+			print("Skipped %s !!!" % (file))
+			record["failed"]=list(failed)
+			continue
+		if (debug):
+			print("############   Compiling entry information for entry number",ct,"(",file,")  ############")
 		try:
-			entry=pyinetadb(fileloc)
-			entry.get_entry_info()
-			if (args.debug):
-				print("#Entry info:",entry.entryID,entry.entryTitle,entry.entryVersion)
-				print("#Solvents:",len(entry.entrySolvent),"==>",entry.entrySolvent)
-			entry.get_shifts()
-			if (args.debug):
-				print("#Shifts:",len(entry.shifts),"==>",entry.shifts)
-			entry.get_bonds()
-			if (args.debug):
-				print("#Bonds:",len(entry.bonds),"==>",entry.bonds)
-			entry.build_network()
-			if (args.debug):
-				print("#Networks:",len(entry.networks),"==>",entry.networks)
-				for i,val in enumerate(entry.networks):
-					print("\t",i,"==========")
-					print("\t",entry.shifts[i])
-					print("\t",entry.bonds[i])
-					print("\t",entry.networks[i])
-			entry.get_ambig()
-			if (args.debug):
-				print("#Ambiguity:",len(entry.ambiguity),"==>",entry.ambiguity)
-				print("############   Compiling entry information   ############")
 			for i in range(0,len(entry.entrySolvent)):
 				if (i>0 and i<len(entry.entrySolvent)):
 					ct+=1 
-				(key,dbitems)=compileEntry(entry,i,ct,args.debug)
-				inetadb[key]=dbitems
-
-		except:
+				(key,dbitems)=compileEntry(entry,i,ct,debug)
+				record["entries"][key]=dbitems
+		except Exception as err:
 			print("Skipped %s !!!" % (file))
+			record["failed"]=["compileEntry",repr(err)]
+	return(records,ct)
 
+def main(args):	
+	files=list_files(args.targetdir,"str")
 	outfilename=str(args.outdir)+"/"+str(args.filename)
-	with open(outfilename, 'w') as outf1:
-		json.dump(inetadb, outf1)
+	manifestname=outfilename+".manifest.json"
+	manifest={"last_ct":0,"files":{}}
+	if (args.update and os.path.isfile(manifestname)):
+		with open(manifestname, 'r') as inf:
+			manifest=json.load(inf)
+	old=manifest["files"]
+	if (args.update):	# Only reprocess added or changed files, numbering their entries after the last used ID
+		todo=[file for file in files if file not in old or old[file]["sha256"]!=file_hash(args.targetdir+"/"+file)]
+		ct=manifest["last_ct"]
+	else:
+		todo=files
+		ct=0
+	(records,ct)=compile_files(todo,args.targetdir,ct,args.procs,args.debug)
+	removed=[file for file in old if file not in files]
+	if (args.update):
+		print("Reused %d, processed %d and removed %d files." % (len(files)-len(todo),len(todo),len(removed)))
+
+	inetadb={}
+	failures=[]
+	for file in files:
+		record=records[file] if file in records else old[file]
+		records[file]=record
+		inetadb.update(record["entries"])
+		if record["failed"] is not None:
+			failures.append([file]+record["failed"])
+
+	if failures:
+		failfilename=outfilename+".failures.tsv"
+		with open(failfilename, 'w') as outf2:
+			outf2.write("#File\tStage\tReason\n")
+			for failed in failures:
+				outf2.write("\t".join(failed)+"\n")
+		print("Skipped %d of %d files. Reasons written to %s" % (len(failures),len(files),failfilename))
+
+	if args.dbformat == "npz":
+		database.writeCompiled(inetadb, outfilename)
+	else:
+		with open(outfilename, 'w') as outf1:
+			json.dump(inetadb, outf1)
+	with open(manifestname, 'w') as outf3:
+		json.dump({"last_ct":ct,"files":{file:records[file] for file in files}}, outf3)
 
 	if (args.plots):
-		plot_db(args.outdir,inetadb)
+		if (args.update):	# Drop images of removed entries and only draw the missing ones
+			dirname=str(args.outdir)+"/db_images_constXYlim/"
+			for file in old:
+				for key in old[file]["entries"]:
+					imgname=dirname+image_name(key)+'.'+args.imgformat
+					if key not in inetadb and os.path.isfile(imgname):
+						os.remove(imgname)
+			plotdb={key:inetadb[key] for key in inetadb if not os.path.isfile(dirname+image_name(key)+'.'+args.imgformat)}
+		else:
+			plotdb=inetadb
+		plot_db(args.outdir,plotdb,imgformat=args.imgformat,size=args.imgsize,dpi=args.imgdpi,procs=args.procs)
 
 if __name__ == '__main__':
 
@@ -269,12 +397,28 @@ if __name__ == '__main__':
 	parser.add_argument('-t', dest='targetdir', required=True,
 		 help='Target folder with all the NMR STAR (*.str) files downloaded from BMRB')
 	parser.add_argument('-f', dest='filename', required=True,
-		help='Filename for the json formatted INETA DB.')
+		help='Filename for the INETA DB.')
+	parser.add_argument('-F', '--format', dest='dbformat', choices=['json','npz'], default='json',
+		help='Format of the INETA DB: json or npz, a compiled columnar format that loads much faster (Defaults to json).')
 	parser.add_argument('-o', dest='outdir', default=os.getcwd(),
 		help='Output directory for the database build.(Defaults to current directory.)')
-	parser.add_argument('-p', dest='plots', action="store_true", default=True,
+	parser.add_argument('-p', dest='plots', action="store_false", default=True,
 		help='Use this flag if you do not want to generate images for all entries in the database (Defaults to True).')
+	parser.add_argument('--img-format', dest='imgformat', choices=['eps','png','svg'], default='eps',
+		help='Format of the database images: eps, png or svg (Defaults to eps).')
+	parser.add_argument('--img-size', dest='imgsize', type=float, default=None,
+		help='Width and height of the database images in inches. Fonts, lines and markers are scaled with it (Defaults to 70 for eps and svg, 8 for png).')
+	parser.add_argument('--img-dpi', dest='imgdpi', type=int, default=None,
+		help='Resolution of the database images (Defaults to 1800 for eps and svg, 300 for png). png images must be less than 65536 pixels wide.')
+	parser.add_argument('-u', dest='update', action="store_true", default=False,
+		help='Incrementally update an existing database build in the output directory. Only added or changed files are reprocessed and only their images are regenerated.')
+	parser.add_argument('-j', dest='procs', type=int, default=1,
+		help='Number of processes used to parse the NMR STAR files and draw the database images (Defaults to 1).')
 	parser.add_argument('-d', dest='debug', action="store_true", default=False, required=False,
 		help='Use this option to run the script in debug mode. Generates output for every step to track errors.')
 	args = parser.parse_args()
+	args.imgsize=args.imgsize or imageDefaults[args.imgformat][0]
+	args.imgdpi=args.imgdpi or imageDefaults[args.imgformat][1]
+	if args.imgformat == 'png' and args.imgsize*args.imgdpi >= maxPixels:
+		parser.error("--img-size %g at --img-dpi %d gives %d pixel wide png images. Agg can only draw images less than %d pixels wide." % (args.imgsize,args.imgdpi,args.imgsize*args.imgdpi,maxPixels))
 	main(args)
\ No newline at end of file
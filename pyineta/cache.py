@@ -0,0 +1,155 @@
+"""Functions for caching the results of the PyINETA steps.
+
+This includes the step cache used by PyINETA to reuse the results of earlier steps between runs.
+Every step result is stored in its own file named after a key built from the input file hash and the parameters of that step and all the steps before it.
+Includes the following functions:
+	* StepCache class - A directory of step results with least recently used eviction.
+		* get - Get a cached step result.
+		* put - Store a step result and evict the least recently used results above the size limit.
+		* evict - Remove the least recently used step results until the cache fits in maxBytes.
+		* fileDigest - Get the sha256 hash of an input file.
+	* stepKey - Build the cache key for a step.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+
+FORMAT=4	# Bump to invalidate cached results when the stored step results change
+
+class StepCache:
+	"""A directory of step results with least recently used eviction.
+
+	Attributes:
+		directory (str): Path to the cache folder.
+		maxBytes (int): Maximum total size of the cached step results. Least recently used results are removed above this size.
+	"""
+
+	def __init__(self, directory, maxBytes):
+		"""The __init__ method.
+
+		Args:
+			directory (str): Path to the cache folder. Created if it does not exist.
+			maxBytes (int): Maximum total size of the cached step results.
+		"""
+
+		self.directory=directory
+		self.maxBytes=maxBytes
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+	def _path(self, key):
+		return(os.path.join(self.directory,key+".pickle"))
+
+	def get(self, key):
+		"""Get a cached step result.
+
+		Args:
+			key (str): The step key.
+
+		Returns:
+			The cached step result, or None if it is not in the cache or cannot be read back.
+		"""
+
+		filename=self._path(key)
+		try:
+			with open(filename, 'rb') as handle:
+				value=pickle.load(handle)
+			os.utime(filename)	# Mark as recently used
+		except Exception:	# Missing, truncated or corrupt results are run again
+			return(None)
+		return(value)
+
+	def put(self, key, value):
+		"""Store a step result and evict the least recently used results above the size limit.
+
+		Args:
+			key (str): The step key.
+			value: The step result.
+		"""
+
+		filename=self._path(key)
+		tmpname="%s.%d.tmp" % (filename,os.getpid())
+		with open(tmpname, 'wb') as handle:
+			pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmpname,filename)	# Readers never see a partially written result
+		self.evict(keep=filename)
+
+	def evict(self, keep=None):
+		"""Remove the least recently used step results until the cache fits in maxBytes.
+
+		Args:
+			keep (str, optional): A filename that is never removed. Defaults to None.
+		"""
+
+		entries=[]
+		for name in os.listdir(self.directory):
+			if not name.endswith(".pickle"):
+				continue
+			filename=os.path.join(self.directory,name)
+			try:
+				st=os.stat(filename)
+			except FileNotFoundError:
+				continue
+			entries.append((st.st_mtime,st.st_size,filename))
+		total=sum(i[1] for i in entries)
+		for (mtime,size,filename) in sorted(entries):
+			if total <= self.maxBytes:
+				break
+			if filename == keep:
+				continue
+			try:
+				os.remove(filename)
+			except FileNotFoundError:
+				pass
+			total-=size
+
+	def fileDigest(self, filename):
+		"""Get the sha256 hash of an input file.
+
+		Hashes are remembered by path, size and modification time so unchanged files are not read again.
+
+		Args:
+			filename (str): The input filename.
+
+		Returns:
+			str : The hex digest of the file contents.
+		"""
+
+		memoFile=os.path.join(self.directory,"digests.json")
+		try:
+			with open(memoFile, 'r') as handle:
+				memo=json.load(handle)
+		except (OSError, ValueError):
+			memo={}
+		path=os.path.abspath(filename)
+		st=os.stat(path)
+		stamp=[st.st_size,st.st_mtime_ns]
+		if path in memo and memo[path][:2] == stamp:
+			return(memo[path][2])
+		sha=hashlib.sha256()
+		with open(path, 'rb') as handle:
+			for block in iter(lambda: handle.read(1<<24), b''):
+				sha.update(block)
+		memo[path]=stamp+[sha.hexdigest()]
+		tmpname="%s.%d.tmp" % (memoFile,os.getpid())
+		with open(tmpname, 'w') as handle:
+			json.dump(memo, handle)
+		os.replace(tmpname,memoFile)
+		return(sha.hexdigest())
+
+def stepKey (parent,step,params):
+	"""Build the cache key for a step.
+
+	Args:
+		parent (str): Key of the previous step, or the hash of the input file for the first step.
+		step (str): The step name.
+		params (list): The parameters used by the step. Dicts are keyed the same whatever the order of their items.
+
+	Returns:
+		str : The step key.
+	"""
+
+	text=json.dumps([FORMAT,parent,step,params],default=str,sort_keys=True)
+	return(step+"-"+hashlib.sha256(text.encode()).hexdigest()[:32])
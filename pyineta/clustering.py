@@ -5,6 +5,9 @@ Includes the following functions:
 	* gather - Gather points along a given axis.
 	* splitY - Split groups of points based on threshold.
 	* centerMass - Find the center of mass for clustered points.
+	* gatherLabels - Label the clusters of an array of points gathered along a given axis.
+	* splitLabels - Split the clusters of an array of points based on threshold.
+	* centers - Find the center of mass for the clusters of an array of points.
 """
 
 import numpy as np
@@ -25,16 +28,11 @@ def gather (Points, thres, ax):
 	"""
 
 	sets = defaultdict(list)
-	sPts = sorted(Points, key=lambda tup: tup[ax]) # ax=0 for X, 1 for Y
-	i=0
-	sets[i].append(sPts.pop(0))
-	for elem in sPts:
-		minval=min(sets[i], key = lambda t: t[0])
-		if (abs(minval[ax]-elem[ax]) < float(thres)):
-			sets[i].append(elem)
-		else:
-			i=i+1
-			sets[i].append(elem)
+	if len(Points)==0:
+		return(sets)
+	(order,labels)=gatherLabels(np.asarray(Points,dtype=float),thres,ax)
+	for i, label in zip(order.tolist(),labels.tolist()):
+		sets[label].append(Points[i])
 	return(sets)
 
 def splitY (Points, thres, ax):
@@ -66,27 +64,111 @@ def splitY (Points, thres, ax):
 		i=i+1
 	return(sets)
 
-def centerMass (Clusters,metric):
+def centerMass (Clusters,metric,weights=None):
 	"""Find the center of mass for clustered points.
 
 	Args:
 		Clusters (dict): A dict mapping list of points to their cluster number.
-		metric (str): use "mean" or "median" as the method to find the center of mass for the clusters.
+		metric (str): use "mean", "median" or "weighted" as the method to find the center of mass for the clusters.
+		weights (dict, optional): Required with "weighted". A dict mapping list of intensities, parallel to the points, to their cluster number. Defaults to None.
+
+	Returns:
+		ndarray : An array of center of masses (peak centers) for all the clusters.
+	"""
+
+	clusts=list(Clusters.values())
+	if len(clusts)==0:
+		return(np.asarray([]))
+	P=np.asarray([v for clust in clusts for v in clust],dtype=float)
+	labels=np.repeat(np.arange(len(clusts)),[len(clust) for clust in clusts])
+	if weights is not None:
+		weights=np.asarray([w for k in Clusters for w in weights[k]],dtype=float)
+	return(centers(P,labels,metric,weights))
+
+def gatherLabels (P, thres, ax):
+	"""Label the clusters of an array of points gathered along a given axis.
+
+	Same clustering as gather: after sorting along the axis, a point joins the current cluster if it is within the threshold of the first point in the cluster.
+	The start of each cluster is found with a binary search from the first point of the previous cluster.
+
+	Args:
+		P (ndarray): An (N,2) array of points (x,y).
+		thres (float): Points found within this threshold are grouped into a single cluster.
+		ax (int): '0' indicates gathering along the 13C axis while '1' indicates gathering along the DQ axis.
+
+	Returns:
+		ndarray : Indices sorting the points along the axis.
+		ndarray : Cluster number of each sorted point.
+	"""
+
+	thres=float(thres)
+	order=np.argsort(P[:,ax],kind='stable')
+	vals=P[order,ax]
+	n=len(vals)
+	starts=np.zeros(n,dtype=bool)
+	i=0
+	while i < n:
+		starts[i]=True
+		j=int(np.searchsorted(vals,vals[i]+thres,side='left'))
+		while j < n and vals[j]-vals[i] < thres:	# Fix up rounding of vals[i]+thres against the exact test
+			j+=1
+		while j > i+1 and not (vals[j-1]-vals[i] < thres):
+			j-=1
+		i=max(j,i+1)
+	labels=np.cumsum(starts)-1
+	return(order,labels)
+
+def splitLabels (P, labels, thres, ax):
+	"""Split the clusters of an array of points based on threshold.
+
+	Same splitting as splitY: within each cluster the points are sorted along the axis and a new cluster starts wherever consecutive points are at least the threshold apart.
+
+	Args:
+		P (ndarray): An (N,2) array of points (x,y), ordered by cluster.
+		labels (ndarray): Cluster number of each point, as returned by gatherLabels.
+		thres (float): A distance threshold for splitting points into a different cluster.
+		ax (int): '0' indicates splitting along the 13C axis while '1' indicates splitting along the DQ axis.
+
+	Returns:
+		ndarray : Indices sorting the points by cluster and along the axis within each cluster.
+		ndarray : Cluster number of each sorted point after splitting.
+	"""
+
+	order=np.lexsort((P[:,ax],labels))
+	vals=P[order,ax]
+	starts=np.ones(len(vals),dtype=bool)
+	starts[1:]=(np.diff(labels[order])!=0) | (np.abs(np.diff(vals)) >= float(thres))
+	return(order,np.cumsum(starts)-1)
+
+def centers (P, labels, metric, weights=None):
+	"""Find the center of mass for the clusters of an array of points.
+
+	Args:
+		P (ndarray): An (N,2) array of points (x,y), ordered by cluster.
+		labels (ndarray): Cluster number of each point, numbered from 0 without gaps.
+		metric (str): use "mean", "median" or "weighted" as the method to find the center of mass for the clusters.
+		weights (ndarray, optional): Required with "weighted". Intensity of each point; the absolute values are used as weights. Defaults to None.
 
 	Returns:
 		ndarray : An array of center of masses (peak centers) for all the clusters.
 	"""
 
-	Center = []
-	C=[]
-	for k, clust in list(Clusters.items()):
-		if (metric == "mean"):
-			C1=sum(v[0] for v in clust) / float(len(clust))
-			C2=sum(v[1] for v in clust) / float(len(clust))
-		elif (metric =="median"):
-			C1=np.median([v[0] for v in clust])
-			C2=np.median([v[1] for v in clust])
-		C=(C1,C2)
-		Center.append(C)
-		C=[]
-	return(np.asarray(Center))
\ No newline at end of file
+	counts=np.bincount(labels)
+	if (metric == "mean"):
+		return(np.column_stack([np.bincount(labels,weights=P[:,k])/counts for k in (0,1)]))
+	if (metric == "weighted"):
+		if weights is None:
+			exit("ERROR: The weighted center of mass needs the intensities of the points.")
+		w=np.abs(np.asarray(weights,dtype=float))
+		total=np.bincount(labels,weights=w)
+		return(np.column_stack([np.bincount(labels,weights=w*P[:,k])/total for k in (0,1)]))
+	if (metric != "median"):
+		exit("ERROR: Unknown center of mass metric %s. Use either mean, median or weighted." % (metric))
+	starts=np.concatenate(([0],np.cumsum(counts)[:-1]))
+	lo=starts+(counts-1)//2
+	hi=starts+counts//2
+	Center=[]
+	for k in (0,1):
+		vals=P[np.lexsort((P[:,k],labels)),k]	# Sorted within each cluster
+		Center.append((vals[lo]+vals[hi])/2)
+	return(np.column_stack(Center))
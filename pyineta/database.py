@@ -0,0 +1,198 @@
+"""Functions for reading and writing the INETA database.
+
+This includes the functions used by PyINETA to load the INETA database either from the json file or from its compiled columnar format.
+The compiled format is an uncompressed npz file with flattened arrays for the entries, chemical shifts, bonds and network points, and a small string table.
+Its arrays are memory-mapped from the file, so they are only read when used and all processes opening the same file share them read-only.
+Includes the following functions:
+	* mapNpz - Memory-map the arrays of an uncompressed npz file.
+	* CompiledDb class - Read-only view of a compiled INETA database with the same layout as the json database.
+	* writeCompiled - Write the INETA database in the compiled format.
+	* loadDatabase - Load the INETA database from a json or a compiled file.
+"""
+
+import json
+import struct
+import zipfile
+import numpy as np
+from collections.abc import Mapping
+
+def mapNpz (filename):
+	"""Memory-map the arrays of an uncompressed npz file.
+
+	np.load cannot memory-map the arrays of an npz file. Members stored without compression are plain npy files inside the zip archive, so they are mapped at their offset in the file instead.
+	Compressed members are read into memory.
+
+	Args:
+		filename (str): The npz filename.
+
+	Returns:
+		dict : A dict mapping the array names to read-only arrays.
+	"""
+
+	arrays={}
+	with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as handle:
+		for info in zf.infolist():
+			name=info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+			if info.compress_type != zipfile.ZIP_STORED:
+				with zf.open(info) as member:
+					arrays[name]=np.lib.format.read_array(member,allow_pickle=False)
+				continue
+			handle.seek(info.header_offset)
+			(nameLen,extraLen)=struct.unpack('<HH',handle.read(30)[26:30])	# The local header can have another extra field than the central directory
+			handle.seek(info.header_offset+30+nameLen+extraLen)
+			version=np.lib.format.read_magic(handle)
+			if version == (1,0):
+				(shape,fortran,dtype)=np.lib.format.read_array_header_1_0(handle)
+			else:
+				(shape,fortran,dtype)=np.lib.format.read_array_header_2_0(handle)
+			if dtype.hasobject:
+				exit("ERROR: Compiled database %s holds python objects." % (filename))
+			if int(np.prod(shape)) == 0:
+				arrays[name]=np.zeros(shape,dtype=dtype)
+			else:
+				arrays[name]=np.memmap(filename,dtype=dtype,mode='r',offset=handle.tell(),shape=shape,order='F' if fortran else 'C')
+	return(arrays)
+
+class CompiledDb(Mapping):
+	"""Read-only view of a compiled INETA database with the same layout as the json database.
+
+	Entries are rebuilt as json-like dicts only when they are accessed, so the database opens without parsing every entry.
+	The arrays are memory-mapped with mapNpz. A pickled CompiledDb only holds the filename and maps the file again when it is unpickled, so worker processes share the pages instead of copies.
+
+	Attributes:
+		dbfile (str): The compiled INETA database filename.
+		strings (ndarray): The string table. All string columns hold positions in this table.
+		entryID (ndarray): InternalID of each entry.
+		entryName (ndarray): BMRBName of each entry.
+		entryVersion (ndarray): Version of each entry.
+		entrySolvent (ndarray): Solvent of each entry.
+		ambiguity (ndarray): Ambiguity score of each entry.
+		csEntry (ndarray): Entry number for each chemical shift value.
+		csAtom (ndarray): Atom label for each chemical shift value.
+		csVal (ndarray): The chemical shift values.
+		bondEntry (ndarray): Entry number for each bond.
+		bondAtoms (ndarray): The two atom labels for each bond.
+		netEntry (ndarray): Entry number for each network (a pair of bonded atoms).
+		sideNet (ndarray): Network number for each side (atom) of a network.
+		sideAtom (ndarray): Atom label for each side of a network.
+		pointSide (ndarray): Side number for each network point.
+		pointVal (ndarray): The 13C and DQ values of each network point.
+	"""
+
+	def __init__(self, dbfile):
+		"""The __init__ method.
+
+		Args:
+			dbfile (str): The compiled INETA database filename.
+		"""
+
+		self.dbfile=dbfile
+		for name, arr in mapNpz(dbfile).items():
+			setattr(self, name, arr)
+		self._index={str(self.strings[k]):e for e, k in enumerate(self.entryID)}
+		nEntry=len(self.entryID)
+		self._csStart=np.searchsorted(self.csEntry,np.arange(nEntry+1))
+		self._bondStart=np.searchsorted(self.bondEntry,np.arange(nEntry+1))
+		self._netStart=np.searchsorted(self.netEntry,np.arange(nEntry+1))
+		self._sideStart=np.searchsorted(self.sideNet,np.arange(len(self.netEntry)+1))
+		self._pointStart=np.searchsorted(self.pointSide,np.arange(len(self.sideNet)+1))
+
+	def __getstate__(self):	# Pickle by filename only
+		return({'dbfile':self.dbfile})
+
+	def __setstate__(self, state):
+		self.__init__(state['dbfile'])
+
+	def __len__(self):
+		return(len(self.entryID))
+
+	def __iter__(self):
+		return(iter(self._index))
+
+	def __contains__(self, key):
+		return(key in self._index)
+
+	def __getitem__(self, key):
+		e=self._index[key]
+		strings=self.strings
+		shifts={}
+		for a in range(self._csStart[e],self._csStart[e+1]):
+			shifts.setdefault(str(strings[self.csAtom[a]]),[]).append(float(self.csVal[a]))
+		bonds=[[str(strings[a]) for a in self.bondAtoms[b]] for b in range(self._bondStart[e],self._bondStart[e+1])]
+		networks=[]
+		for n in range(self._netStart[e],self._netStart[e+1]):
+			net=[]
+			for s in range(self._sideStart[n],self._sideStart[n+1]):
+				pts=self.pointVal[self._pointStart[s]:self._pointStart[s+1]].tolist()
+				net.append([str(strings[self.sideAtom[s]]),pts])
+			networks.append(net)
+		dbEntry={}
+		dbEntry["BMRBName"]=str(strings[self.entryName[e]])
+		dbEntry["InternalID"]=key
+		dbEntry["Version"]=str(strings[self.entryVersion[e]])
+		dbEntry["Solvent"]=str(strings[self.entrySolvent[e]])
+		dbEntry["ChemicalShifts"]=shifts
+		dbEntry["Bonds"]=bonds
+		dbEntry["Networks"]=networks
+		dbEntry["Ambiguity"]=float(self.ambiguity[e])
+		return(dbEntry)
+
+def writeCompiled (inetadb,outfilename):
+	"""Write the INETA database in the compiled format.
+
+	Args:
+		inetadb (dict): The INETA database in json format.
+		outfilename (str): Output filename (.npz).
+	"""
+
+	strings={}
+	def code(s):
+		return(strings.setdefault(s,len(strings)))
+	cols={k:[] for k in ('entryID','entryName','entryVersion','entrySolvent','ambiguity','csEntry','csAtom','csVal','bondEntry','bondAtoms','netEntry','sideNet','sideAtom','pointSide','pointVal')}
+	for e, i in enumerate(inetadb):
+		entry=inetadb[i]
+		cols['entryID'].append(code(i))
+		cols['entryName'].append(code(entry["BMRBName"]))
+		cols['entryVersion'].append(code(entry["Version"]))
+		cols['entrySolvent'].append(code(entry["Solvent"]))
+		cols['ambiguity'].append(entry["Ambiguity"])
+		for CS, CSlist in entry["ChemicalShifts"].items():
+			for val in CSlist:
+				cols['csEntry'].append(e)
+				cols['csAtom'].append(code(CS))
+				cols['csVal'].append(val)
+		for bond in entry["Bonds"]:
+			cols['bondEntry'].append(e)
+			cols['bondAtoms'].append([code(a) for a in bond])
+		for net in entry["Networks"]:
+			for side in net:
+				for pt in side[1]:
+					cols['pointSide'].append(len(cols['sideNet']))
+					cols['pointVal'].append(pt[:2])
+				cols['sideNet'].append(len(cols['netEntry']))
+				cols['sideAtom'].append(code(side[0]))
+			cols['netEntry'].append(e)
+	arrays={k:np.asarray(v,dtype=float if k in ('ambiguity','csVal','pointVal') else np.int64) for k, v in cols.items()}
+	arrays['bondAtoms']=arrays['bondAtoms'].reshape(-1,2)
+	arrays['pointVal']=arrays['pointVal'].reshape(-1,2)
+	arrays['strings']=np.asarray(list(strings),dtype=str)
+	with open(outfilename, 'wb') as outf:
+		np.savez(outf, **arrays)
+
+def loadDatabase (dbfile):
+	"""Load the INETA database from a json or a compiled file.
+
+	Args:
+		dbfile (str): The INETA database filename, either json or compiled.
+
+	Returns:
+		dict or CompiledDb : The INETA database.
+	"""
+
+	with open(dbfile, 'rb') as db_file:
+		magic=db_file.read(2)
+	if magic == b'PK':	# npz files are zip archives
+		return(CompiledDb(dbfile))
+	with open(dbfile, 'r') as json_file:
+		json_data = json.load(json_file)
+	return(json_data)
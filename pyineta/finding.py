@@ -4,18 +4,36 @@ This contains functions used by PyINETA to construct networks in the processed s
 Includes the following functions:
 	* findClosestPoints - Uses KDTree to find close points.
 	* mergeLevels - Merge points found in different iterations of peak picking.
+	* horzPairs - Find the indices of horizontally aligned pairs of points.
 	* horzAlign - Find horizontally aligned points.
 	* getPairs - Get pairs.
+	* UnionFind class - Disjoint sets of integer point indices.
+		* add - Add an item as a set of its own.
+		* find - Find the root item of the set holding an item.
+		* union - Merge the sets holding two items.
+		* groups - List the sets.
+	* NetworkLinks class - The networks and connected pairs of a set of points, grown one group of aligned points at a time.
+		* add - Connect a group of aligned points.
+		* networks - List the networks.
+		* pairArray - List the connected pairs.
+	* networkxOrder - List the networks with networkx, in the order used before the union-find.
+	* linkNetworks - Build the networks and the list of connected pairs in a single pass.
+	* pairIndex - Index the connected pairs by point.
+	* networkPairs - Find the connected pairs within a network.
 	* buildNetwork - Build network.
 	* listPairs - List all pairs of points that are part of a network.
 """
 
+import math
 import itertools
 import numpy as np
-import networkx as nx
 from collections import defaultdict
 from scipy import spatial as spatial
-import pyineta.clustering as clustering
+try:
+	import networkx as nx
+except ImportError:	# Only needed for the networkx network order
+	nx=None
+import pyineta.instrument as instrument
 
 def findClosestPoints (Pts,Qry):
 	"""Uses KDTree to find close points.
@@ -35,11 +53,14 @@ def findClosestPoints (Pts,Qry):
 	return(QryRes)
 
 
+@instrument.timed('mergeLevels',lambda out, args: {'merged_points':len(out)})
 def mergeLevels (Clist,levdist):
 	"""Merge points found in different iterations of peak picking.
 
 	This function is used to merge points found in multiple iterations of peak picking into a single array.
 	Points that are closer to each other than a defined threshold are merged into a single point.
+	Every point is compared with the closest merged point so far, found with a grid hash of cell size levdist that is updated as points are merged.
+	When several merged points are equally close, findClosestPoints picks one over all the merged points so the result is the same as with a KDTree query for every point.
 
 	Args:
 		Clist (dict): A dict mapping the iteration number of peak picking to a list of cluster centers for points found in that iteration.
@@ -49,22 +70,94 @@ def mergeLevels (Clist,levdist):
 		ndarray : A 2D array of merged points. 
 	"""
 
+	levdist=float(levdist)
+	cell=levdist if levdist > 0 else 1.0
 	mergedClistAll=np.vstack(list(Clist.values()))
-	mergedClist=Clist[list(Clist.keys())[0]]
+	merged=[]	# Merged points in the order they were added, None once merged again
+	grid=defaultdict(list)
+	def addPoint(x,y):
+		key=(math.floor(x/cell),math.floor(y/cell))
+		grid[key].append(len(merged))
+		merged.append((x,y,key))
+	for x, y in Clist[list(Clist.keys())[0]].tolist():
+		addPoint(x,y)
 	for k, C in list(Clist.items()):
-		for P in C:
-			res=findClosestPoints(mergedClist,P)
-			if (res[0]>float(levdist)):
-				mergedClist=np.vstack([mergedClist, P])
+		for x, y in np.asarray(C,dtype=float).tolist():
+			(cx,cy)=(math.floor(x/cell),math.floor(y/cell))
+			best=None
+			for gx in (cx-1,cx,cx+1):
+				for gy in (cy-1,cy,cy+1):
+					for idx in grid.get((gx,gy),()):
+						(mx,my,_)=merged[idx]
+						dist=math.sqrt((mx-x)**2+(my-y)**2)
+						if best is None or dist<best[0]:
+							(best,tied)=((dist,idx),False)
+						elif dist==best[0]:
+							tied=True
+			if best is not None and tied and best[0]<=levdist:	# Let the KDTree break ties so the same point is merged as by findClosestPoints
+				alive=[i for i, m in enumerate(merged) if m is not None]
+				res=findClosestPoints(np.array([merged[i][:2] for i in alive],dtype=float),[x,y])
+				best=(res[0],alive[res[1]])
+			if best is None or best[0]>levdist:
+				addPoint(x,y)
 			else:
-				avgP=np.mean([mergedClist[res[1]], P],0)
-				mergedClist = np.delete(mergedClist, (res[1]), axis=0)
-				mergedClist=np.vstack([mergedClist, avgP])	
+				(mx,my,key)=merged[best[1]]
+				grid[key].remove(best[1])
+				merged[best[1]]=None
+				addPoint((mx+x)/2,(my+y)/2)
+	mergedClist=np.array([(x,y) for x, y, key in filter(None,merged)],dtype=float).reshape(-1,2)
 	mergedClist.view('i8,i8').sort(order=['f0'], axis=0) # Sort numerically based on 1st column
 	print("Step3.1==> Merging levels: ",mergedClistAll.shape[0]," Points merged to ",mergedClist.shape[0])
 	return(mergedClist)
 
-def horzAlign (P,threshold1,threshold2,threshold3):
+def horzPairs (P,threshold1,threshold2,threshold3):
+	"""Find the indices of horizontally aligned pairs of points.
+
+	Points are sorted along the DQ axis and split into groups where consecutive points are further apart than threshold1.
+	All pairs within a group are then tested at once, one offset within the group at a time, for the sum and diagonal symmetry rules.
+
+	Args:
+		P (ndarray): A 2D array of final merged points.
+		threshold1 (float): Threshold to split the merged points along the DQ axis.
+		threshold2 (float): Threshold to check if the sum of 13C ppm values for two points equals their DQ ppm or not.
+		threshold3 (float): Threshold to check of the 2 points are equidistant from the diagonal.
+
+	Returns:
+		ndarray : A 2D array with the indices in P of the aligned pairs of points, ordered by their DQ groups.
+		int : Number of candidate pairs tested.
+	"""
+
+	P=np.asarray(P)
+	order=np.argsort(P[:,1],kind='stable')
+	X=P[order,0]
+	Y=P[order,1]
+	group=np.concatenate(([0],np.cumsum(~(np.abs(np.diff(Y))<float(threshold1)))))
+	I=[]
+	J=[]
+	tested=0
+	for off in range(1,len(order)):
+		a=np.nonzero(group[:-off]==group[off:])[0]
+		if len(a)==0:
+			break
+		b=a+off
+		tested+=len(a)
+		meanY=(Y[a]+Y[b])/2
+		sumX=X[a]+X[b]
+		D1=np.abs(X[a]-Y[a]/2) # {diag:y=2x;mid-point:(y/2,y) so dist=x-y/2}
+		D2=np.abs(X[b]-Y[b]/2)
+		keep=(np.abs(meanY-sumX)<=float(threshold2)) & (np.abs(D1-D2)<=float(threshold3))
+		I.append(a[keep])
+		J.append(b[keep])
+	if I:
+		I=np.concatenate(I)
+		J=np.concatenate(J)
+	else:
+		I=J=np.zeros(0,dtype=int)
+	sel=np.lexsort((J,I))
+	return(np.column_stack((order[I[sel]],order[J[sel]])),tested)
+
+@instrument.timed('horzAlign',lambda out, args: {'horizontal_pairs':len(out[0] if isinstance(out,tuple) else out)})
+def horzAlign (P,threshold1,threshold2,threshold3,indices=False):
 	"""Find horizontally aligned points.
 
 	This function starts building the INETA networks by finding the horizontally aligned points, i.e. points with same double quantum ppm values as defined by the thresholds.
@@ -75,28 +168,21 @@ def horzAlign (P,threshold1,threshold2,threshold3):
 		threshold1 (float): Threshold to split the merged points along the DQ axis.
 		threshold2 (float): Threshold to check if the sum of 13C ppm values for two points equals their DQ ppm or not.
 		threshold3 (float): Threshold to check of the 2 points are equidistant from the diagonal.
+		indices (bool, optional): Also return the indices in P of the aligned pairs. Defaults to False.
 
 	Returns:
 		dict : A dict mapping horizontally aligned peaks to their indices.
+		ndarray : Only if indices is True. A 2D array with the indices in P of the aligned pairs of points, in the same order.
 	"""
 
-	ct=0
-	Pd=dict()
-	Pd[0]=P
-	AlnY=clustering.splitY(Pd,threshold1,1)
+	(pairs,tested)=horzPairs(P,threshold1,threshold2,threshold3)
+	print("Step3.1==> Horizontal alignment: ",tested," candidate pairs tested, ",len(pairs)," pairs aligned")
 	filtI=defaultdict(list)
-	for i, lst in list(AlnY.items()):
-		if (len(lst)>=2):
-			for (a, b) in itertools.combinations(enumerate(lst), 2):
-				meanY=(a[1][1]+b[1][1])/2
-				sumX=a[1][0]+b[1][0]
-				if (abs(meanY-sumX)<=float(threshold2)):
-					D1=abs(a[1][0]-a[1][1]/2) # {diag:y=2x;mid-point:(y/2,y) so dist=x-y/2}
-					D2=abs(b[1][0]-b[1][1]/2)
-					if (abs(D1-D2)<=float(threshold3)):
-						filtI[ct].append(a[1])
-						filtI[ct].append(b[1])
-						ct+=1
+	for ct, (a, b) in enumerate(pairs):
+		filtI[ct].append(P[a])
+		filtI[ct].append(P[b])
+	if indices:
+		return (filtI,pairs)
 	return (filtI)
 
 def getPairs(lst):
@@ -118,6 +204,228 @@ def getPairs(lst):
 		first = curr
 	yield curr, second
 
+class UnionFind:
+	"""Disjoint sets of integer point indices.
+
+	Sets are merged by size and paths are halved on lookup, so adding one more pair to the networks costs close to constant time.
+
+	Attributes:
+		parent (dict): A dict mapping every item to its parent item. Root items are their own parent.
+		size (dict): A dict mapping every root item to the size of its set.
+		order (list): All items in the order they were first added.
+	"""
+
+	def __init__(self):
+		"""The __init__ method."""
+
+		self.parent={}
+		self.size={}
+		self.order=[]
+
+	def add(self, x):
+		"""Add an item as a set of its own. Items already added are left unchanged.
+
+		Args:
+			x (int): The item.
+		"""
+
+		if x not in self.parent:
+			self.parent[x]=x
+			self.size[x]=1
+			self.order.append(x)
+
+	def find(self, x):
+		"""Find the root item of the set holding an item.
+
+		Args:
+			x (int): The item.
+
+		Returns:
+			int : The root item.
+		"""
+
+		parent=self.parent
+		while parent[x] != x:
+			parent[x]=parent[parent[x]]
+			x=parent[x]
+		return(x)
+
+	def union(self, a, b):
+		"""Merge the sets holding two items. Items not added yet are added first.
+
+		Args:
+			a (int): The first item.
+			b (int): The second item.
+
+		Returns:
+			int : The root item of the merged set.
+		"""
+
+		self.add(a)
+		self.add(b)
+		(ra,rb)=(self.find(a),self.find(b))
+		if ra == rb:
+			return(ra)
+		if self.size[ra] < self.size[rb]:
+			(ra,rb)=(rb,ra)
+		self.parent[rb]=ra
+		self.size[ra]+=self.size.pop(rb)
+		return(ra)
+
+	def groups(self):
+		"""List the sets.
+
+		Returns:
+			list : List of lists of items. Sets are ordered by their first added item and items by the order they were added.
+		"""
+
+		groups={}
+		for x in self.order:
+			groups.setdefault(self.find(x),[]).append(x)
+		return(list(groups.values()))
+
+class NetworkLinks:
+	"""The networks and connected pairs of a set of points, grown one group of aligned points at a time.
+
+	Points are keyed on integer indices instead of their float coordinates. Points in P with the same coordinates are the same peak and are always given by the index of the first one.
+	The union-find is kept between groups, so adding one more pair does not rebuild the networks found so far.
+
+	Attributes:
+		P (ndarray): A 2D array of points.
+		order (str): "index" lists the points of every network by increasing index in P, "networkx" in the order of the networkx connected components used before.
+		key (list): Key of every point in P. Points with the same coordinates have the same key.
+		first (dict): A dict mapping every key added so far to the first index in P with that key.
+		uf (UnionFind): The networks as sets of point indices.
+		groups (list): The groups of point indices added so far.
+		pairs (list): All connected pairs of point indices, in the order of listPairs.
+	"""
+
+	def __init__(self, P, order="index"):
+		"""The __init__ method.
+
+		Args:
+			P (ndarray): A 2D array of points.
+			order (str, optional): "index" or "networkx". Defaults to "index".
+		"""
+
+		if order not in ("index","networkx"):
+			exit("ERROR: Unknown network order %s. Use either index or networkx." % (order))
+		if order == "networkx" and nx is None:
+			exit("ERROR: Network order networkx needs the networkx package. Install it or use the index order.")
+		self.P=np.asarray(P,dtype=float).reshape(-1,2)
+		self.order=order
+		self.key=np.unique(self.P,axis=0,return_inverse=True)[1].ravel().tolist()
+		self.first={}
+		self.uf=UnionFind()
+		self.groups=[]
+		self.pairs=[]
+
+	def add(self, grp):
+		"""Connect a group of aligned points.
+
+		Args:
+			grp (list): Indices in P of the vertically aligned points, or of a horizontally aligned pair.
+		"""
+
+		pts=[self.first.setdefault(self.key[i],i) for i in grp]
+		for i in pts:
+			self.uf.union(pts[0],i)
+		self.pairs.extend(itertools.combinations(pts,2))
+		self.groups.append(pts)
+
+	def networks(self):
+		"""List the networks.
+
+		Returns:
+			list : List of lists of indices in P of the points belonging to a network. Networks are in the order they first appear in the groups.
+		"""
+
+		if self.order == "networkx":
+			return(networkxOrder(self.P,self.groups))
+		return([sorted(net) for net in self.uf.groups()])
+
+	def pairArray(self):
+		"""List the connected pairs.
+
+		Returns:
+			ndarray : A 2D array with the indices in P of all connected pairs of points, in the order of listPairs.
+		"""
+
+		return(np.asarray(self.pairs,dtype=int).reshape(-1,2))
+
+def networkxOrder (P,groups):
+	"""List the networks with networkx, in the order used before the union-find.
+
+	Every group is linked as a ring of consecutive points in a graph keyed on the point coordinates, as buildNetwork did.
+	Points of a network come in the iteration order of the set returned by networkx.connected_components.
+
+	Args:
+		P (ndarray): A 2D array of points.
+		groups (list): List of lists of indices in P of the aligned points, with equal points given by the same index.
+
+	Returns:
+		list : List of lists of indices in P of the points belonging to a network.
+	"""
+
+	g=nx.Graph()
+	index={}
+	for grp in groups:
+		pts=[tuple(P[i]) for i in grp]
+		index.update(zip(pts,grp))
+		for edge in getPairs(pts):
+			g.add_edge(*edge)
+	return([[index[pt] for pt in net] for net in nx.connected_components(g)])
+
+@instrument.timed('linkNetworks',lambda out, args: {'networks':len(out[0]),'connected_pairs':len(out[1])})
+def linkNetworks (P,groups,order="index"):
+	"""Build the networks and the list of connected pairs in a single pass.
+
+	Args:
+		P (ndarray): A 2D array of points.
+		groups (list): List of lists of indices in P of the vertically aligned points followed by the horizontally aligned pairs.
+		order (str, optional): Order of the points within a network, "index" or "networkx". See NetworkLinks. Defaults to "index".
+
+	Returns:
+		list : List of lists of indices in P of the points belonging to a network. Networks are in the order they first appear in groups.
+		ndarray : A 2D array with the indices in P of all connected pairs of points, in the order of listPairs.
+		NetworkLinks : The networks, to add more pairs to.
+	"""
+
+	links=NetworkLinks(P,order)
+	for grp in groups:
+		links.add(grp)
+	return(links.networks(),links.pairArray(),links)
+
+def pairIndex (pairs,nPoints):
+	"""Index the connected pairs by point.
+
+	Args:
+		pairs (ndarray): A 2D array with the indices of the connected pairs of points, as returned by linkNetworks.
+		nPoints (int): Number of points.
+
+	Returns:
+		tuple : Arrays (start,pos) where pos[start[p]:start[p+1]] are the positions in pairs of the pairs that include point p.
+	"""
+
+	ends=np.asarray(pairs,dtype=int).reshape(-1,2).ravel()
+	order=np.argsort(ends,kind='stable')
+	start=np.searchsorted(ends[order],np.arange(nPoints+1))
+	return((start,order//2))
+
+def networkPairs (index,net):
+	"""Find the connected pairs within a network.
+
+	Args:
+		index (tuple): The (start,pos) arrays returned by pairIndex.
+		net (list): Indices of the points belonging to the network.
+
+	Returns:
+		ndarray : Sorted positions of the pairs that include any point of the network.
+	"""
+
+	(start,pos)=index
+	return(np.unique(np.concatenate([pos[start[p]:start[p+1]] for p in net]+[np.zeros(0,dtype=int)])))
+
 def buildNetwork (HorzPts,VertPts):	
 	"""Build network.
 
@@ -131,25 +439,12 @@ def buildNetwork (HorzPts,VertPts):
 		list : list of lists with points belonging to a network.
 	"""
 
-	AllPts=[]
-	for i,v in list(VertPts.items()):
-		AllPts.append(v)
-	for i,v in list(HorzPts.items()):
-		AllPts.append(v)
-	i=0
-	for v in AllPts:
-		i+=1
-		g = nx.Graph()
-	for lst in AllPts:
-		lstt=tuple(map(tuple, lst))
-		for edge in getPairs(lstt):
-			g.add_edge(*edge)
-	Net=list(nx.connected_components(g))
-	j=0
-	for i in Net:
-		Net[j]=list(i)
-		j+=1
-	return (Net)
+	AllPts=list(VertPts.values())+list(HorzPts.values())
+	P=[tuple(p) for lst in AllPts for p in lst]
+	ends=np.cumsum([len(lst) for lst in AllPts]).tolist()
+	groups=[list(range(end-len(lst),end)) for lst, end in zip(AllPts,ends)]
+	(Net,pairs,links)=linkNetworks(P,groups)
+	return ([[P[i] for i in net] for net in Net])
 
 def listPairs (horzPts,vertPts):
 	"""List all pairs of horizontally connected points that are part of a network.
@@ -165,17 +460,6 @@ def listPairs (horzPts,vertPts):
 	"""
 
 	allPairs=[]
-	for i,v in list(vertPts.items()):
-		if (len(v)>=2):
-			for a, b in itertools.combinations(enumerate(v),2):
-				allPairs.append(list((a[1],b[1])))
-		else:
-			continue
-
-	for i,v in list(horzPts.items()):
-		if (len(v)>=2):
-			for a, b in itertools.combinations(enumerate(v),2):
-				allPairs.append(list((a[1],b[1])))
-		else:
-			continue
-	return (allPairs)
\ No newline at end of file
+	for v in itertools.chain(vertPts.values(),horzPts.values()):
+		allPairs.extend([a,b] for a, b in itertools.combinations(v,2))
+	return (allPairs)
@@ -0,0 +1,122 @@
+"""Functions for measuring the PyINETA steps.
+
+This includes the functions used by PyINETA to record the wall time, CPU time, peak memory and the number of points, pairs and networks of every step of a run.
+Steps are recorded by decorating the functions that run them. Steps run inside another step are recorded with their depth, so the time of a step can be split into its parts.
+Includes the following functions:
+	* reset - Forget the recorded steps and set where the cProfile dumps go.
+	* timed - Decorator recording every call of a function as a step.
+	* count - Add to a count of the innermost running step.
+	* peakRss - Get the peak resident memory of the process.
+	* writeReport - Write the recorded steps to a json file.
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+try:
+	import resource
+except ImportError:	# Not available on Windows, peak memory is then not recorded
+	resource=None
+
+records=[]	# Recorded steps in the order they started
+running=[]	# Steps that have started but not finished, innermost last
+profileDir=None	# Folder for the cProfile dumps of the top level steps, or None
+
+def reset (profile=None):
+	"""Forget the recorded steps and set where the cProfile dumps go.
+
+	Args:
+		profile (str, optional): Folder to write a cProfile dump of every top level step to. No dumps are written if None. Defaults to None.
+	"""
+
+	global profileDir
+	del records[:]
+	del running[:]
+	profileDir=profile
+	if profile is not None and not os.path.exists(profile):
+		os.makedirs(profile)
+
+def peakRss ():
+	"""Get the peak resident memory of the process.
+
+	Returns:
+		float : The peak resident memory in MB, or None if it cannot be measured on this platform.
+	"""
+
+	if resource is None:
+		return(None)
+	rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return(round(rss/(2**20 if sys.platform == 'darwin' else 2**10),1))	# Bytes on macOS, KB elsewhere
+
+def count (name,n=1):
+	"""Add to a count of the innermost running step.
+
+	Args:
+		name (str): Name of the count.
+		n (int, optional): Number to add. Defaults to 1.
+	"""
+
+	if running:
+		counts=running[-1]['counts']
+		counts[name]=counts.get(name,0)+int(n)
+
+def timed (name,counts=None):
+	"""Decorator recording every call of a function as a step.
+
+	Args:
+		name (str): The step name used in the report.
+		counts (function, optional): Called with the return value and the positional arguments of the function, returns a dict of counts to record. Defaults to None.
+
+	Returns:
+		function : The decorator.
+	"""
+
+	def decorate(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			rec={'step':name,'function':func.__qualname__,'depth':len(running),'counts':{}}
+			records.append(rec)
+			running.append(rec)
+			profiler=None
+			if profileDir is not None and rec['depth'] == 0:
+				profiler=cProfile.Profile()
+			rssStart=peakRss()
+			(wall,cpu)=(time.perf_counter(),time.process_time())
+			try:
+				if profiler is not None:
+					result=profiler.runcall(func,*args,**kwargs)
+				else:
+					result=func(*args,**kwargs)
+			finally:
+				rec['wall']=round(time.perf_counter()-wall,6)
+				rec['cpu']=round(time.process_time()-cpu,6)
+				rec['peak_rss_mb']=peakRss()
+				rec['rss_growth_mb']=None if rssStart is None else round(rec['peak_rss_mb']-rssStart,1)
+				running.pop()
+				if profiler is not None:
+					ct=sum(1 for r in records if r['step'] == name and r['depth'] == 0)
+					profiler.dump_stats(os.path.join(profileDir,"%s%s.prof" % (name,"" if ct == 1 else "_%d" % (ct))))
+			if counts is not None:
+				rec['counts'].update(counts(result,args))
+			return(result)
+		return(wrapper)
+	return(decorate)
+
+def writeReport (outfilename,info=None):
+	"""Write the recorded steps to a json file.
+
+	Args:
+		outfilename (str): Output filename.
+		info (dict, optional): Extra fields for the report, like the input file. Defaults to None.
+	"""
+
+	report=dict(info or {})
+	report['total_wall']=round(sum(r.get('wall',0) for r in records if r['depth'] == 0),6)
+	report['total_cpu']=round(sum(r.get('cpu',0) for r in records if r['depth'] == 0),6)
+	report['peak_rss_mb']=peakRss()
+	report['steps']=records
+	with open(outfilename, 'w') as out_file:
+		json.dump(report, out_file, indent=1, default=str)
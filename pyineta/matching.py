@@ -4,12 +4,17 @@ This includes all the functions used by PyINETA to match the identified networks
 Includes the following functions:
 	* prepUnknowns - Add tags and connection names to the unknown networks.
 	* matchTag - Match the tags from matched peaks to the list of unknown connections.
+	* MatchIndex class - Preindexed INETA database for finding candidate entries.
 	* matchDatabase - Match unknown networks to networks in the InETA database.
 """
 
 import itertools
+import numpy as np
+from scipy import spatial as spatial
+import pyineta.database as database
+import pyineta.instrument as instrument
 
-def prepUnknowns (Pvals,Pairs):
+def prepUnknowns (Pvals,Pairs,pairPos=None):
 	"""Add tags and connection names to the unknown networks.
 
 	This function adds CX tags to the peaks that wil be used when matching them to teh database.
@@ -17,6 +22,7 @@ def prepUnknowns (Pvals,Pairs):
 	Args:
 		Pvals (list): List of all points in a single network.
 		Pairs (list): A list of all horizontally connected pairs of points included in a network.
+		pairPos (ndarray, optional): Positions in Pairs of the pairs within the network, as returned by finding.networkPairs. Only these pairs are looked at instead of searching all of Pairs. Defaults to None.
 	
 	Returns:
 		list : List of Tags for naming the unknown peaks in a network.
@@ -30,6 +36,10 @@ def prepUnknowns (Pvals,Pairs):
 		j=str('CX'+str(i+1))
 		TagDict[Pvals[i]]=j
 		Ptags.append('CX'+str(i+1))
+	if pairPos is not None:
+		newP=sorted(set(tuple(map(tuple, Pairs[k])) for k in pairPos.tolist()))
+		unknownConn= [[TagDict[j] for j in x] for x in newP]
+		return(Ptags,unknownConn,newP)
 	newP=[]
 	for i in Pvals:
 		new1=[]
@@ -78,11 +88,186 @@ def matchTag (match_peaks,unknown_conn):
 			hits=hits+1
 	return (final_match,no_match,hits)
 	
+class MatchIndex:
+	"""Preindexed INETA database for finding candidate entries.
+
+	The database is loaded once and the mean chemical shift of every atom of the entries passing the ambiguity filter is kept in a sorted array.
+	Candidate entries for a network are then found with a binary-search range lookup for each of its peaks.
+	All (13C, DQ) network points of these entries are also kept in a KDTree for the topology matching.
+
+	Attributes:
+		db (dict or CompiledDb): The INETA database.
+		ambig (float): Amibiguity tolerance used to filter the database entries.
+		keys (list): IDs of the entries with networks and passing the ambiguity filter, in database order.
+		position (dict): A dict mapping the entry IDs to their position in keys.
+		shifts (ndarray): Sorted mean chemical shifts of all atoms of the kept entries.
+		entries (ndarray): Position in keys of the entry each shift belongs to.
+		atoms (ndarray): Unique atom number for each shift.
+		groupAtom (list): Atom label of every (entry, network, atom) group of points, in database order.
+		groupStart (ndarray): Position in groupAtom of the first group of each entry, with a final end position.
+		points (ndarray): The (13C, DQ) values of all database network points.
+		pointGroup (ndarray): Group number of each database network point.
+		pointOrder (ndarray): Position of each point within its group.
+		tree (KDTree): KDTree over the (13C, DQ) values of all database network points.
+	"""
+
+	def __init__(self, json_db, amb_tol):
+		"""The __init__ method.
+
+		Args:
+			json_db (dict or CompiledDb): The INETA database.
+			amb_tol (float): Amibiguity tolerance (Removes all database entries with ambiguity higher than this tolerance).
+		"""
+
+		self.db=json_db
+		self.ambig=float(amb_tol)
+		if isinstance(json_db,database.CompiledDb):
+			self._indexCompiled(json_db)
+		else:
+			self._indexJson(json_db)
+		self.position={i:e for e, i in enumerate(self.keys)}
+		self.tree=spatial.KDTree(self.points) if len(self.points) else None
+
+	def _indexJson (self, json_db):	# Index the nested json entries
+		self.keys=[]
+		means=[]
+		entries=[]
+		for i in json_db:
+			if (len(json_db[i]['Networks'] ) >=1):
+				if (json_db[i]['Ambiguity'] <= self.ambig):
+					for CS in json_db[i]['ChemicalShifts']:
+						CSlist=json_db[i]['ChemicalShifts'][CS]
+						means.append(sum(CSlist) / float(len(CSlist)))
+						entries.append(len(self.keys))
+					self.keys.append(i)
+		self._sortShifts(means,entries)
+
+		self.groupAtom=[]
+		groupStart=[]
+		points=[]
+		pointGroup=[]
+		pointOrder=[]
+		for i in self.keys:
+			groupStart.append(len(self.groupAtom))
+			for j in json_db[i]['Networks']:
+				for k in j:
+					for n, l in enumerate(k[1]):
+						points.append(l[:2])
+						pointGroup.append(len(self.groupAtom))
+						pointOrder.append(n)
+					self.groupAtom.append(k[0])
+		groupStart.append(len(self.groupAtom))
+		self.groupStart=np.asarray(groupStart,dtype=int)
+		self.points=np.asarray(points,dtype=float).reshape(-1,2)
+		self.pointGroup=np.asarray(pointGroup,dtype=int)
+		self.pointOrder=np.asarray(pointOrder,dtype=int)
+
+	def _indexCompiled (self, db):	# Index the flat arrays of a compiled database directly
+		nets=np.bincount(db.netEntry,minlength=len(db))
+		keep=(nets>=1) & (db.ambiguity<=self.ambig)
+		kept=np.nonzero(keep)[0]
+		newEntry=np.cumsum(keep)-1
+		self.keys=[str(db.strings[k]) for k in db.entryID[kept]]
+
+		csKeep=keep[db.csEntry]
+		(csEntry,csAtom,csVal)=(db.csEntry[csKeep],db.csAtom[csKeep],db.csVal[csKeep])
+		starts=np.nonzero(np.concatenate(([True],(csEntry[1:]!=csEntry[:-1]) | (csAtom[1:]!=csAtom[:-1]))))[0] if len(csEntry) else np.zeros(0,dtype=int)
+		counts=np.diff(np.append(starts,len(csVal)))
+		sums=np.zeros(len(starts))
+		for k in range(counts.max() if len(counts) else 0):	# Add the values of each atom in order, as sum() does for the json entries
+			sums[counts>k]+=csVal[starts[counts>k]+k]
+		means=sums/counts
+		self._sortShifts(means,newEntry[csEntry[starts]])
+
+		sideKeep=keep[db.netEntry[db.sideNet]]
+		sides=np.nonzero(sideKeep)[0]
+		self.groupAtom=[str(a) for a in db.strings[db.sideAtom[sides]]]
+		sideEntry=newEntry[db.netEntry[db.sideNet[sides]]]
+		self.groupStart=np.searchsorted(sideEntry,np.arange(len(kept)+1))
+		newSide=np.cumsum(sideKeep)-1
+		ptKeep=sideKeep[db.pointSide]
+		self.points=db.pointVal[ptKeep].reshape(-1,2)
+		self.pointGroup=newSide[db.pointSide[ptKeep]]
+		self.pointOrder=np.nonzero(ptKeep)[0]-db._pointStart[db.pointSide[ptKeep]]
+
+	def _sortShifts (self, means, entries):	# Keep the mean shifts sorted with their entry positions
+		order=np.argsort(np.asarray(means,dtype=float),kind='stable')
+		self.shifts=np.asarray(means,dtype=float)[order]
+		self.entries=np.asarray(entries,dtype=int)[order]
+		self.atoms=order
+
+	@classmethod
+	def fromFile (cls, dbfile, amb_tol):
+		"""Build the index from an INETA database file.
+
+		Args:
+			dbfile (str): The INETA database filename in json or compiled npz format.
+			amb_tol (float): Amibiguity tolerance.
+
+		Returns:
+			MatchIndex : The index for the database.
+		"""
+
+		return cls(database.loadDatabase(dbfile),amb_tol)
+
+	def candidates (self, X, near_tol, match_tol):
+		"""Find the database entries with enough atoms close to the peaks of a network.
+
+		Args:
+			X (list): List of the 13C ppm values of the network peaks.
+			near_tol (float): Tolerance for distance in the 13C dimension between unknown peak and a match database peak.
+			match_tol (int): Tolerance for number of matches in a single network.
+
+		Returns:
+			list : IDs of the matching entries, in database order.
+		"""
+
+		near_tol=float(near_tol)
+		pad=1e-6*(1+near_tol)	# Widen the lookup and filter with the exact tolerance below
+		X=np.asarray(X,dtype=float)
+		lo=np.searchsorted(self.shifts,X-near_tol-pad,side='left')
+		hi=np.searchsorted(self.shifts,X+near_tol+pad,side='right')
+		hits=[np.arange(a,b)[np.abs(x-self.shifts[a:b])<=near_tol] for x, a, b in zip(X,lo,hi)]
+		hits=np.unique(np.concatenate(hits)) if hits else np.zeros(0,dtype=int)
+		counts=np.bincount(self.entries[hits],minlength=len(self.keys))
+		return([self.keys[k] for k in np.nonzero(counts>=float(match_tol))[0]])
+
+	def topology (self, X, Y, top_tol):
+		"""Find the first database point of every group within the topology tolerance of the network peaks.
+
+		A group is the list of points of one atom in one of the networks of an entry.
+		All network peaks are queried against the KDTree at once. For every group, the first of its points with any peak in range is kept along with the first such peak.
+
+		Args:
+			X (list): List of the 13C ppm values of the network peaks.
+			Y (list): List of the DQ ppm values of the network peaks.
+			top_tol (float): Topology tolerance (How far the point can be in all directions from the match peak point).
+
+		Returns:
+			ndarray : Sorted group numbers with a matched point.
+			ndarray : Index of the matched network peak for each of these groups.
+		"""
+
+		top_tol=float(top_tol)
+		if self.tree is None or len(X)==0:
+			return(np.zeros(0,dtype=int),np.zeros(0,dtype=int))
+		X=np.asarray(X,dtype=float)
+		Y=np.asarray(Y,dtype=float)
+		near=self.tree.query_ball_point(np.column_stack((X,Y)),r=top_tol+1e-6*(1+top_tol))
+		ind=np.repeat(np.arange(len(X)),[len(n) for n in near])
+		pt=np.concatenate([np.asarray(n,dtype=int) for n in near])
+		keep=((X[ind]-self.points[pt,0])**2 + (Y[ind]-self.points[pt,1])**2)**(1/2.0) <= top_tol
+		(ind,pt)=(ind[keep],pt[keep])
+		order=np.lexsort((ind,self.pointOrder[pt],self.pointGroup[pt]))
+		(ind,group)=(ind[order],self.pointGroup[pt][order])
+		first=np.concatenate(([True],group[1:]!=group[:-1])) if len(group) else np.zeros(0,dtype=bool)
+		return(group[first],ind[first])
+
 def matchDatabase (json_db,Pval,tag,unknown_conn,amb_tol,near_tol,match_tol,top_tol,hit_tol,cov_tol,NetNum,Pts):
 	"""Match unknown networks to networks in the InETA database.
 
 	Args:
-		json_db (dict): The INETA database in json format.
+		json_db (dict or MatchIndex): The INETA database in json format, or an index built for it with the same ambiguity tolerance.
 		Pval (list): List of all points in a single network.
 		tag (list): List of tags for the unknown peaks.
 		unknown_conn (list): List of unknown connections.
@@ -107,45 +292,33 @@ def matchDatabase (json_db,Pval,tag,unknown_conn,amb_tol,near_tol,match_tol,top_
 	hitList.append(Y)
 	hitList.append(tag)
 	hitList.append(Pts)
-	for i in json_db:
-		matchCnt=0
-		matchCS=[]
-		if (len(json_db[i]['Networks'] ) >=1):
-			if (json_db[i]['Ambiguity'] <= float(amb_tol)):
-				ambScore=json_db[i]['Ambiguity']
-				for xval in X:
-					for CS in json_db[i]['ChemicalShifts']:
-						if CS not in matchCS:
-							CSlist=json_db[i]['ChemicalShifts'][CS]
-							meanCS=sum(CSlist) / float(len(CSlist))
-							if (abs(xval-meanCS)<= float(near_tol)):
-								matchCS.append(CS)
-								matchCnt+=1
-				if (matchCnt>= float(match_tol)):
-					found={}
-					matchPeaks={}
-					for j in json_db[i]['Networks']:
-						for k in j:
-							break_outer_loop=False
-							for l in k[1]:
-								for ind,xval in enumerate(X):
-									if (((xval-l[0])**2 + (Y[ind]-l[1])**2)**(1/2.0) <= float(top_tol)):
-										matchPeaks[tag[ind]]=k[0]
-										found[tag[ind]]=1
-										break_outer_loop=True
-										break
-								if break_outer_loop: break
-					(fin_match,no_match,hitCount)=matchTag(matchPeaks,unknown_conn)
-					hitScore=float("{0:.3f}".format(float(hitCount)/float(len(json_db[i]['Networks']))))
-					CovScore=float("{0:.3f}".format(float(len(found))/float(len(tag))))
-					if (hitScore >= float(hit_tol) and CovScore >= float(cov_tol)):
-						hitOut=[]
-						hitOut.append(i)
-						hitOut.append([json_db[i]['Networks']])
-						hitOut.append(fin_match)
-						hitOut.append(no_match)
-						hitOut.append(ambScore)
-						hitOut.append(hitScore)
-						hitOut.append(CovScore)
-						hitList.append(hitOut)
-	return(hitList)
\ No newline at end of file
+	if not (isinstance(json_db,MatchIndex) and json_db.ambig==float(amb_tol)):
+		json_db=MatchIndex(getattr(json_db,'db',json_db),amb_tol)
+	index=json_db
+	json_db=index.db
+	(groups,peaks)=index.topology(X,Y,top_tol)
+	candidates=index.candidates(X,near_tol,match_tol)
+	instrument.count('db_candidates',len(candidates))
+	for i in candidates:
+		ambScore=json_db[i]['Ambiguity']
+		found={}
+		matchPeaks={}
+		e=index.position[i]
+		(lo,hi)=np.searchsorted(groups,index.groupStart[e:e+2])
+		for g, ind in zip(groups[lo:hi],peaks[lo:hi]):
+			matchPeaks[tag[ind]]=index.groupAtom[g]
+			found[tag[ind]]=1
+		(fin_match,no_match,hitCount)=matchTag(matchPeaks,unknown_conn)
+		hitScore=float("{0:.3f}".format(float(hitCount)/float(len(json_db[i]['Networks']))))
+		CovScore=float("{0:.3f}".format(float(len(found))/float(len(tag))))
+		if (hitScore >= float(hit_tol) and CovScore >= float(cov_tol)):
+			hitOut=[]
+			hitOut.append(i)
+			hitOut.append([json_db[i]['Networks']])
+			hitOut.append(fin_match)
+			hitOut.append(no_match)
+			hitOut.append(ambScore)
+			hitOut.append(hitScore)
+			hitOut.append(CovScore)
+			hitList.append(hitOut)
+	return(hitList)
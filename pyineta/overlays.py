@@ -1,9 +1,35 @@
+"""Functions for overlaying INETA networks on 1D and Jres spectra.
+
+This includes the functions used by PyINETA to integrate 1D 13C spectra, or the 13C projection of Jres spectra, around the peaks of the matched networks.
+Areas are computed for all peaks of a spectrum at once and written to a file one network at a time. Plotting the matched regions is a separate, optional stage.
+Includes the following functions:
+	* readFt - Read ft files using nmrglue.
+	* read1D - Read a 1D ft file.
+	* shift1D - Shift a 1D spectrum by padding units.
+	* projectJres - Project a Jres spectrum on the 13C axis, reading it in chunks of rows.
+	* readJres - Read a Jres ft file and project it on the 13C axis.
+	* readSpectrum - Read a 1D or Jres spectrum to overlay.
+	* networkPeaks - List the network peaks to integrate.
+	* nearestIndex - Find the index of the closest ppm value.
+	* peakAUC - Area under the curve around every network peak.
+	* writeOverlays - Write the areas under the curve for all networks and spectra.
+	* plotOverlay - Plot the integrated regions on a spectrum.
+	* overlaySpec - Overlay the matched networks on a list of 1D or Jres spectra.
+	* integrateSpectrum - Read a spectrum and integrate it around every network peak.
+	* writeMatrix - Write a samples by network peaks table.
+	* cohortOverlay - Integrate the network peaks in a cohort of 1D or Jres spectra on a process pool.
+"""
+
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 import re
 import operator
 import nmrglue as ng
+from functools import partial
+from multiprocessing import Pool
+from pyineta.cache import stepKey
+import pyineta.instrument as instrument
 import pyineta.plotting as plotting
 
 def readFt (ftfile):
@@ -29,6 +55,16 @@ def readFt (ftfile):
 	return(In,Xs,Ys)
 
 def read1D (ftfile1D):
+    """Read a 1D ft file.
+
+    Args:
+        ftfile1D (str): 1D ft filename.
+
+    Returns:
+        ndarray : A 1D array with the real intensities.
+        1D-array : A 1D array with the 13C ppm values.
+    """
+
     ft_dic,ft_data = ng.pipe.read(ftfile1D)
     CS = ng.pipe.make_uc(ft_dic, ft_data, 0)
     if ft_data.dtype=='complex64':
@@ -38,6 +74,18 @@ def read1D (ftfile1D):
     return(ft_data,Xs)
 
 def shift1D (In,pX,fullX,direction):
+    """Shift a 1D spectrum by padding units.
+
+    Args:
+        In (ndarray): A 1D array with the intensities.
+        pX (int): Number of units to shift by.
+        fullX (int): Size of the 13C axis in units.
+        direction (str): "pos" or "neg".
+
+    Returns:
+        ndarray : The shifted intensities.
+    """
+
     # print(In)
     if direction.lower() == "pos":      # For increasing ppm axes (eg: peak at 35 ppm is now at 40 ppm)
         padX=np.zeros(pX)   # fullY= 8192 for INADEQUATE
@@ -50,197 +98,377 @@ def shift1D (In,pX,fullX,direction):
     # print(In)
     return(In)
 
-def readJres (ftfileJres,method='max'):
-    ft_dic,ft_data = ng.pipe.read(ftfileJres)
-    In=ft_data.transpose()
-    
-    DQ = ng.pipe.make_uc(ft_dic, ft_data, 0)
-    Ys=DQ.ppm_scale()
+def projectJres (data,method='max',maxBytes=1<<24):
+    """Project a Jres spectrum on the 13C axis, reading it in chunks of rows.
 
-    CS = ng.pipe.make_uc(ft_dic, ft_data, 1)
-    Xs=CS.ppm_scale()
+    Only maxBytes of the spectrum are in memory at once. Sums are accumulated in double precision.
+
+    Args:
+        data (ndarray): The Jres intensities as stored in the ft file, with the 13C axis last. Any array-like that reads rows on slicing, like the nmrglue low memory data objects.
+        method (str, optional): Projection method, "sum", "avg" or "max". Defaults to 'max'.
+        maxBytes (int, optional): Size of the chunks of rows read at once. Defaults to 16 MB.
+
+    Returns:
+        ndarray : A 1D array with the projected intensities, in the dtype of data.
+    """
+
+    (nrows,ncols)=data.shape
+    dtype=np.dtype(data.dtype)
+    step=max(1,maxBytes//(ncols*dtype.itemsize))
+    InProj=None
+    for start in range(0,nrows,step):
+        block=np.asarray(data[start:start+step]).reshape(-1,ncols)   # nmrglue squeezes single rows
+        if method=='max':
+            part=np.amax(block,axis=0)
+            InProj=part if InProj is None else np.maximum(InProj,part)
+        else:
+            part=np.sum(block,axis=0,dtype=np.promote_types(dtype,np.float64))
+            InProj=part if InProj is None else InProj+part
+    if method=='avg':
+        InProj=InProj/nrows
+    return(InProj.astype(dtype))
+
+def readJres (ftfileJres,method='max',cache=None):
+    """Read a Jres ft file and project it on the 13C axis.
+
+    Args:
+        ftfileJres (str): Jres ft filename.
+        method (str, optional): Projection method, "sum", "avg" or "max". Defaults to 'max'.
+        cache (StepCache, optional): Step cache to reuse the projection from, keyed on the file contents and the method. Defaults to None.
+
+    Returns:
+        ndarray : A 1D array with the projected intensities.
+        1D-array : A 1D array with the 13C ppm values.
+    """
+
+    method=method.lower()
+    if method not in ('sum','avg','max'):
+        exit("ERROR: %s not a valid Jres projection method. Please use either max, sum or avg." % (method))
+    if cache is not None:
+        key=stepKey(cache.fileDigest(ftfileJres),'jres',[method])
+        state=cache.get(key)
+        if state is not None:
+            return(state)
     # X is 13 C spectrum for Jres
     # Y is 1 H spectrum for Jres
-    if method.lower()=='sum':
-        InProj=np.sum(In,axis=1)
-    elif method.lower()=='avg':
-        InProj=np.mean(In,axis=1)
-    elif method.lower()=='max':
-        InProj=np.amax(In,axis=1)
-    else:
-        msg="ERROR:",method,"not a valid Jres projection method. Please use either max, sum or avg."
+    ft_dic,ft_data = ng.pipe.read_lowmem(ftfileJres)
+    CS = ng.pipe.make_uc(ft_dic, ft_data, 1)
+    Xs=CS.ppm_scale()
+    InProj=projectJres(ft_data,method)
+    if cache is not None:
+        cache.put(key,(InProj,Xs))
     return(InProj,Xs)
 
-def writeOverlays (filelist,aucfile,intThres,outfilename):    
-    out_file = open(outfilename, 'w')
-    for entry in aucfile:
-        outline=entry
-        for num in aucfile[entry]:
-            outline+="\t"+filelist[num]+"="
-            for i in aucfile[entry][num]:
-                if (i[3]>=intThres):
-                    met="Present"
+def readSpectrum (filename,method='1d',shift=None,use=None,cache=None):
+    """Read a 1D or Jres spectrum to overlay.
+
+    Args:
+        filename (str): ft filename.
+        method (str, optional): "1d" or "jres". Defaults to '1d'.
+        shift (list, optional): Only for 1D spectra. [padding units, size of the 13C axis, direction] to shift the spectrum. Defaults to None.
+        use (str, optional): Only for Jres spectra. The projection method. Defaults to None.
+        cache (StepCache, optional): Only for Jres spectra. Step cache for the projections. Defaults to None.
+
+    Returns:
+        ndarray : A 1D array with the intensities.
+        1D-array : A 1D array with the 13C ppm values.
+    """
+
+    if method.lower()=='1d':
+        (In,Xs)=read1D(filename)
+        if shift is not None:
+            if type(shift) is list and len(shift)==3:
+                if (shift[2].lower() == 'pos'):
+                    directionShift="higher"
                 else:
-                    met="Absent"
-                outline+=i[0]+"["+met+"]("+str(i[1])+","+str(i[2])+")"+":"+str(i[3])+";"
-        outline+='\n'
-        out_file.write(outline)
+                    directionShift="lower"
+                ppmUnits=(200/shift[1])*shift[0]
+                print("\nStep5.1==>Shifting 1D spectra to %s ppm level by %.2f units (%.2f ppm on 13C axis)" % (directionShift,shift[0],ppmUnits))
+                In=shift1D(In,*shift)
+            else:
+                exit("ERROR: Argument shift needs to be a list with 3 items:padding units, total size of X axis and direction (either pos or neg). Eg: [20,4096,'pos']")
+    elif method.lower()=='jres':
+        (In,Xs)=readJres(filename,use,cache)
+    else:
+        exit("ERROR: %s not a valid method. Please use 1D or Jres." % (method))
+    return(In,Xs)
 
-def overlaySpec (pyinetaObj,spec_files,ptsTol,aucTol,intThres,outfilename,outimgname,net,shift=None,method='1d',use=None,savefmt="svg"):
-    filelist=spec_files.split(',')
-    nrows = len(filelist)
-    allAUC=dict()
-    fig_net=dict()
-    ax_net=dict()
-    ct=dict()
-    fig, axs = plt.subplots(nrows, 1, figsize=(30, nrows*5), sharex=True)
-    for j,filename in enumerate(filelist):
-        fn=filename.split("/")[-1].rsplit(".",1)[0]
-        # Reading 1D file
-        if method.lower()=='1d':
-            (In,Xs)=read1D(filename)
-            # Matching networks to 1D peaks
-            if shift is not None:
-                if type(shift) is list and len(shift)==3:
-                    if (shift[2].lower() == 'pos'):
-                        directionShift="higher"
+def networkPeaks (NetMatch,ptsTol):
+    """List the network peaks to integrate.
+
+    Peaks of a network that are within ptsTol of an earlier peak of the same network (or of 0 ppm) are integrated only once.
+
+    Args:
+        NetMatch (list): A list of networks with their corresponding hits as set by Pyineta.matchDb.
+        ptsTol (float): Peaks closer than this along the 13C axis are the same peak.
+
+    Returns:
+        list : List of (network, tag, 13C ppm, DQ ppm) tuples, with ppm values rounded to 2 decimals.
+    """
+
+    peaks=[]
+    for Net in NetMatch:
+        Matched=np.zeros(1)
+        arr=np.around(np.asarray(Net[1]),decimals=2)
+        arr2=np.around(np.asarray(Net[2]),decimals=2)
+        for i,Pt in enumerate(arr):
+            if np.isclose(Matched,Pt,atol=ptsTol).any():
+                continue
+            Matched=np.append(Matched,Pt)
+            peaks.append((Net[0],Net[3][i],Pt,arr2[i]))
+    return(peaks)
+
+def nearestIndex (Xs,vals):
+    """Find the index of the closest ppm value.
+
+    Same as np.abs(Xs-val).argmin() for every value, including ties going to the lower index, but with a binary search.
+
+    Args:
+        Xs (1D-array): Sorted ppm values, increasing or decreasing.
+        vals (1D-array): The ppm values to look up.
+
+    Returns:
+        ndarray : Index in Xs of the closest value for every value.
+    """
+
+    Xs=np.asarray(Xs)
+    vals=np.asarray(vals,dtype=float)
+    if len(Xs)>1 and Xs[0]>Xs[-1]:
+        j=np.searchsorted(-Xs,-vals)
+    else:
+        j=np.searchsorted(Xs,vals)
+    lo=np.clip(j-1,0,len(Xs)-1)
+    hi=np.clip(j,0,len(Xs)-1)
+    return(np.where(np.abs(Xs[hi]-vals)<np.abs(Xs[lo]-vals),hi,lo))
+
+def peakAUC (In,Xs,pts,aucTol):
+    """Area under the curve around every network peak.
+
+    The window of a peak runs from the point closest to pt-aucTol/2 towards, but not including, the point closest to pt+aucTol/2.
+    All window edges are found at once with a binary search. Every window is then summed in the dtype of In and in the same order as before, so the areas are identical to the per-point loop.
+
+    Args:
+        In (ndarray): A 1D array with the intensities.
+        Xs (1D-array): A 1D array with the 13C ppm values, decreasing.
+        pts (1D-array): The 13C ppm values of the peaks.
+        aucTol (float): Width of the window around each peak, in ppm.
+
+    Returns:
+        ndarray : Area under the curve for every peak, in the dtype of In.
+    """
+
+    pts=np.asarray(pts,dtype=float).reshape(-1)
+    idxMin=nearestIndex(Xs,pts-aucTol/2)
+    idxMax=nearestIndex(Xs,pts+aucTol/2)
+    return(np.asarray([In[i:j:-1].sum() for i, j in zip(idxMin.tolist(),idxMax.tolist())],dtype=In.dtype))
+
+def writeOverlays (filelist,networks,peaks,aucs,intThres,outfilename):
+    """Write the areas under the curve for all networks and spectra.
+
+    Every network is one row with its peaks in all spectra, written as soon as it is formatted.
+
+    Args:
+        filelist (list): The spectrum filenames.
+        networks (list): The network names, one row each.
+        peaks (list): The (network, tag, 13C ppm, DQ ppm) tuples from networkPeaks.
+        aucs (list): The areas under the curve of the peaks in every spectrum, as returned by peakAUC.
+        intThres (float): Peaks with an area of at least this are flagged as present.
+        outfilename (str): Output filename.
+    """
+
+    cols={name:list() for name in networks}
+    for k, p in enumerate(peaks):
+        cols[p[0]].append(k)
+    with open(outfilename, 'w') as out_file:
+        for entry in cols:
+            outline=entry
+            for filename, auc in zip(filelist,aucs):
+                outline+="\t"+filename+"="
+                for k in cols[entry]:
+                    (name,tag,Pt,dq)=peaks[k]
+                    if (auc[k]>=intThres):
+                        met="Present"
                     else:
-                        directionShift="lower"
-                    ppmUnits=(200/shift[1])*shift[0]
-                    print("\nStep5.1==>Shifting 1D spectra to %s ppm level by %.2f units (%.2f ppm on 13C axis)" % (directionShift,shift[0],ppmUnits))
-                    In=shift1D(In,*shift)
-                else:
-                    exit("ERROR: Argument shift needs to be a list with 3 items:padding units, total size of X axis and direction (either pos or neg). Eg: [20,4096,'pos']")
-        elif method.lower()=='jres':
-            (In,Xs)=readJres(filename,use)
-        else:
-            msg="ERROR: ",method,"not a valid method. Please use 1D or Jres."
-            exit(msg)
-
-        aucregion=dict()
-        for Net in pyinetaObj.NetMatch:
-            # if not Net[0] == "Network3":
-            #     continue
-            # print(Net)
-            if Net[0] not in allAUC:
-                allAUC[Net[0]]=dict()
-            allAUC[Net[0]][j]=list()
-            Matched=np.zeros(1)
-            arr=np.around(np.asarray(Net[1]),decimals=2)
-            arr2=np.around(np.asarray(Net[2]),decimals=2)
-            print(arr,arr2)
-            aucregion[Net[0]]=list()
-            for i,Pt in enumerate(arr):
-                print(Matched,Pt)
-                if np.isclose(Matched,Pt,atol=ptsTol).any():
-                    continue
-                Matched=np.append(Matched,Pt)
-                valMin=Pt-aucTol/2
-                valMax=Pt+aucTol/2
-                print(valMin,valMax, aucTol)
-                idxMin = (np.abs(Xs - valMin)).argmin()
-                idxMax = (np.abs(Xs - valMax)).argmin()
-                indices=list(range(idxMin,idxMax,-1))
-                print(indices)
-                print(Xs[indices]) # <- this is collected correctly
-                print(In[indices])
-                auc=In[indices].sum()
-                allAUC[Net[0]][j].append([Net[3][i],Pt,arr2[i],auc])
-                aucregion[Net[0]].append((valMin,valMax))
-        # Plotting overall 1D plots
-        if isinstance(axs,np.ndarray):
-            currax=axs[j]
-        else:
-            currax=axs
-        print("HERE now:", type(axs))
-        print(aucregion)
-        # print(In.shape)
-        plotting.plot1D(In,Xs,aucregion,ax=currax,title=fn,net=net)
-        auc_lower = {k.lower():v for k,v in aucregion.items()}
-        print(auc_lower)
-        # Plotting individual matched regions for specified networks
-        print("Plotting individual network matches for %s ..." % (fn))
-        if net is None:
-            Netlist=[item[0].lower() for item in pyinetaObj.NetMatch]
-        else:
-            Netlist=net.lower().split(",")
-        print(net,Netlist)
-        for n in Netlist:
-            # if not n == "network3":
-            #     continue
-            # n="network3"
-            ncols=len(auc_lower[n])
-            if n not in fig_net:
-                print("NROWS==>",nrows)
-                fig_net[n]=plt.figure(figsize=(ncols*5, 10))
-                gs=GridSpec(2,ncols)
-
-                # fig_net[n],ax_net[n] = plt.subplots(nrows, ncols, figsize=(ncols*5, nrows*5))
-                ct[n]=0
-            
-            curr_ax = plt.subplot(gs[1,:])
-            fig_net[n].add_subplot(curr_ax)
-            ## PLOT THE ENTIRE THING HERE....
-            sel_region={n:auc_lower[n]}
-            # print(auc_lower[n])
-            plotting.plot1D(In,Xs,sel_region,ax=curr_ax,title=fn,net=net)
+                        met="Absent"
+                    outline+=tag+"["+met+"]("+str(Pt)+","+str(dq)+")"+":"+str(auc[k])+";"
+            outline+='\n'
+            out_file.write(outline)
 
+def plotOverlay (In,Xs,fn,aucregion,net,ax,fig_net):
+    """Plot the integrated regions on a spectrum.
+
+    Args:
+        In (ndarray): A 1D array with the intensities.
+        Xs (1D-array): A 1D array with the 13C ppm values.
+        fn (str): Spectrum name used in the titles.
+        aucregion (dict): A dict mapping every network to a list of (min,max) ppm windows.
+        net (str): Comma-separated networks to plot on their own figure, or None for all networks.
+        ax (Axes): Axes for the plot of the whole spectrum.
+        fig_net (dict): A dict mapping the network names to their figure and axes, filled in on the first spectrum.
+    """
+
+    plotting.plot1D(In,Xs,aucregion,ax=ax,title=fn,net=net)
+    auc_lower = {k.lower():sorted(v,key=operator.itemgetter(0),reverse=True) for k,v in aucregion.items()}
+    print("Plotting individual network matches for %s ..." % (fn))
+    if net is None:
+        Netlist=list(auc_lower)
+    else:
+        Netlist=net.lower().split(",")
+    for n in Netlist:
+        if not auc_lower.get(n):
+            continue
+        ncols=len(auc_lower[n])
+        if n not in fig_net:
+            fig=plt.figure(figsize=(ncols*5, 10))
+            gs=GridSpec(2,ncols)
+            fig_net[n]=(fig,fig.add_subplot(gs[1,:]),[fig.add_subplot(gs[0,k]) for k in range(ncols)])
+            fig_net[n][1].invert_xaxis()
+        (fig,curr_ax,peak_axs)=fig_net[n]
+        plotting.plot1D(In,Xs,{n:auc_lower[n]},ax=curr_ax,title=fn,net=net)
+        curr_ax.tick_params(axis='both', which='major', labelsize=12)
+        for r,curr_ax in zip(auc_lower[n],peak_axs):
+            curr_ax.plot(Xs,In,'k-')
+            curr_ax.axvspan(r[0], r[1], facecolor='g', alpha=0.1)
+            curr_ax.set_xlim(r[0]-1,r[1]+1)
+            midpt=(r[0]+r[1])/2
+            curr_ax.set_title(fn+" "+str(r[0])+"-"+str(r[1])+"("+str(midpt)+")")
             curr_ax.invert_xaxis()
-            curr_ax.tick_params(axis='both', which='major', labelsize=12)
-            
-            # lines, labels = fig_net[n].axes[-1].get_legend_handles_labels()
-            # fig_net[n].legend(lines, labels, loc = 'upper right')
-            # fig_net[n].tight_layout()
-            # fig.savefig(outimgname)
-
-            auc_lower[n].sort(key = operator.itemgetter(0), reverse = True)
-            print(auc_lower)
-            # ax_net[n][]
-
-            for k,r in enumerate(auc_lower[n]):
-                curr_ax = plt.subplot(gs[0,k])
-                curr_ax.plot(Xs,In,'k-')
-                low_lim=r[0]-1
-                up_lim=r[1]+1
-                curr_ax.axvspan(r[0], r[1], facecolor='g', alpha=0.1)
-                curr_ax.set_xlim(low_lim,up_lim)
-                midpt=(r[0]+r[1])/2
-                title=fn+" "+str(r[0])+"-"+str(r[1])+"("+str(midpt)+")"
-                curr_ax.set_title(title)
-                curr_ax.invert_xaxis()
-                ct[n]+=1
-    # Save individual peak stacks for specified networks (-n flag)    
+
+@instrument.timed('overlay',lambda out, args: {'spectra':len(args[1].split(','))})
+def overlaySpec (pyinetaObj,spec_files,ptsTol,aucTol,intThres,outfilename,outimgname,net,shift=None,method='1d',use=None,savefmt="svg",plot=True,cache=None):
+    """Overlay the matched networks on a list of 1D or Jres spectra.
+
+    Spectra are read one at a time and only kept while they are integrated and, if asked, plotted. Only their areas under the curve are kept for the output file.
+
+    Args:
+        pyinetaObj (Pyineta): The Pyineta object with the matched networks.
+        spec_files (str): Comma-separated list of ft filenames.
+        ptsTol (float): Peaks of a network closer than this along the 13C axis are integrated once.
+        aucTol (float): Width of the window around each peak, in ppm.
+        intThres (float): Peaks with an area of at least this are flagged as present.
+        outfilename (str): Output filename for the areas under the curve.
+        outimgname (str): Output filename for the overlay image.
+        net (str): Comma-separated networks to plot on their own figure, or None for all networks.
+        shift (list, optional): Only for 1D spectra. [padding units, size of the 13C axis, direction] to shift the spectra. Defaults to None.
+        method (str, optional): "1d" or "jres". Defaults to '1d'.
+        use (str, optional): Only for Jres spectra. The projection method. Defaults to None.
+        savefmt (str, optional): Image format of the network figures. Defaults to "svg".
+        plot (bool, optional): Plot the integrated regions. Defaults to True.
+        cache (StepCache, optional): Only for Jres spectra. Step cache for the projections. Defaults to None.
+    """
+
+    filelist=spec_files.split(',')
+    peaks=networkPeaks(pyinetaObj.NetMatch,ptsTol)
+    pts=np.asarray([p[2] for p in peaks],dtype=float)
+    aucs=list()
+    aucregion={Net[0]:list() for Net in pyinetaObj.NetMatch}
+    for (name,tag,Pt,dq) in peaks:
+        aucregion[name].append((Pt-aucTol/2,Pt+aucTol/2))
+    if plot:
+        nrows = len(filelist)
+        fig, axs = plt.subplots(nrows, 1, figsize=(30, nrows*5), sharex=True, squeeze=False)
+        fig_net=dict()
+    for j,filename in enumerate(filelist):
+        (In,Xs)=readSpectrum(filename,method,shift,use,cache)
+        aucs.append(peakAUC(In,Xs,pts,aucTol))
+        if plot:
+            fn=filename.split("/")[-1].rsplit(".",1)[0]
+            plotOverlay(In,Xs,fn,aucregion,net,axs[j,0],fig_net)
+    # Write matches for all networks to a file
+    writeOverlays(filelist,[Net[0] for Net in pyinetaObj.NetMatch],peaks,aucs,intThres,outfilename)
+    if not plot:
+        return
+    # Save individual peak stacks for specified networks (-n flag)
     for n in fig_net:
         outcurrimg=outimgname.rsplit(".",1)[0]+"_"+n+"."+savefmt
-        fig_net[n].tight_layout()
-        fig_net[n].savefig(outcurrimg, dpi=300)
-    # Write 1D matches for all networks to a file
-    writeOverlays(filelist,allAUC,intThres,outfilename)
+        fig_net[n][0].tight_layout()
+        fig_net[n][0].savefig(outcurrimg, dpi=300)
+        plt.close(fig_net[n][0])
     # Save final figure
-    if isinstance(axs,np.ndarray):
-        curr_ax=axs[0]
-    else:
-        curr_ax=axs
-    curr_ax.invert_xaxis()
+    axs[0,0].invert_xaxis()
     lines, labels = fig.axes[-1].get_legend_handles_labels()
     fig.legend(lines, labels, loc = 'upper right')
     fig.tight_layout()
     fig.savefig(outimgname)
+    plt.close(fig)
+
+def integrateSpectrum (filename,pts,aucTol,method='1d',shift=None,use=None,cache=None):
+    """Read a spectrum and integrate it around every network peak.
+
+    Args:
+        filename (str): ft filename.
+        pts (1D-array): The 13C ppm values of the peaks.
+        aucTol (float): Width of the window around each peak, in ppm.
+        method (str, optional): "1d" or "jres". Defaults to '1d'.
+        shift (list, optional): Only for 1D spectra. [padding units, size of the 13C axis, direction] to shift the spectrum. Defaults to None.
+        use (str, optional): Only for Jres spectra. The projection method. Defaults to None.
+        cache (StepCache, optional): Only for Jres spectra. Step cache for the projections. Defaults to None.
+
+    Returns:
+        ndarray : Area under the curve for every peak.
+    """
 
-# def overlayJres (pyinetaObj,filesJres,method='max'):
-#     filelist=filesJres.split(',')
-#     allAUC=dict()
-#     fig, axs = plt.subplots(len(filelist), 1, figsize=(30, 10), sharex=True)
-#     for j,filename in enumerate(filelist):
-#         # Reading 1D file
-#         (In,Xs,Ys)=readJres(filename)
-#         print(pyinetaObj.Cppm)#,pyinetaObj.DQppm)
-#         if method.lower()=='sum':
-#             InProj=np.sum(In,axis=1)
-#         elif method.lower()=='avg':
-#             InProj=np.mean(In,axis=1)
-#         elif method.lower()=='max':
-#             InProj=np.amax(In,axis=1)
-#         # InProj,Xs
-
-        
+    (In,Xs)=readSpectrum(filename,method,shift,use,cache)
+    return(peakAUC(In,Xs,pts,aucTol))
+
+def writeMatrix (filelist,peaks,values,outfilename):
+    """Write a samples by network peaks table.
+
+    Args:
+        filelist (list): The spectrum filenames, one per row.
+        peaks (list): The (network, tag, 13C ppm, DQ ppm) tuples from networkPeaks, one per column.
+        values (ndarray): A 2D array with one row per spectrum and one column per peak.
+        outfilename (str): Output filename (tab-delimited).
+    """
+
+    with open(outfilename, 'w') as out_file:
+        out_file.write('#Sample\t'+'\t'.join("%s:%s(%s,%s)" % p for p in peaks)+'\n')
+        for filename, row in zip(filelist,values):
+            out_file.write(filename+'\t'+'\t'.join(str(v) for v in row)+'\n')
+
+@instrument.timed('cohort',lambda out, args: {'spectra':out[0].shape[0],'peaks':len(out[1])})
+def cohortOverlay (pyinetaObj,spec_files,ptsTol,aucTol,intThres,outfilename,shift=None,method='1d',use=None,procs=1,cache=None):
+    """Integrate the network peaks in a cohort of 1D or Jres spectra on a process pool.
+
+    Every spectrum is read and integrated by a worker process, which only sends back its areas.
+    The areas are written as a tab-delimited table and as a NumPy array (.npy) with the same stem, and the presence calls as a second table (_presence.tsv).
+
+    Args:
+        pyinetaObj (Pyineta): The Pyineta object with the matched networks.
+        spec_files (str): Comma-separated list of ft filenames.
+        ptsTol (float): Peaks of a network closer than this along the 13C axis are integrated once.
+        aucTol (float): Width of the window around each peak, in ppm.
+        intThres (float): Peaks with an area of at least this are called present.
+        outfilename (str): Output filename for the table of areas.
+        shift (list, optional): Only for 1D spectra. [padding units, size of the 13C axis, direction] to shift the spectra. Defaults to None.
+        method (str, optional): "1d" or "jres". Defaults to '1d'.
+        use (str, optional): Only for Jres spectra. The projection method. Defaults to None.
+        procs (int, optional): Number of processes. Defaults to 1.
+        cache (StepCache, optional): Only for Jres spectra. Step cache for the projections. Defaults to None.
+
+    Returns:
+        ndarray : A 2D array of areas under the curve with one row per spectrum and one column per network peak.
+        list : The (network, tag, 13C ppm, DQ ppm) tuples of the columns.
+    """
+
+    if method.lower() not in ('1d','jres'):   # Checked here, an exit in a worker process would hang the pool
+        exit("ERROR: %s not a valid method. Please use 1D or Jres." % (method))
+    if method.lower()=='1d' and shift is not None and not (type(shift) is list and len(shift)==3):
+        exit("ERROR: Argument shift needs to be a list with 3 items:padding units, total size of X axis and direction (either pos or neg). Eg: [20,4096,'pos']")
+    if method.lower()=='jres' and str(use).lower() not in ('sum','avg','max'):
+        exit("ERROR: %s not a valid Jres projection method. Please use either max, sum or avg." % (use))
+    filelist=[f.strip() for f in spec_files.split(',') if f.strip()]
+    peaks=networkPeaks(pyinetaObj.NetMatch,ptsTol)
+    pts=np.asarray([p[2] for p in peaks],dtype=float)
+    run=partial(integrateSpectrum,pts=pts,aucTol=aucTol,method=method,shift=shift,use=use,cache=cache)
+    if procs > 1 and len(filelist) > 1:
+        with Pool(min(procs,len(filelist))) as pool:
+            rows=pool.map(run,filelist,chunksize=1)
+    else:
+        rows=[run(f) for f in filelist]
+    AUC=np.vstack(rows) if rows else np.zeros((0,len(peaks)))
+    stem=outfilename.rsplit(".",1)[0]
+    writeMatrix(filelist,peaks,AUC,outfilename)
+    np.save(stem+".npy",AUC)
+    writeMatrix(filelist,peaks,np.where(AUC>=intThres,"Present","Absent"),stem+"_presence.tsv")
+    return(AUC,peaks)
@@ -3,14 +3,27 @@
 This includes all the function definitions used for reading the NMR ft files and peak picking.
 Includes the following functions:
 	* readFt - Read ft files using nmrglue.
+	* mapFt - Memory-map ft files without reading the data.
+	* regionSlice - Find the index range of an axis covering a ppm range.
+	* readRegion - Read the part of an ft file within a ppm region.
 	* shifting - Shift the spectra as needed for proper referencing.
 	* frange - Generate a range of floats.
+	* findCells - Find the cells of a spectrum above a cutoff intensity.
+	* SparseSpectrum class - A compact coordinate list of the cells above a cutoff intensity.
+	* sparsify - Extract the cells above the minimum picking intensity into a SparseSpectrum.
+	* levelBounds - Assign picking levels to intensities with a sorted-threshold lookup.
+	* candidates - Find the cells above the lowest picking threshold.
 	* pick - Peak picking function.
+	* neighbours - Find the pairs of adjacent cells in a list of cells.
+	* pickRegions - Peak picking by connected regions and local maxima.
 """
 
 import math
 import numpy as np
 import nmrglue as ng
+from scipy import spatial as spatial
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 def readFt (ftfile):
 	"""Read ft files using nmrglue.
@@ -34,6 +47,80 @@ def readFt (ftfile):
 	Xs=CS.ppm_scale()
 	return(In,Xs,Ys)
 
+def mapFt (ftfile):
+	"""Memory-map ft files without reading the data.
+
+	Only the header is read. The intensities are a read-only view on the file, so several processes working on the same spectrum share the page cache.
+
+	Args:
+		ftfile (str): ft filename.
+
+	Returns:
+		ndarray : A read-only memory-mapped array with the intensities.
+		tuple : The unit conversion objects for the double quantum and the 13C axes.
+	"""
+
+	fdata=ng.pipe.get_fdata(ftfile)
+	ft_dic=ng.pipe.fdata2dic(fdata)
+	shape=ng.pipe.find_shape(ft_dic)
+	if ft_dic["FDTRANSPOSED"] == 1:
+		quad=ft_dic["FDF1QUADFLAG"]
+	else:
+		quad=ft_dic["FDF2QUADFLAG"]
+	if ft_dic["FDDIMCOUNT"] != 2 or quad != 1:
+		exit("ERROR: Only real 2D ft files can be memory-mapped. Load %s without memory-mapping instead." % (ftfile))
+	dtype=np.dtype(np.float32)
+	if np.fromfile(ftfile,dtype,512)[2] - 2.345 > 1e-6:	# Same byteswap check as nmrglue
+		dtype=dtype.newbyteorder()
+	ft_data=np.memmap(ftfile,dtype=dtype,mode='r',offset=512*4,shape=shape)
+	In=ft_data.transpose()
+
+	DQ = ng.pipe.make_uc(ft_dic, ft_data, 0)
+	CS = ng.pipe.make_uc(ft_dic, ft_data, 1)
+	return(In,(DQ,CS))
+
+def regionSlice (uc,size,ppmRange):
+	"""Find the index range of an axis covering a ppm range.
+
+	Args:
+		uc (unit_conversion): The nmrglue unit conversion object of the axis.
+		size (int): Number of points along the axis.
+		ppmRange (tuple): The (min,max) ppm values of the range.
+
+	Returns:
+		slice : The slice of the axis with all the points within the ppm range.
+	"""
+
+	# ppm values decrease along the axis, so the highest ppm value gives the first index
+	start=max(int(math.floor(uc.f(max(ppmRange),'ppm'))),0)
+	stop=min(int(math.ceil(uc.f(min(ppmRange),'ppm')))+1,size)
+	return(slice(start,max(stop,start)))
+
+def readRegion (ftfile,Xrng,Yrng,mmap=False):
+	"""Read the part of an ft file within a ppm region.
+
+	Only the slab of the data covering the region is read from the file.
+
+	Args:
+		ftfile (str): ft filename.
+		Xrng (tuple): The (min,max) ppm values along the 13C axis.
+		Yrng (tuple): The (min,max) ppm values along the double quantum axis.
+		mmap (bool, optional): Keep the region as a read-only memory-mapped view instead of reading it. Defaults to False.
+
+	Returns:
+		ndarray : A numpy array with the intensities within the region.
+		tuple : The unit conversion objects for the double quantum and the 13C axes.
+		tuple : The slices of the 13C and double quantum axes covered by the region.
+	"""
+
+	(In,(DQ,CS))=mapFt(ftfile)
+	sX=regionSlice(CS,In.shape[0],Xrng)
+	sY=regionSlice(DQ,In.shape[1],Yrng)
+	In=In[sX,sY]
+	if not mmap:
+		In=np.array(In)
+	return(In,(DQ,CS),(sX,sY))
+
 def shifting (In,pX,fullX,fullY,direction):
 	"""Shift the spectra as needed for proper referencing.
 
@@ -42,27 +129,30 @@ def shifting (In,pX,fullX,fullY,direction):
 	The empty cells are zero filled to complete the output array.
 
 	Args:
-		In (ndarray): Array with the peak intensities.
+		In (ndarray or SparseSpectrum): Array with the peak intensities.
 		pX (int): Units to shift all the peaks (in points; 200 ppm ~ 4000 points).
 		fullX (int): Length of the 13C ppm array (4096 for a typical INADEQUATE spectrum).
 		fullY (int): Length of the DQ ppm array (8192 for a typical INADEQUATE spectrum).
 		direction (str): 'pos' indicates shifting the peaks towards a higher ppm value while 'neg' indicates shifting peaks towards a lower ppm value.
 	
 	Returns:
-		ndarray : Intensity array after shifting of peaks.
+		ndarray or SparseSpectrum : Intensity array after shifting of peaks.
 	"""
 	ratio=fullY/fullX
 	pY=math.ceil(pX*ratio)
+	if isinstance(In,SparseSpectrum):
+		return(In.shift(pX,pY,direction))
+	(sizeX,sizeY)=In.shape	# Smaller than fullX and fullY when only a region was loaded
 	if direction.lower() == "pos":      # For increasing ppm axes (eg: peak at 35 ppm is now at 40 ppm)
-		padX=np.zeros((pX,fullY))   # fullY= 8192 for INADEQUATE
-		padY=np.zeros((fullX,pY))   # fullX=4096 for INADEQUATE
+		padX=np.zeros((pX,sizeY))   # fullY= 8192 for INADEQUATE
+		padY=np.zeros((sizeX,pY))   # fullX=4096 for INADEQUATE
 		In=np.hstack((In,padY))
 		In=In[:,pY:]
 		In=np.concatenate((In,padX))
 		In=In[pX:,:]
 	elif direction.lower() == "neg":        # For decreasing ppm axes (eg: peak at 40 ppm is now at 35 ppm)
-		padX=np.zeros((pX,fullY))   # fullY= 8192 for INADEQUATE
-		padY=np.zeros((fullX,pY))   # fullX=4096 for INADEQUATE
+		padX=np.zeros((pX,sizeY))   # fullY= 8192 for INADEQUATE
+		padY=np.zeros((sizeX,pY))   # fullX=4096 for INADEQUATE
 		In=np.hstack((padY,In)) 
 		In=In[:,:-pY]
 		In=np.concatenate((padX,In))
@@ -88,39 +178,295 @@ def frange (start,end,parts):
 	part_duration = duration / (parts-1)
 	return [start+(i * part_duration) for i in range(parts-1,-1,-1)]
 
-def pick (In,xppm,yppm,PPmin,PPmax,steps):
-	"""Peak picking function.
+def findCells (In,cutoff,rows=256):
+	"""Find the cells of a spectrum above a cutoff intensity.
 
-	This function iterates over a provided range of intensities and collects all cells with intensity values that fall within that range.
+	The absolute intensities are computed over blocks of rows so that the full matrix is never duplicated in memory.
 
 	Args:
 		In (ndarray): Array with the peak intensities.
+		cutoff (float): Cells with an absolute intensity higher than this value are kept.
+		rows (int, optional): Number of rows processed at a time. Defaults to 256.
+
+	Returns:
+		ndarray : Row (13C) indices of the kept cells.
+		ndarray : Column (DQ) indices of the kept cells.
+		ndarray : Intensities of the kept cells.
+	"""
+
+	XindL=[]
+	YindL=[]
+	for r in range(0,In.shape[0],rows):
+		(Xind, Yind) = np.nonzero(np.abs(In[r:r+rows]) > cutoff)
+		XindL.append(Xind+r)
+		YindL.append(Yind)
+	Xind=np.concatenate(XindL) if XindL else np.zeros(0,dtype=np.intp)
+	Yind=np.concatenate(YindL) if YindL else np.zeros(0,dtype=np.intp)
+	return(Xind,Yind,np.asarray(In[Xind,Yind]))
+
+class SparseSpectrum:
+	"""A compact coordinate list of the cells above a cutoff intensity.
+
+	Used in place of the dense intensity matrix when only the cells that can be picked as peaks are needed.
+
+	Attributes:
+		Xind (ndarray): Row (13C) indices of the kept cells.
+		Yind (ndarray): Column (DQ) indices of the kept cells.
+		Intensity (ndarray): Intensities of the kept cells.
+		Cppm (1D-array): A 1D array with the 13C ppm values of the full spectrum.
+		DQppm (1D-array): A 1D array with the double quantum ppm values of the full spectrum.
+		shape (tuple): Shape of the dense intensity matrix.
+		cutoff (float): Cells with an absolute intensity higher than this value were kept.
+	"""
+
+	def __init__(self,Xind,Yind,Intensity,Cppm,DQppm,shape,cutoff):
+		self.Xind=Xind
+		self.Yind=Yind
+		self.Intensity=Intensity
+		self.Cppm=Cppm
+		self.DQppm=DQppm
+		self.shape=tuple(shape)
+		self.cutoff=cutoff
+
+	def __len__(self):
+		return(len(self.Intensity))
+
+	def points(self):
+		"""Get the ppm values of the kept cells.
+
+		Returns:
+			ndarray : 13C ppm values of the kept cells.
+			ndarray : Double quantum ppm values of the kept cells.
+		"""
+
+		return(self.Cppm[self.Xind],self.DQppm[self.Yind])
+
+	def shift(self,pX,pY,direction):
+		"""Shift the kept cells, dropping the ones moved out of the spectrum.
+
+		Args:
+			pX (int): Units to shift along the 13C axis.
+			pY (int): Units to shift along the DQ axis.
+			direction (str): 'pos' or 'neg', see shifting.
+
+		Returns:
+			SparseSpectrum : The shifted coordinate list.
+		"""
+
+		if direction.lower() == "pos":
+			Xind=self.Xind-pX
+			Yind=self.Yind-pY
+		elif direction.lower() == "neg":
+			Xind=self.Xind+pX
+			Yind=self.Yind+pY
+		else:
+			return(self)
+		keep=(Xind>=0) & (Xind<self.shape[0]) & (Yind>=0) & (Yind<self.shape[1])
+		return(SparseSpectrum(Xind[keep],Yind[keep],self.Intensity[keep],self.Cppm,self.DQppm,self.shape,self.cutoff))
+
+def sparsify (In,xppm,yppm,PPmin):
+	"""Extract the cells above the minimum picking intensity into a SparseSpectrum.
+
+	Almost every cell of an INADEQUATE spectrum is below PPmin and can never be picked, so the dense matrix can be released after this step.
+
+	Args:
+		In (ndarray): Array with the peak intensities.
+		xppm (ndarray): A 1D array with the 13C ppm values.
+		yppm (ndarray): A 1D array with the double quantum ppm values.
+		PPmin (float): Minimum intensity value to be considered a peak.
+
+	Returns:
+		SparseSpectrum : Coordinate list with the cells above PPmin.
+	"""
+
+	(Xind,Yind,vals)=findCells(In,int(PPmin))
+	return(SparseSpectrum(Xind,Yind,vals,xppm,yppm,In.shape,int(PPmin)))
+
+def levelBounds (vals,thresholds):
+	"""Assign picking levels to intensities with a sorted-threshold lookup.
+
+	A cell is first picked at the level where its intensity exceeds the integer part of the threshold and stays picked until the level where it exceeds the threshold itself.
+	This reproduces the iterative picking where hits above a threshold are removed before the next iteration.
+
+	Args:
+		vals (ndarray): A 1D array of absolute intensities.
+		thresholds (list): Descending list of thresholds, one per iteration.
+
+	Returns:
+		ndarray : First iteration number each value is picked in (len(thresholds) if never picked).
+		ndarray : Last iteration number each value is picked in.
+	"""
+
+	steps=len(thresholds)
+	dtype=vals.dtype if np.issubdtype(vals.dtype,np.floating) else float	# Compare at the precision of the spectrum
+	cuts=np.asarray(thresholds).astype(dtype)[::-1]
+	intCuts=np.asarray([int(i) for i in thresholds]).astype(dtype)[::-1]
+	first=steps-np.searchsorted(intCuts,vals,side='left')
+	last=np.minimum(steps-np.searchsorted(cuts,vals,side='left'),steps-1)
+	return(first,last)
+
+def candidates (In,thresholds,PPmin):
+	"""Find the cells above the lowest picking threshold.
+
+	Args:
+		In (ndarray or SparseSpectrum): Array with the peak intensities.
+		thresholds (list): The picking thresholds.
+		PPmin (float): Minimum intensity value to be considered a peak.
+
+	Returns:
+		ndarray : Row (13C) indices of the cells.
+		ndarray : Column (DQ) indices of the cells.
+		ndarray : Intensities of the cells.
+	"""
+
+	cutoff=min(int(i) for i in thresholds)
+	if isinstance(In,SparseSpectrum):
+		if cutoff < In.cutoff:
+			exit("ERROR: The sparse spectrum only holds cells above %s. Reload the spectrum to pick peaks with PPmin=%s." % (In.cutoff,PPmin))
+		keep=np.abs(In.Intensity) > cutoff
+		return(In.Xind[keep],In.Yind[keep],In.Intensity[keep])
+	return(findCells(In,cutoff))
+
+def pick (In,xppm,yppm,PPmin,PPmax,steps,intensities=False):
+	"""Peak picking function.
+
+	This function collects all cells with intensity values that fall within each of the intensity levels between PPmin and PPmax.
+	The absolute intensities are computed once and every cell above the lowest level is assigned its levels in a single pass.
+
+	Args:
+		In (ndarray or SparseSpectrum): Array with the peak intensities.
 		xppm (ndarray): A 1D array with the 13C ppm values.
 		yppm (ndarray): A 1D array with the double quantum ppm values.
 		PPmin (float): Minimum intensity value to be considered a peak.
 		PPmax (float): Maximum intensity value to be considered a peak.
 		steps (int): Number of iterations to find peaks within the PPmin to PPmax range.
+		intensities (bool, optional): Also return the intensities of the picked cells. Defaults to False.
 
 	Returns:
 		dict : A dict mapping an array of points (x,y) to the iteration number it was found in.
 		dict : A dict mapping an array of x axis values (13C ppm values) to the iteration number it was found in.
 		dict : A dict mapping an array of y axis values (DQ ppm values) to the iteration number it was found in.
+		dict : Only with intensities. A dict mapping an array of intensities, parallel to the points, to the iteration number it was found in.
+	"""
+
+	thresholds=frange(PPmin,PPmax,steps)
+	(Xind,Yind,vals)=candidates(In,thresholds,PPmin)
+	(first,last)=levelBounds(np.abs(vals),thresholds)
+	X={}
+	Y={}
+	I={}
+	Pts={}
+	for j in range(len(thresholds)):
+		sel=(first<=j) & (last>=j)
+		selX=xppm[Xind[sel]]
+		selY=yppm[Yind[sel]]
+		X[j]=selX
+		Y[j]=selY
+		I[j]=vals[sel]
+		Pts[j]=list(zip(selX,selY))
+	if intensities:
+		return (Pts,X,Y,I)
+	return (Pts,X,Y)
+
+def neighbours (Xind,Yind,shape):
+	"""Find the pairs of adjacent cells in a list of cells.
+
+	Cells are looked up by their linear index with a binary search, so only the listed cells are ever touched.
+
+	Args:
+		Xind (ndarray): Row (13C) indices of the cells.
+		Yind (ndarray): Column (DQ) indices of the cells.
+		shape (tuple): Shape of the spectrum.
+
+	Returns:
+		ndarray : Position of the first cell of each adjacent pair.
+		ndarray : Position of the second cell of each adjacent pair (one of its 8 neighbours).
+	"""
+
+	lin=Xind.astype(np.int64)*shape[1]+Yind
+	order=np.argsort(lin,kind='stable')
+	sortedLin=lin[order]
+	A=[]
+	B=[]
+	for dx in (-1,0,1):
+		for dy in (-1,0,1):
+			if dx == 0 and dy == 0:
+				continue
+			nx=Xind+dx
+			ny=Yind+dy
+			inside=np.nonzero((nx >= 0) & (nx < shape[0]) & (ny >= 0) & (ny < shape[1]))[0]
+			target=nx[inside].astype(np.int64)*shape[1]+ny[inside]
+			pos=np.minimum(np.searchsorted(sortedLin,target),len(sortedLin)-1)
+			found=sortedLin[pos] == target
+			A.append(inside[found])
+			B.append(order[pos[found]])
+	return(np.concatenate(A),np.concatenate(B))
+
+def pickRegions (In,xppm,yppm,PPmin,PPmax,steps):
+	"""Peak picking by connected regions and local maxima.
+
+	For each intensity level between PPmax and PPmin, the cells above the level are split into connected regions (8-connectivity).
+	Every local maximum of a region is reported as one peak, with flat maxima collapsed into one.
+	The cells of a region are assigned to their nearest maximum, and each peak gets the intensity-weighted centroid and the number of its cells.
+
+	Args:
+		In (ndarray or SparseSpectrum): Array with the peak intensities.
+		xppm (ndarray): A 1D array with the 13C ppm values.
+		yppm (ndarray): A 1D array with the double quantum ppm values.
+		PPmin (float): Minimum intensity value to be considered a peak.
+		PPmax (float): Maximum intensity value to be considered a peak.
+		steps (int): Number of iterations to find peaks within the PPmin to PPmax range.
+
+	Returns:
+		dict : A dict mapping an array of peak centroids (x,y) to the iteration number it was found in.
+		dict : A dict mapping an array of x axis values (13C ppm values) to the iteration number it was found in.
+		dict : A dict mapping an array of y axis values (DQ ppm values) to the iteration number it was found in.
+		dict : A dict mapping an array of peak maximum intensities to the iteration number it was found in.
+		dict : A dict mapping an array of peak areas (number of cells) to the iteration number it was found in.
 	"""
 
-	points=np.copy(In)
-	j=0
+	thresholds=frange(PPmin,PPmax,steps)
+	(Xind,Yind,vals)=candidates(In,thresholds,PPmin)
+	absv=np.abs(vals)
+	(first,last)=levelBounds(absv,thresholds)
+	(A,B)=neighbours(Xind,Yind,In.shape)
 	X={}
 	Y={}
+	I={}
+	Area={}
 	Pts={}
-	for i in frange(PPmin,PPmax,steps):
-		(Xind, Yind) = np.where(abs(points) > int(i))
-		points[abs(points) > i] =0    # This removes hit peaks from the previous iteration
-		selX=np.around(xppm[Xind],decimals=2)
-		selY=np.around(yppm[Yind],decimals=2)
-		selX=xppm[Xind]
-		selY=yppm[Yind]
+	for j in range(len(thresholds)):
+		cells=np.nonzero(first<=j)[0]	# Every cell above the level, including the ones picked at earlier levels
+		n=len(cells)
+		if n == 0:
+			(X[j],Y[j],I[j],Area[j],Pts[j])=(np.zeros(0),np.zeros(0),vals[cells],np.zeros(0,dtype=int),[])
+			continue
+		pos=np.full(len(vals),-1)
+		pos[cells]=np.arange(n)
+		edge=(pos[A] >= 0) & (pos[B] >= 0)
+		(a,b)=(pos[A[edge]],pos[B[edge]])
+		v=absv[cells]
+		region=connected_components(coo_matrix((np.ones(len(a)),(a,b)),shape=(n,n)),directed=False)[1]
+		nbMax=np.zeros(n,dtype=v.dtype)
+		np.maximum.at(nbMax,a,v[b])
+		isMax=v >= nbMax
+		# Adjacent maxima have the same intensity, so each connected group of maxima is one flat peak
+		keep=isMax[a] & isMax[b]
+		plateau=connected_components(coo_matrix((np.ones(keep.sum()),(a[keep],b[keep])),shape=(n,n)),directed=False)[1]
+		maxCells=np.nonzero(isMax)[0]
+		rep=np.unique(plateau[maxCells],return_index=True)[1]
+		rep=maxCells[rep]
+		# Assign the cells to the nearest maximum of the same region
+		far=float(In.shape[0]+In.shape[1])
+		coords=np.column_stack((Xind[cells],Yind[cells],region*far)).astype(float)
+		owner=spatial.cKDTree(coords[rep]).query(coords)[1]
+		w=v.astype(float)
+		weight=np.bincount(owner,weights=w,minlength=len(rep))
+		selX=np.bincount(owner,weights=w*xppm[Xind[cells]],minlength=len(rep))/weight
+		selY=np.bincount(owner,weights=w*yppm[Yind[cells]],minlength=len(rep))/weight
 		X[j]=selX
 		Y[j]=selY
+		I[j]=vals[cells[rep]]
+		Area[j]=np.bincount(owner,minlength=len(rep))
 		Pts[j]=list(zip(selX,selY))
-		j=j+1
-	return (Pts,X,Y)
\ No newline at end of file
+	return (Pts,X,Y,I,Area)
@@ -16,13 +16,13 @@ Includes the following funcitons:
 """
 
 import os
-import json
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator
 from shutil import copyfile
 from itertools import combinations
 from matplotlib.axes._axes import _log as matplotlib_axes_logger
+import pyineta.database as database
 matplotlib_axes_logger.setLevel('ERROR')
 
 def plot1D (Intsy,ppm,range,ax=None,title=None,net=None):
@@ -385,7 +385,7 @@ def plotMatches (pyinetaObj,outFolder,db_file,Xlim,Ylim):
 	Args:
 		pyinetaObj (pyineta object): The pyineta object with the spectra.
 		outFolder (str): path to the output folder for the images.
-		db_file (dict): The INETA database in json format.
+		db_file (str): The INETA database filename in json or compiled npz format. Images are read from the db_images_constXYlim folder next to it.
 		Xlim (tuple): Tuple of (min,max) values of the X axis (13C spectrum); (0,200) for a typical INADEQUATE spectra.
 		Ylim (tuple): Tuple of (min,max) values of the Y axis (DQ spectrum); (0,400) for a typical INADEQUATE spectra.
 	"""
@@ -422,7 +422,9 @@ def plotMatches (pyinetaObj,outFolder,db_file,Xlim,Ylim):
 				name=i[j][0]
 				name=name.replace('::','-')
 				name=name.replace('/','-')
-				name +='.eps'
+				# The database images can be built as eps, png or svg
+				ext=next((e for e in ('.eps','.png','.svg') if os.path.isfile(src+"/db_images_constXYlim/"+name+e)),'.eps')
+				name +=ext
 				srcfile=src+"/db_images_constXYlim/"+name
 				destfile=outMatchFigs+name
 				copyfile(srcfile,destfile)
@@ -448,7 +450,7 @@ def plotIndividualMatch(pyinetaObj,db_file,netNum,id,Xlim,Ylim):
 
 	Args:
 		pyinetaObj (pyineta object): The pyineta object with the spectra.
-		db_file (dict): The INETA database in json format.
+		db_file (str): The INETA database filename in json or compiled npz format.
 		netNum (str): The network number to plot (Eg: Network1).
 		id (str): A string identifier that matches part or all of the Internal IDs used for the INETA database entries.
 		Xlim (tuple): Tuple of (min,max) values of the X axis (13C spectrum); (0,200) for a typical INADEQUATE spectra.
@@ -495,8 +497,7 @@ def plotIndividualMatch(pyinetaObj,db_file,netNum,id,Xlim,Ylim):
 	# Plot all the database network name or id matches
 	col=0
 	pos=0
-	with open(db_file, 'r') as json_file:
-		json_db = json.load(json_file)
+	json_db = database.loadDatabase(db_file)
 	for i in json_db:
 		if id in i:
 			axsCom=plotDb(json_db[i]['Networks'],axsCom,colors(col),pos,i)
@@ -2,9 +2,14 @@
 
 This includes the core Pyineta class and function definitions.
 	* Pyineta class - The core Pyineta class.
+		* stepState - Get the results of a pipeline step for the step cache.
+		* restore - Restore the results of a pipeline step from the step cache.
+		* sparsify - Keep only the cells that can be picked as peaks.
 		* pickPeak - Peak picking the input spectra.
 		* clusterPoints - Clustering a list of closely located points.
 		* findNetwork - Find INETA networks in the Pyineta object spectrum.
+		* addPair - Connect one more pair of merged points to the networks.
+		* setNetworks - Set the networks and connected pairs from the network links.
 		* writeNetwork - Write the found networks along with their points to a file.
 		* matchDb - Match the found INETA networks to the database entries.
 		* writeMatches - Write the matches report to a tab-delimited file.
@@ -23,6 +28,7 @@ import pyineta.picking as picking
 import pyineta.clustering as clustering
 import pyineta.finding as finding
 import pyineta.matching as matching
+import pyineta.instrument as instrument
 
 class Pyineta:
 	"""The core Pyineta class.
@@ -30,33 +36,101 @@ class Pyineta:
 	This includes the following attributes:
 
 	Attributes:
-		In (ndarray): A numpy array with the intensities.
+		In (ndarray or SparseSpectrum): A numpy array with the intensities, or the cells above PPmin after sparsify.
 		Cppm (1D-array): A 1D array with the 13C ppm values.
 		DQppm (1D-array): A 1D array with the double quantum ppm values. 
 		Pts (dict): A dict mapping an array of points (x,y) to the iteration number it was found in.
 		Xlist (dict): A dict mapping an array of x axis values (13C ppm values) to the iteration number it was found in.
 		Ylist (dict): A dict mapping an array of y axis values (DQ ppm values) to the iteration number it was found in.
+		Ilist (dict): A dict mapping an array of intensities, parallel to the points, to the iteration number it was found in.
+		Alist (dict): Only with region picking. A dict mapping an array of peak areas (number of cells), parallel to the points, to the iteration number it was found in.
 		clusteredPts (ndarray): An array of center of masses (peak centers) for all the clusters.
 		mergedPts (ndarray): A 2D array of merged points.
 		horzPts (dict): A dict mapping horizontally aligned peaks to their indices.
 		vertPts (dict): A dict mapping lists of clustered points to their respective cluster numbers.
 		Networks (list): list of lists with points belonging to a network.
 		Pairs (list): A list of all horizontally connected pairs of points included in a network.
+		NetIdx (list): list of lists with the indices in mergedPts of the points belonging to a network.
+		PairIdx (ndarray): A 2D array with the indices in mergedPts of all connected pairs of points, parallel to Pairs.
+		PairIndex (tuple): The connected pairs indexed by point, as returned by finding.pairIndex.
+		Links (NetworkLinks): The union-find of the networks, to add more pairs to.
 		NetTag (list): List of Tags for naming the unknown peaks in a network.
 		NetMatch (list): A list of networks with their corresponding hits and hit details.
 
 	"""
 
-	def __init__(self, spectrum):	# Read the ft file using nmrglue
+	# Attributes set by each pipeline step, stored separately in the step cache
+	stepAttributes={
+		'pick':('Pts','Xlist','Ylist','Ilist','Alist'),
+		'cluster':('clusteredPts',),
+		'find':('mergedPts','horzPts','vertPts','Networks','Pairs','NetIdx','PairIdx','PairIndex','Links'),
+		'match':('NetTag','NetMatch'),
+	}
+
+	def __init__(self, spectrum=None, mmap=False, region=None):	# Read the ft file using nmrglue
 		"""The __init__ method.
 
 		Initialize the Pyineta object.
 
 		Args:
-			spectrum (str): input ft filename with the pre-processed NMR spectra.
+			spectrum (str, optional): input ft filename with the pre-processed NMR spectra. An empty object is created if None, to restore step results into. Defaults to None.
+			mmap (bool, optional): Memory-map the spectrum instead of reading it. The ppm axes are then computed on first use. Defaults to False.
+			region (tuple, optional): A ((min,max),(min,max)) tuple of ppm ranges along the 13C and DQ axes. Only this region of the spectrum is read and kept. Defaults to None.
+		"""
+
+		if spectrum is None:
+			return
+		if region is not None:
+			(self.In,self._uc,self._region)=picking.readRegion(spectrum,region[0],region[1],mmap)
+			self._ftFile=spectrum
+		elif mmap:
+			(self.In,self._uc)=picking.mapFt(spectrum)
+			self._ftFile=spectrum
+		else:
+			(self.In,self.Cppm,self.DQppm)=picking.readFt(spectrum)
+
+	def __getattr__(self, name):	# Compute the ppm axes of a memory-mapped or region spectrum on first use
+		if name in ('Cppm','DQppm') and '_uc' in self.__dict__:
+			(DQ,CS)=self._uc
+			(sX,sY)=self.__dict__.get('_region',(slice(None),slice(None)))
+			self.Cppm=CS.ppm_scale()[sX]
+			self.DQppm=DQ.ppm_scale()[sY]
+			return(self.__dict__[name])
+		raise AttributeError("'Pyineta' object has no attribute '%s'" % (name))
+
+	def __getstate__(self):	# Pickle a memory-mapped spectrum by its filename only
+		state=self.__dict__.copy()
+		if isinstance(self.In,np.memmap):
+			del state['In']
+		return(state)
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if 'In' not in state and '_ftFile' in state:
+			(self.In,self._uc)=picking.mapFt(self._ftFile)
+			if '_region' in state:
+				self.In=self.In[self._region]
+
+	def stepState (self,step):
+		"""Get the results of a pipeline step for the step cache.
+
+		Args:
+			step (str): The step name: pick, cluster, find or match.
+
+		Returns:
+			dict : A dict mapping the attributes set by the step to their values.
+		"""
+
+		return({k:getattr(self,k) for k in self.stepAttributes[step] if hasattr(self,k)})
+
+	def restore (self,state):
+		"""Restore the results of a pipeline step from the step cache.
+
+		Args:
+			state (dict): The step results as returned by stepState.
 		"""
 
-		(self.In,self.Cppm,self.DQppm)=picking.readFt(spectrum)
+		self.__dict__.update(state)
 
 	@classmethod
 	def readMat (cls, spectrum, xmat, ymat):	# Read in numpy arrays
@@ -79,8 +153,22 @@ class Pyineta:
 		return cls(In,Cppm,DQppm)
 	
 	# Step 1: Peak Picking
+
+	@instrument.timed('sparsify',lambda out, args: {'cells':len(args[0].In.Intensity)})
+	def sparsify (self,PPmin):
+		"""Keep only the cells that can be picked as peaks.
+
+		Replaces the dense intensity matrix with a coordinate list of the cells above PPmin and releases the dense matrix.
+
+		Args:
+			PPmin (float): Minimum intensity value to be considered a peak.
+		"""
+
+		if not isinstance(self.In,picking.SparseSpectrum):
+			self.In=picking.sparsify(self.In,self.Cppm,self.DQppm,PPmin)
 	
-	def pickPeak (self,PPmin,PPmax,steps,shift=None):
+	@instrument.timed('pick',lambda out, args: {'points_per_level':[len(v) for v in args[0].Pts.values()]})
+	def pickPeak (self,PPmin,PPmax,steps,shift=None,method="cells"):
 		"""Peak picking the input spectra.
 
 		Args:
@@ -88,6 +176,7 @@ class Pyineta:
 			PPmax (float): Maximum intensity value to be considered a peak.
 			steps (int): Number of iterations to find peaks within the PPmin to PPmax range.
 			shift (list, optional): A list with 4 values: units to shift, length of 13C and DQ axes and the direction to shift. Defaults to None.
+			method (str, optional): "cells" picks every cell above each intensity level, "regions" picks one peak per local maximum of the connected regions above each level. Defaults to "cells".
 		"""
 
 		if shift is not None:
@@ -101,16 +190,24 @@ class Pyineta:
 				self.In=picking.shifting(self.In,*shift)
 			else:
 				exit("ERROR: Argument shift needs to be a list with 4 items:padding units, total size of X axis, total size of Y axis and direction (either pos or neg). Eg: [20,4096,8192,'pos']")
-		(self.Pts,self.Xlist,self.Ylist)=picking.pick(self.In,self.Cppm,self.DQppm,PPmin,PPmax,steps)
+		if method == "regions":
+			(self.Pts,self.Xlist,self.Ylist,self.Ilist,self.Alist)=picking.pickRegions(self.In,self.Cppm,self.DQppm,PPmin,PPmax,steps)
+		elif method == "cells":
+			(self.Pts,self.Xlist,self.Ylist,self.Ilist)=picking.pick(self.In,self.Cppm,self.DQppm,PPmin,PPmax,steps,intensities=True)
+			self.__dict__.pop('Alist',None)
+		else:
+			exit("ERROR: Unknown peak picking method %s. Use either cells or regions." % (method))
 
 	# Step 2: Cluster points
 
-	def clusterPoints (self,PPcs,PPdq):
+	@instrument.timed('cluster',lambda out, args: {'centres_per_level':[len(v) for v in args[0].clusteredPts.values()]})
+	def clusterPoints (self,PPcs,PPdq,metric="median"):
 		"""Clustering a list of closely located points.
 
 		Args:
 			PPcs (float): Points found within this threshold along the 13C axis are grouped into a single cluster.
 			PPdq (float): A distance threshold for splitting points into a different cluster along the DQ axis.
+			metric (str, optional): "median", "mean" or "weighted" (intensity-weighted centroid) center of mass for the clusters. Defaults to "median".
 		"""
 		# print(self.Pts)
 		self.clusteredPts={}
@@ -118,13 +215,17 @@ class Pyineta:
 			if len(P)==0: 
 				continue
 			# print(k,len(P))
-			sortedP=clustering.gather(P,float(PPcs),0)
-			ysortedP=clustering.splitY(sortedP,float(PPdq),1)
-			self.clusteredPts[k]=clustering.centerMass(ysortedP,"median")
+			P=np.asarray(P,dtype=float)
+			I=self.Ilist[k] if metric == "weighted" else np.zeros(len(P))
+			(order,labels)=clustering.gatherLabels(P,float(PPcs),0)
+			(P,I)=(P[order],I[order])
+			(order,labels)=clustering.splitLabels(P,labels,float(PPdq),1)
+			self.clusteredPts[k]=clustering.centers(P[order],labels,metric,I[order])
 
 	# Step 3: Find Networks
 
-	def findNetwork (self,levdist,dqt,sumXY,sdt,cst,sel='all'):
+	@instrument.timed('find',lambda out, args: {'merged_points':len(args[0].mergedPts),'horizontal_pairs':len(args[0].horzPts),'networks':len(args[0].Networks),'connected_pairs':len(args[0].Pairs)})
+	def findNetwork (self,levdist,dqt,sumXY,sdt,cst,sel='all',netOrder='index'):
 		"""Find INETA networks in the Pyineta object spectrum.
 
 		Args:
@@ -134,6 +235,7 @@ class Pyineta:
 			sdt (float): Threshold to check of the 2 points are equidistant from the diagonal.
 			cst (float): Points found within this threshold are grouped into a single cluster.
 			sel (str, optional): 'all' or 'last'. Defaults to 'all'.
+			netOrder (str, optional): Order of the points within a network, 'index' or 'networkx'. See finding.NetworkLinks. Defaults to 'index'.
 		"""
 
 		## Find horizontally aligned peaks
@@ -143,20 +245,46 @@ class Pyineta:
 			self.mergedPts=self.clusteredPts[len(self.clusteredPts)-1]
 		else:
 			exit("ERROR: Unknown value for sel. Use either all or last.")
-		(self.horzPts)=finding.horzAlign(self.mergedPts,dqt,sumXY,sdt)
+		(self.horzPts,pairIdx)=finding.horzAlign(self.mergedPts,dqt,sumXY,sdt,indices=True)
 		
 		## Find vertically aligned peaks from the set of horizontally aligned peaks
-		horzMerged = [self.horzPts[k][0] for k in self.horzPts]
-		horzMerged.extend([self.horzPts[k][1] for k in self.horzPts])
-		self.vertPts=clustering.gather(horzMerged,cst,0) # 0 for x-axis, 1 of y-axis
-
-		## Build network from aligned peaks
-		self.Networks=finding.buildNetwork(self.horzPts,self.vertPts)
+		horzIdx=np.concatenate((pairIdx[:,0],pairIdx[:,1]))
+		(order,labels)=clustering.gatherLabels(self.mergedPts[horzIdx],float(cst),0) # 0 for x-axis, 1 of y-axis
+		vertIdx=np.split(horzIdx[order],np.flatnonzero(np.diff(labels))+1) if len(order) else []
+		self.vertPts={ct:[self.mergedPts[i] for i in v] for ct, v in enumerate(vertIdx)}
+
+		## Build network from aligned peaks and list all connected pairs of peaks
+		(Net,pairs,self.Links)=finding.linkNetworks(self.mergedPts,[v.tolist() for v in vertIdx]+pairIdx.tolist(),netOrder)
+		self.setNetworks(Net,pairs)
 		print("Step3.2==> Built ",len(self.Networks)," networks.")
 
-		## Generate a list of all connected pairs of peaks.
-		self.Pairs=finding.listPairs(self.horzPts,self.vertPts)
+	def addPair (self,i,j):
+		"""Connect one more pair of merged points to the networks.
+
+		The pair is added to the union-find kept by findNetwork, so the networks are not rebuilt from scratch.
+
+		Args:
+			i (int): Index in mergedPts of the first point.
+			j (int): Index in mergedPts of the second point.
+		"""
+
+		self.Links.add([i,j])
+		self.setNetworks(self.Links.networks(),self.Links.pairArray())
 
+	def setNetworks (self,Net,pairs):
+		"""Set the networks and connected pairs from the network links.
+
+		Args:
+			Net (list): List of lists of indices in mergedPts of the points belonging to a network.
+			pairs (ndarray): A 2D array with the indices in mergedPts of all connected pairs of points.
+		"""
+
+		(self.NetIdx,self.PairIdx)=(Net,pairs)
+		self.Networks=[[tuple(self.mergedPts[i]) for i in net] for net in self.NetIdx]
+		self.Pairs=[[self.mergedPts[i],self.mergedPts[j]] for i, j in self.PairIdx]
+		self.PairIndex=finding.pairIndex(self.PairIdx,len(self.mergedPts))
+
+	@instrument.timed('writeNetwork')
 	def writeNetwork (self,outFolder,net_file):
 		""" Write the found networks along with their points to a file.
 
@@ -181,11 +309,12 @@ class Pyineta:
 
 	# Step 4: Match Database
 
+	@instrument.timed('match',lambda out, args: {'networks':len(args[0].NetMatch),'matched_networks':sum(1 for i in args[0].NetMatch if len(i)>5)})
 	def matchDb (self,inetaDb,ambig,near,match,topo,hitSc,covSc):
 		""" Match the found INETA networks to the database entries.
 
 		Args:
-			inetaDb (dict): The INETA database in json format.
+			inetaDb (str or MatchIndex): The INETA database filename in json format, or an index already built for it.
 			ambig (float): Amibiguity tolerance (Removes all database entries with ambiguity higher than this tolerance).
 			near (float): Tolerance for distance in the 13C dimension between unknown peak and a match database peak.
 			match (int): Tolerance for number of matches in a single network.
@@ -194,18 +323,19 @@ class Pyineta:
 			covSc (float): Coverage score threshold.
 		"""
 
-		import json
-
+		if isinstance(inetaDb,matching.MatchIndex):
+			index=inetaDb if inetaDb.ambig==float(ambig) else matching.MatchIndex(inetaDb.db,ambig)
+		else:
+			index=matching.MatchIndex.fromFile(inetaDb,ambig)
 		self.NetTag=[]
 		self.NetMatch=[]
 		q=0
 		ct_match=0
 		for Pvals in self.Networks:
 			q=q+1
-			(Ptags,unknownConn,FinalPairs)=matching.prepUnknowns(Pvals,self.Pairs)
-			with open(inetaDb, 'r') as json_file:
-				json_data = json.load(json_file)
-			out=matching.matchDatabase(json_data,Pvals,Ptags,unknownConn,ambig,near,match,topo,hitSc,covSc,q,FinalPairs)
+			pairPos=finding.networkPairs(self.PairIndex,self.NetIdx[q-1]) if hasattr(self,'PairIndex') else None
+			(Ptags,unknownConn,FinalPairs)=matching.prepUnknowns(Pvals,self.Pairs,pairPos)
+			out=matching.matchDatabase(index,Pvals,Ptags,unknownConn,ambig,near,match,topo,hitSc,covSc,q,FinalPairs)
 			self.NetMatch.append(out)
 			self.NetTag.append(Ptags)
 			if (len(out)>5):
@@ -215,6 +345,7 @@ class Pyineta:
 				print("Step4.1==> No matches found for Network",q)
 		print("Matches found for ", ct_match, "Networks out of ",len(self.Networks))
 
+	@instrument.timed('writeMatches')
 	def writeMatches (self,outFolder,match_file):
 		"""Write the matches report to a tab-delimited file.
 
@@ -242,6 +373,7 @@ class Pyineta:
 					outstr+=outline
 			out_file.write(outstr)
 
+	@instrument.timed('summary')
 	def summarize (self,outFolder,filename):
 		"""Write a summary file with the main reports for the entire INETA run.
 
@@ -297,7 +429,7 @@ def readConfig (configFile):
 
 	import configparser
 	config = configparser.ConfigParser()
-	config.read("config.ini")
+	config.read(configFile)
 	param=dict()
 	try:
 		param["Ft_File"]= config.get("PeakPick", "Ft_File")
@@ -315,12 +447,17 @@ def readConfig (configFile):
 		param["Shift13C"]=config.getint("PeakPick","Shift13C")
 		param["Full13C"]=config.getint("PeakPick","Full13C")
 		param["FullDQ"]=config.getint("PeakPick","FullDQ")
+		param["Memory_map"]=config.get("PeakPick","Memory_map",fallback="No")
+		param["Sparse"]=config.get("PeakPick","Sparse",fallback="No")
+		param["Region"]=config.get("PeakPick","Region",fallback="No")
+		param["Pick_method"]= config.get("PeakPick", "Pick_method", fallback="cells")
 		param["PPmin"]= config.getfloat("PeakPick", "PPmin")
 		param["PPmax"]= config.getfloat("PeakPick", "PPmax")
 		param["steps"]= config.getint("PeakPick", "steps")
 		
 		param["PPCS"]= config.getfloat("ClusterPoints", "PPCS")
 		param["PPDQ"]= config.getfloat("ClusterPoints", "PPDQ")
+		param["Center_metric"]= config.get("ClusterPoints", "Center_metric", fallback="median")
 		param["OutImage_cluster_separate"]= config.get("ClusterPoints", "OutImage_cluster_separate")
 		param["OutImage_cluster_complete"]= config.get("ClusterPoints", "OutImage_cluster_complete")
 
@@ -330,6 +467,7 @@ def readConfig (configFile):
 		param["SumXY"]= config.getfloat("FindNetwork", "SumXY")
 		param["SDT"]= config.getfloat("FindNetwork", "SDT")
 		param["CST"]= config.getfloat("FindNetwork", "CST")
+		param["Network_order"]= config.get("FindNetwork", "Network_order", fallback="index")
 		param["Network_output_file"]= config.get("FindNetwork", "Network_output_file")
 		param["OutImage_network_AllNets"]= config.get("FindNetwork", "OutImage_network_AllNets")
 
@@ -343,6 +481,9 @@ def readConfig (configFile):
 		param["Matches_list_output_file"]= config.get("MatchDatabase", "Matches_list_output_file")
 		param["Summary_file"]= config.get("MatchDatabase", "Summary_file")
 
+		param["Cache_dir"]= config.get("Cache", "Cache_dir", fallback="")
+		param["Cache_size"]= config.getfloat("Cache", "Cache_size", fallback=1024)
+
 		param["Files1D"]= config.get("Overlay1D","1D_File_List")
 		param["PeakWidth1D"]= config.getfloat("Overlay1D","Peak_Width_1D")
 		param["Intensity_threshold1D"]= config.getfloat("Overlay1D","Intensity_threshold_1D")
@@ -354,6 +495,7 @@ def readConfig (configFile):
 		param["Shift_1D_val"]= config.getint("Overlay1D","Shift_1D_val")
 		param["Full_1D"]= config.getint("Overlay1D","Full_1D")
 		param['1DImgFmt']= config.get("Overlay1D","OutImageFormat1D")
+		param["Cohort1D_output_file"]= config.get("Overlay1D","Cohort1D_output_file",fallback="file_5Cohort1D.tsv")
 		
 		param["FilesJres"]= config.get("OverlayJres","Jres_File_List")
 		param['JresProjectionMethod']= config.get("OverlayJres","Jres_Projection_Method")
@@ -362,6 +504,7 @@ def readConfig (configFile):
 		param["MatchJres_output_file"]= config.get("OverlayJres","MatchJres_output_file")
 		param["OutImage_MatchJres"]= config.get("OverlayJres","OutImage_MatchJres")
 		param['JresImgFmt']= config.get("OverlayJres","OutImageFormatJres")
+		param["CohortJres_output_file"]= config.get("OverlayJres","CohortJres_output_file",fallback="file_5CohortJres.tsv")
 	except:
 		print("\nERROR: Encountered problems with the config file.")
 		print("\tDo you have an older version?")
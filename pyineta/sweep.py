@@ -0,0 +1,166 @@
+"""Functions for sweeping the FindNetwork and MatchDatabase parameters.
+
+This includes the functions used by PyINETA to evaluate many parameter combinations from a single set of picked and clustered points.
+Networks are found once for every combination of the FindNetwork parameters in each process that evaluates it, and matched for every combination of the MatchDatabase parameters.
+Includes the following functions:
+	* parseGrid - Parse parameter grids given as NAME=value1,value2 strings.
+	* scoreStats - Summarize the hit and coverage scores of a set of matches.
+	* initSweep - Share the clustered points and the database index with a worker process.
+	* sweepNetworks - Find and match networks for one FindNetwork combination and a list of MatchDatabase combinations.
+	* runSweep - Evaluate all parameter combinations on a process pool and write a table of the results.
+"""
+
+import io
+import math
+import itertools
+import contextlib
+import numpy as np
+from functools import partial
+from multiprocessing import Pool
+import pyineta.pyineta as pyineta
+
+# Config parameters that can be swept and the type of their values
+findParams={'LevelPointsDistance':float,'DQT':float,'SumXY':float,'SDT':float,'CST':float}
+matchParams={'CSMT':float,'Match_tolerance':int,'Topology_tolerance':float,'Hit_Score_threshold':float,'Coverage_Score_threshold':float}
+
+# Clustered points, database index and last found networks of the current process, set by initSweep
+shared=dict()
+
+def parseGrid (specs):
+	"""Parse parameter grids given as NAME=value1,value2 strings.
+
+	Args:
+		specs (list): List of NAME=value1,value2,... strings, one per swept parameter.
+
+	Returns:
+		dict : A dict mapping the parameter names to their list of values.
+	"""
+
+	grid=dict()
+	for spec in specs:
+		if '=' not in spec:
+			exit("ERROR: Parameter grid %s should look like NAME=value1,value2." % (spec))
+		(name,values)=spec.split('=',1)
+		name=name.strip()
+		if name in findParams:
+			cast=findParams[name]
+		elif name in matchParams:
+			cast=matchParams[name]
+		else:
+			exit("ERROR: Cannot sweep %s. Use one of %s." % (name,', '.join(list(findParams)+list(matchParams))))
+		try:
+			grid[name]=[cast(v) for v in values.split(',') if v.strip()]
+		except ValueError:
+			exit("ERROR: Values for %s should be numbers: %s" % (name,values))
+	return(grid)
+
+def scoreStats (NetMatch):
+	"""Summarize the hit and coverage scores of a set of matches.
+
+	Args:
+		NetMatch (list): The networks with their hits as set by Pyineta.matchDb.
+
+	Returns:
+		list : Number of matched networks, number of hits, and the min, median and max hit and coverage scores.
+	"""
+
+	hitScores=[]
+	covScores=[]
+	matched=0
+	for i in NetMatch:
+		if len(i)>5:
+			matched+=1
+			for j in range(5,len(i)):
+				hitScores.append(i[j][5])
+				covScores.append(i[j][6])
+	stats=[matched,len(hitScores)]
+	for scores in (hitScores,covScores):
+		if scores:
+			stats.extend(np.around(np.percentile(scores,[0,50,100]),decimals=3).tolist())
+		else:
+			stats.extend(['NA']*3)
+	return(stats)
+
+def initSweep (state,index):
+	"""Share the clustered points and the database index with a worker process.
+
+	Used as the initializer of the process pool, so it works with both the fork and the spawn start methods.
+
+	Args:
+		state (dict): The clustered points as returned by Pyineta.stepState for the cluster step.
+		index (MatchIndex): The database index to match against.
+	"""
+
+	shared.clear()
+	shared['state']=state
+	shared['index']=index
+
+def sweepNetworks (findValues,matchCombos,param):
+	"""Find and match networks for one FindNetwork combination and a list of MatchDatabase combinations.
+
+	The networks found for the last FindNetwork combination are kept, so consecutive lists of MatchDatabase combinations for the same FindNetwork combination only find them once.
+
+	Args:
+		findValues (dict): Values of the FindNetwork parameters.
+		matchCombos (list): List of dicts with values of the MatchDatabase parameters.
+		param (dict): The parameters read from the config file.
+
+	Returns:
+		list : One row of results per MatchDatabase combination.
+	"""
+
+	spec=pyineta.Pyineta()
+	spec.restore(shared['state'])
+	findKey=tuple(findValues[k] for k in findParams)
+	rows=[]
+	with contextlib.redirect_stdout(io.StringIO()):	# Keep the per-network reports of every combination out of the log
+		if shared.get('findKey') == findKey:
+			spec.restore(shared['found'])
+		else:
+			spec.findNetwork(findValues['LevelPointsDistance'],findValues['DQT'],findValues['SumXY'],findValues['SDT'],findValues['CST'],netOrder=param['Network_order'].lower())
+			(shared['findKey'],shared['found'])=(findKey,spec.stepState('find'))
+		counts=[spec.mergedPts.shape[0],len(spec.horzPts),len(spec.Networks)]
+		for matchValues in matchCombos:
+			spec.matchDb(shared['index'],param['Ambiguity'],matchValues['CSMT'],matchValues['Match_tolerance'],matchValues['Topology_tolerance'],matchValues['Hit_Score_threshold'],matchValues['Coverage_Score_threshold'])
+			rows.append([findValues[k] for k in findParams]+[matchValues[k] for k in matchParams]+counts+scoreStats(spec.NetMatch))
+	return(rows)
+
+def runSweep (state,index,param,grid,outfilename,procs=1):
+	"""Evaluate all parameter combinations on a process pool and write a table of the results.
+
+	Parameters not in the grid keep their config file values.
+	Every FindNetwork combination is split into lists of MatchDatabase combinations so that all processes are used even when only MatchDatabase parameters are swept.
+
+	Args:
+		state (dict): The clustered points as returned by Pyineta.stepState for the cluster step.
+		index (MatchIndex): The database index to match against.
+		param (dict): The parameters read from the config file.
+		grid (dict): A dict mapping the swept parameter names to their list of values.
+		outfilename (str): Output filename for the tab-delimited table of results.
+		procs (int, optional): Number of processes. Defaults to 1.
+
+	Returns:
+		int : The number of parameter combinations evaluated.
+	"""
+
+	findGrid=[grid.get(k,[param[k]]) for k in findParams]
+	matchGrid=[grid.get(k,[param[k]]) for k in matchParams]
+	findCombos=[dict(zip(findParams,v)) for v in itertools.product(*findGrid)]
+	matchCombos=[dict(zip(matchParams,v)) for v in itertools.product(*matchGrid)]
+	nChunks=min(len(matchCombos),math.ceil(procs/len(findCombos)))
+	bounds=[len(matchCombos)*i//nChunks for i in range(nChunks+1)]
+	units=[(f,matchCombos[bounds[i]:bounds[i+1]]) for f in findCombos for i in range(nChunks)]
+	run=partial(sweepNetworks,param=param)
+	if procs > 1:
+		with Pool(procs,initializer=initSweep,initargs=(state,index)) as pool:
+			results=pool.starmap(run,units,chunksize=1)
+	else:
+		initSweep(state,index)
+		results=[run(*u) for u in units]
+	header=list(findParams)+list(matchParams)+['MergedPoints','HorizontalPairs','Networks','MatchedNetworks','Hits','HitScore_min','HitScore_median','HitScore_max','CoverageScore_min','CoverageScore_median','CoverageScore_max']
+	with open(outfilename, 'w') as out_file:
+		out_file.write('#'+'\t'.join(header)+'\n')
+		for rows in results:
+			for row in rows:
+				out_file.write('\t'.join(str(v) for v in row)+'\n')
+	return(len(findCombos)*len(matchCombos))
@@ -10,13 +10,28 @@ Or portions can be used to combine with other custom scripts to utilize the diff
 
 import argparse
 import os
-import pickle
+import glob
+from functools import partial
+from multiprocessing import Pool
 import numpy as np
 import matplotlib.pyplot as plt
 import pyineta.pyineta as pyineta
 import pyineta.plotting as plotting
 import pyineta.picking as picking
+import pyineta.matching as matching
 import pyineta.overlays as overlays
+import pyineta.sweep as sweep
+from pyineta.cache import StepCache, stepKey
+import pyineta.instrument as instrument
+
+# Database indexes built once in the parent process of a batch run and handed to every worker by initBatch
+sharedDb=dict()
+
+# Order of the cached pipeline steps
+stepOrder=['load','pick','cluster','find','match']
+
+# Selections that only report or plot the results of earlier runs, read from the step cache without rerunning any step
+reportSteps={'plot','summary','singleplot','overlay1d','overlayjres','cohort1d','cohortjres'}
 
 
 def main(args):
@@ -25,143 +40,361 @@ def main(args):
 
 	print("Step0.1==> Reading Config file...", end=" ")
 	param=pyineta.readConfig(args.configfile)
-	Xrng=(param['Xrange_min'],param['Xrange_max'])
-	Yrng=(param['Yrange_min'],param['Yrange_max'])
 	print("..Done.")
-		
-	## Read the NMR Ft or data matrix file
-
-	if args.steps.lower() in {'all','load','load+'}:
-		print("Step0.2==> Loading NMR file...", end=' ')
-		try:
-			spec=pyineta.Pyineta(param['Ft_File'])
-		except FileNotFoundError:
-			print("\nTrying to load from data matrix file.")
-			try:
-				Intsy = np.loadtxt(param['Data_Matrix_File'],dtype=np.float32)
-				Xs = np.loadtxt(param['13C_Ppm_File'],dtype=np.float32)
-				Ys = np.loadtxt(param['Double_Quantum_File'], dtype=np.float32)
-				spec=pyineta.Pyineta(Intsy,Xs,Ys)
-			except:
-				print("ERROR: No input files found as specified in the config file.")
-				print("\tPlease check the [Ft_File] or the [Data_Matrix_File, 13C_Ppm_File and Double_Quantum_File] options in the config file.")
-				exit(0)
+
+	if args.batch is None:
+		runSample(args,param)
+	else:
+		runBatch(args,param)
+
+def listSamples(batch):
+	"""List the samples for a batch run.
+
+	Args:
+		batch (str): A manifest file with one Ft file per line (optionally followed by a tab and a sample name), a directory with Ft files or a glob pattern.
+
+	Returns:
+		list : List of (sample name, Ft filename) tuples.
+	"""
+
+	samples=list()
+	if os.path.isfile(batch):
+		with open(batch, 'r') as inf:
+			for line in inf:
+				line=line.strip()
+				if not line or line.startswith('#'):
+					continue
+				cols=line.split('\t')
+				name=cols[1] if len(cols)>1 else os.path.splitext(os.path.basename(cols[0]))[0]
+				samples.append((name,cols[0]))
+	else:
+		if os.path.isdir(batch):
+			batch=os.path.join(batch,'*.ft')
+		for ftfile in sorted(glob.glob(batch)):
+			samples.append((os.path.splitext(os.path.basename(ftfile))[0],ftfile))
+	if not samples:
+		exit("ERROR: No Ft files found for batch %s." % (batch))
+	names=[i[0] for i in samples]
+	if len(set(names)) < len(names):
+		exit("ERROR: Sample names in batch %s are not unique. Provide names in the manifest file." % (batch))
+	return(samples)
+
+def initBatch(dbfile,index):
+	"""Set the database index in a batch worker process.
+
+	Used as the pool initializer so the index reaches the workers with any start method, not only with fork.
+
+	Args:
+		dbfile (str): The database filename, as given in the config file.
+		index (MatchIndex): The database index, or None if the selected steps do not match the database.
+	"""
+
+	sharedDb.clear()
+	if index is not None:
+		sharedDb[dbfile]=index
+
+def runBatchSample(sample,args,param):
+	"""Run the pipeline for one sample of a batch in its own output folder.
+
+	Args:
+		sample (tuple): (sample name, Ft filename) of the sample.
+		args (Namespace): The command line options of the batch run.
+		param (dict): The parameters read from the config file.
+
+	Returns:
+		tuple : (sample name, Ft filename, status) where status is Done or the reason the run stopped.
+	"""
+
+	(name,ftfile)=sample
+	sampleArgs=argparse.Namespace(**vars(args))
+	sampleArgs.outdir=os.path.join(args.outdir,name)
+	sampleArgs.procs=1	# Samples already run in parallel
+	sampleParam=dict(param)
+	sampleParam['Ft_File']=ftfile
+	sampleParam['Data_Matrix_File']=''	# Never fall back to the data matrix of the config file
+	try:
+		runSample(sampleArgs,sampleParam)
+	except SystemExit as err:
+		return(name,ftfile,"Stopped: "+str(err.code))
+	except Exception as err:
+		return(name,ftfile,"Failed: "+repr(err))
+	return(name,ftfile,"Done")
+
+def runBatch(args,param):
+	"""Run the pipeline for all samples of a batch on a process pool.
+
+	Each sample is written to a subfolder of the output folder named after the sample.
+	The database is loaded once and passed to every worker by the pool initializer.
+
+	Args:
+		args (Namespace): The command line options.
+		param (dict): The parameters read from the config file.
+	"""
+
+	samples=listSamples(args.batch)
+	if not os.path.exists(args.outdir):
+		os.makedirs(args.outdir)
+	if not param['Cache_dir']:	# All samples share one step cache
+		param['Cache_dir']=os.path.join(args.outdir,'pyineta_cache')
+	index=None
+	if args.steps.lower() in {'all','load+','pick+','cluster+','find+','match','match+'}:
+		print("Batch==> Loading database",param['Database_file'],"...", end=' ')
+		index=matching.MatchIndex.fromFile(param['Database_file'],param['Ambiguity'])
+		print("..Done.")
+	print("Batch==> Running",len(samples),"samples on",args.procs,"processes...")
+	run=partial(runBatchSample,args=args,param=param)
+	if args.procs > 1:
+		with Pool(args.procs,initializer=initBatch,initargs=(param['Database_file'],index)) as pool:
+			results=pool.map(run,samples,chunksize=1)
+	else:
+		initBatch(param['Database_file'],index)
+		results=[run(sample) for sample in samples]
+	summary_file=os.path.join(args.outdir,"Batch_summary.tsv")
+	with open(summary_file, 'w') as outf:
+		outf.write("#Sample\tFt_File\tStatus\n")
+		for result in results:
+			outf.write("\t".join(result)+"\n")
+	done=sum(1 for i in results if i[2] == "Done")
+	print("Batch==> Finished %d of %d samples. Status written to %s" % (done,len(samples),summary_file))
+
+def shiftUnits(param):
+	# Padding units for shifting the spectrum before peak picking, if enabled
+	if param["Shift"].lower() == "yes":
+		return([param["Shift13C"],param["Full13C"],param["FullDQ"],param["Direction"]])
+	return(None)
+
+def shiftUnits1D(param):
+	# Padding units for shifting the 1D spectra before overlaying, if enabled
+	if param["Shift_1D"].lower() == "yes":
+		return([param["Shift_1D_val"],param["Full_1D"],param["Direction_1D"]])
+	return(None)
+
+def spectrumRegion(param):
+	# ppm region of the Ft file to load, if only the Xrange and Yrange region is analysed
+	if param["Region"].lower() == "yes":
+		return(((param['Xrange_min'],param['Xrange_max']),(param['Yrange_min'],param['Yrange_max'])))
+	return(None)
+
+def stepKeys(param,cache,last='match'):
+	"""Build the step cache keys for the pipeline steps up to the given step.
+
+	Each key depends on the input spectrum and on the parameters of its own step and all the steps before it.
+
+	Args:
+		param (dict): The parameters read from the config file.
+		cache (StepCache): The step cache.
+		last (str, optional): The last step to build a key for. Defaults to 'match'.
+
+	Returns:
+		dict : A dict mapping the step names to their keys.
+	"""
+
+	try:
+		if os.path.isfile(param['Ft_File']):
+			source=cache.fileDigest(param['Ft_File'])
 		else:
-			pickle.dump(spec, open('ptf_pyINETAObj.pickle', 'wb'))
-			print("..Done.")
+			source='+'.join(cache.fileDigest(param[i]) for i in ('Data_Matrix_File','13C_Ppm_File','Double_Quantum_File'))
+	except OSError:
+		print("ERROR: No input files found as specified in the config file.")
+		print("\tPlease check the [Ft_File] or the [Data_Matrix_File, 13C_Ppm_File and Double_Quantum_File] options in the config file.")
+		exit(0)
+	keys=dict()
+	keys['load']=source
+	keys['pick']=stepKey(keys['load'],'pick',[param['PPmin'],param['PPmax'],param['steps'],shiftUnits(param),spectrumRegion(param),param['Pick_method'].lower()])
+	keys['cluster']=stepKey(keys['pick'],'cluster',[param['PPCS'],param['PPDQ'],param['Center_metric'].lower()])
+	keys['find']=stepKey(keys['cluster'],'find',[param['LevelPointsDistance'],param['DQT'],param['SumXY'],param['SDT'],param['CST'],param['Network_order'].lower()])
+	if last == 'match':
+		if not os.path.isfile(param['Database_file']):
+			exit("ERROR: Database file %s not found." % (param['Database_file']))
+		dbKey=cache.fileDigest(param['Database_file'])
+		keys['match']=stepKey(keys['find'],'match',[dbKey,param['Ambiguity'],param['CSMT'],param['Match_tolerance'],param['Topology_tolerance'],param['Hit_Score_threshold'],param['Coverage_Score_threshold']])
+	return(keys)
+
+def cachedState(cache,keys,step,sel):
+	"""Get the cached results of a pipeline step.
+
+	Selections that only report or plot earlier results never rerun a step, so they stop with an error naming the first step that is not cached.
+
+	Args:
+		cache (StepCache): The step cache.
+		keys (dict): The step keys as returned by stepKeys.
+		step (str): The step name.
+		sel (str): The selected steps.
+
+	Returns:
+		dict : The step results as returned by Pyineta.stepState, or None if the step has to be run.
+	"""
+
+	state=cache.get(keys[step])
+	if state is None and sel in reportSteps:
+		exit("ERROR: No cached results for the %s step with the parameters in the config file. -s %s only reads cached results; run the pipeline first, eg with -s all or -s %s+." % (step,sel,step))
+	return(state)
+
+@instrument.timed('load',lambda out, args: {'cells':int(np.prod(np.shape(out.In)))})
+def loadSpectrum(param):
+	"""Read the NMR Ft file, or the data matrix files if there is no Ft file.
+
+	Args:
+		param (dict): The parameters read from the config file.
+
+	Returns:
+		pyineta object : The pyineta object with the spectra.
+	"""
+
+	print("Step0.2==> Loading NMR file...", end=' ')
+	if os.path.isfile(param['Ft_File']):
+		spec=pyineta.Pyineta(param['Ft_File'],mmap=(param["Memory_map"].lower() == "yes"),region=spectrumRegion(param))
+	else:
+		print("\nTrying to load from data matrix file.")
+		spec=pyineta.Pyineta()
+		spec.In = np.loadtxt(param['Data_Matrix_File'],dtype=np.float32)
+		spec.Cppm = np.loadtxt(param['13C_Ppm_File'],dtype=np.float32)
+		spec.DQppm = np.loadtxt(param['Double_Quantum_File'], dtype=np.float32)
+	if param["Sparse"].lower() == "yes":
+		spec.sparsify(param['PPmin'])
+	print("..Done.")
+	return(spec)
+
+def runSample(args,param):
+	"""Run the selected steps of the pipeline for a single spectrum and write the timings report.
+
+	The wall time, CPU time, peak memory and counts of every step are written to a json file named after the Summary_file, even if the run stops early.
+
+	Args:
+		args (Namespace): The command line options.
+		param (dict): The parameters read from the config file.
+	"""
+
+	## Create output folder if does not exists
+	if not os.path.exists(args.outdir):
+		os.makedirs(args.outdir)
+
+	instrument.reset(os.path.join(args.outdir,'profile') if args.profile else None)
+	try:
+		runSteps(args,param)
+	finally:
+		report_file=os.path.join(args.outdir,param['Summary_file'].rsplit('.',1)[0]+"_timings.json")
+		instrument.writeReport(report_file,{'Ft_File':param['Ft_File'],'selected_steps':args.steps})
+
+def runSteps(args,param):
+	"""Run the selected steps of the pipeline for a single spectrum.
+
+	Args:
+		args (Namespace): The command line options.
+		param (dict): The parameters read from the config file.
+	"""
+
+	Xrng=(param['Xrange_min'],param['Xrange_max'])
+	Yrng=(param['Yrange_min'],param['Yrange_max'])
+
+	## Results of earlier steps are reused from the step cache, the spectrum is only read when peak picking has to be rerun
+
+	sel=args.steps.lower()
+	cacheDir=param['Cache_dir'] or os.path.join(args.outdir,'pyineta_cache')
+	cache=StepCache(cacheDir,int(param['Cache_size']*2**20))
+	if sel == 'load':
+		exit("ERROR: The spectrum is only read when peak picking runs and is not cached on its own. Use -s pick or -s load+ instead of -s load.")
+	last={'pick':'pick','cluster':'cluster','sweep':'cluster','find':'find'}.get(sel,'match')
+	needed=stepOrder[:stepOrder.index(last)+1]
+	keys=stepKeys(param,cache,last)
+	spec=pyineta.Pyineta()
 
-	## Check for the presence of the pyineta object pickle file to load data from for subsequent steps.
-	
-	if args.steps.lower() not in {'all','load','load+'}:
-		if not os.path.isfile("ptf_pyINETAObj.pickle"):
-			print("ERROR: PyINETA object file not found. Please run the load module with -s load option first.")
-			exit(0)
-	
 	## Step 1: Peak Picking
 
 	PPmin=param['PPmin']
 	PPmax=param['PPmax']
 	steps=param['steps']
 
-	if args.steps.lower() in {'all','pick','load+','pick+'}:
-
-		if args.steps.lower() in {'pick','pick+'}:
-			with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
-
-		if param["Shift"].lower() == "yes":
-			padUnits=[param["Shift13C"],param["Full13C"],param["FullDQ"],param["Direction"]]
+	if 'pick' in needed:
+		state=cachedState(cache,keys,'pick',sel)
+		if state is not None:
+			spec.restore(state)
+			print("Step1==> Reusing cached peak picking results.")
 		else:
-			padUnits=None
-		print("Step1==> Peak picking with cutoffs min =","{:.2e}".format(PPmin),"and max =","{:.2e}".format(PPmax), "with ",steps," steps...", end=' ')
-		try:
-			spec.pickPeak(PPmin,PPmax,steps,padUnits)
-		except AttributeError as atte:
-			pyineta.stepError(atte)
-		pickle.dump(spec, open('ptf_pyINETAObj.pickle', 'wb'))
-		print("..Done.")
+			spec=loadSpectrum(param)
+			print("Step1==> Peak picking with cutoffs min =","{:.2e}".format(PPmin),"and max =","{:.2e}".format(PPmax), "with ",steps," steps...", end=' ')
+			spec.pickPeak(PPmin,PPmax,steps,shiftUnits(param),param['Pick_method'].lower())
+			cache.put(keys['pick'],spec.stepState('pick'))
+			print("..Done.")
 
 	## Step 2: Cluster points
 
 	PPcs=param['PPCS']
 	PPdq=param['PPDQ']
 
-	if args.steps.lower() in {'all','cluster','load+','pick+','cluster+'}:
-
-		if args.steps.lower() in {'cluster','cluster+'}:
-			with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
-
-		
-		print("Step2==> Clustering points using PPCS=",PPcs,"and PPDQ=",PPdq,"and finding center of mass for clustered points...", end=' ')
-		try:
-			spec.clusterPoints(PPcs,PPdq)
-		except AttributeError as atte:
-			pyineta.stepError(atte)
-		pickle.dump(spec, open('ptf_pyINETAObj.pickle', 'wb'))
-		print("..Done.")
+	if 'cluster' in needed:
+		state=cachedState(cache,keys,'cluster',sel)
+		if state is not None:
+			spec.restore(state)
+			print("Step2==> Reusing cached clustering results.")
+		else:
+			print("Step2==> Clustering points using PPCS=",PPcs,"and PPDQ=",PPdq,"and finding",param['Center_metric'],"center of mass for clustered points...", end=' ')
+			spec.clusterPoints(PPcs,PPdq,param['Center_metric'].lower())
+			cache.put(keys['cluster'],spec.stepState('cluster'))
+			print("..Done.")
 
-	## Create output folder if does not exists
-	if not os.path.exists(args.outdir):
-		os.makedirs(args.outdir)
+	## Sweep the FindNetwork and MatchDatabase parameters from the clustered points
+
+	if sel == 'sweep':
+		if not args.grid:
+			parser.error("-s sweep requires at least one -g NAME=value1,value2 parameter grid.")
+		grid=sweep.parseGrid(args.grid)
+		inetaDb=param['Database_file']
+		index=sharedDb.get(inetaDb)
+		if index is None or index.ambig != float(param['Ambiguity']):
+			index=matching.MatchIndex.fromFile(inetaDb,param['Ambiguity'])
+		sweep_file=os.path.join(args.outdir,"file_Sweep.tsv")
+		print("Step3==> Sweeping",', '.join(grid),"over",np.prod([len(v) for v in grid.values()]),"combinations...", end=' ')
+		ct=sweep.runSweep(spec.stepState('cluster'),index,param,grid,sweep_file,args.procs)
+		print("..Done. Results for",ct,"combinations written to",sweep_file)
+		return
 
 	## Step 3: Find Networks
 	
-	if args.steps.lower() in {'all','find','load+','pick+','cluster+','find+'}:
-
-		if args.steps.lower() in {'find','find+'}:
-			with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
-
-		levdist=param['LevelPointsDistance']
-		dqt=param['DQT']
-		sumXY=param['SumXY']
-		sdt=param['SDT']
-		cst=param['CST']
-		print("Step3==> Finding networks...")
-		try:
-			spec.findNetwork(levdist,dqt,sumXY,sdt,cst)
-		except AttributeError as atte:
-			pyineta.stepError(atte)
-		#
-		net_file=param['Network_output_file']
-		spec.writeNetwork(args.outdir,net_file)
-		pickle.dump(spec, open('ptf_pyINETAObj.pickle', 'wb'))
-		print("...Done.")
+	if 'find' in needed:
+		state=cachedState(cache,keys,'find',sel)
+		if state is not None:
+			spec.restore(state)
+			print("Step3==> Reusing cached networks.")
+		else:
+			levdist=param['LevelPointsDistance']
+			dqt=param['DQT']
+			sumXY=param['SumXY']
+			sdt=param['SDT']
+			cst=param['CST']
+			print("Step3==> Finding networks...")
+			spec.findNetwork(levdist,dqt,sumXY,sdt,cst,netOrder=param['Network_order'].lower())
+			cache.put(keys['find'],spec.stepState('find'))
+			print("...Done.")
+		if sel in {'all','find','load+','pick+','cluster+','find+'}:
+			net_file=param['Network_output_file']
+			spec.writeNetwork(args.outdir,net_file)
 
 	## Step 4: Match Database
 
 	inetaDb=param['Database_file']
 	
-	if args.steps.lower() in {'all','match','load+','pick+','cluster+','find+','match+'}:
-
-		if args.steps.lower() in {'match','match+'}:
-			with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
-
-		ambig=param['Ambiguity']
-		near=param['CSMT']
-		match=param['Match_tolerance']
-		topo=param['Topology_tolerance']
-		hitSc=param['Hit_Score_threshold']
-		covSc=param['Coverage_Score_threshold']
-		print("Step4==> Searching database",inetaDb,"for matches...")
-		try:
-			spec.matchDb(inetaDb,ambig,near,match,topo,hitSc,covSc)
-		except AttributeError as atte:
-			pyineta.stepError(atte)
-		#
-		match_file= param['Matches_list_output_file']
-		spec.writeMatches(args.outdir,match_file)
-		pickle.dump(spec, open('ptf_pyINETAObj.pickle', 'wb'))
-		print("...Done.")
-
-	if args.steps.lower() in {'all','summary','load+','pick+','cluster+','find+','match+'}:
-		
-		if args.steps.lower() in {'summary'}:
-			with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
+	if 'match' in needed:
+		state=cachedState(cache,keys,'match',sel)
+		if state is not None:
+			spec.restore(state)
+			print("Step4==> Reusing cached database matches.")
+		else:
+			ambig=param['Ambiguity']
+			near=param['CSMT']
+			match=param['Match_tolerance']
+			topo=param['Topology_tolerance']
+			hitSc=param['Hit_Score_threshold']
+			covSc=param['Coverage_Score_threshold']
+			print("Step4==> Searching database",inetaDb,"for matches...")
+			spec.matchDb(sharedDb.get(inetaDb,inetaDb),ambig,near,match,topo,hitSc,covSc)
+			cache.put(keys['match'],spec.stepState('match'))
+			print("...Done.")
+		if sel in {'all','match','load+','pick+','cluster+','find+','match+'}:
+			match_file= param['Matches_list_output_file']
+			spec.writeMatches(args.outdir,match_file)
 
+	if sel in {'all','summary','load+','pick+','cluster+','find+','match+'}:
 		summary_file=param['Summary_file']
 		spec.summarize(args.outdir,summary_file)
 	
@@ -169,9 +402,6 @@ def main(args):
 	
 	if args.steps.lower() in {'overlay1d'}:
 		
-		with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
-		
 		files1D=param['Files1D']
 		peakWidth1D=param['PeakWidth1D']
 		intThres1D=param['Intensity_threshold1D']
@@ -180,23 +410,16 @@ def main(args):
 		out_1dallImg=param['OutImage_Match1d']
 		out_img51=args.outdir+"/"+out_1dallImg
 		savefmt=param['1DImgFmt']
-
-		if param["Shift_1D"].lower() == "yes":
-			padUnits=[param["Shift_1D_val"],param["Full_1D"],param["Direction_1D"]]
-		else:
-			padUnits=None
+		padUnits=shiftUnits1D(param)
 
 		print("Step5==> Overlaying INETA results with provided 1D spectra...")
 		# (fig,curraxs)=plotting.plotNetwork(spec,Xrng,Yrng,PPcs,PPdq,out_file3)
-		overlays.overlaySpec(spec,files1D,PPcs,peakWidth1D,intThres1D,out_file51,out_img51,net=args.net,shift=padUnits,method='1D',savefmt=savefmt)
+		overlays.overlaySpec(spec,files1D,PPcs,peakWidth1D,intThres1D,out_file51,out_img51,net=args.net,shift=padUnits,method='1D',savefmt=savefmt,plot=args.figure.lower() == "yes")
 
 	## Overlay 1D 13C specctra on the INADEQUATE spectra
 	
 	if args.steps.lower() in {'overlayjres'}:
 		
-		with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
-		
 		filesJres=param['FilesJres']
 		JresMethod=param['JresProjectionMethod']
 		peakWidthJres=param['PeakWidthJres']
@@ -210,13 +433,23 @@ def main(args):
 		# (fig,curraxs)=plotting.plotNetwork(spec,Xrng,Yrng,PPcs,PPdq,out_file3)
 		# overlays.overlay1D(spec,files1D,PPcs,peakWidth1D,intThres,out_file51,out_img51,net=args.net)
 		# overlays.overlayJres(spec,filesJres,method=JresMethod)
-		overlays.overlaySpec(spec,filesJres,PPcs,peakWidthJres,intThresJres,out_file52,out_img52,net=args.net,shift=None,method='jres',use=JresMethod,savefmt=savefmt)
+		overlays.overlaySpec(spec,filesJres,PPcs,peakWidthJres,intThresJres,out_file52,out_img52,net=args.net,shift=None,method='jres',use=JresMethod,savefmt=savefmt,plot=args.figure.lower() == "yes",cache=cache)
 
-	## Plotting for all steps
+	## Integrate the network peaks across a cohort of 1D or Jres spectra on a process pool
+
+	if args.steps.lower() in {'cohort1d'}:
+		out_file53=args.outdir+"/"+param['Cohort1D_output_file']
+		print("Step5==> Integrating INETA network peaks in the provided 1D spectra...")
+		overlays.cohortOverlay(spec,param['Files1D'],PPcs,param['PeakWidth1D'],param['Intensity_threshold1D'],out_file53,shift=shiftUnits1D(param),method='1D',procs=args.procs)
+		print("...Done.")
 
-	if args.steps.lower() in {'plot'}:
-		with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
+	if args.steps.lower() in {'cohortjres'}:
+		out_file54=args.outdir+"/"+param['CohortJres_output_file']
+		print("Step5==> Integrating INETA network peaks in the provided Jres spectra...")
+		overlays.cohortOverlay(spec,param['FilesJres'],PPcs,param['PeakWidthJres'],param['Intensity_thresholdJres'],out_file54,method='jres',use=param['JresProjectionMethod'],procs=args.procs,cache=cache)
+		print("...Done.")
+
+	## Plotting for all steps
 
 	out_sep= param['OutImage_pick_separate']
 	out_comp= param['OutImage_pick_complete']
@@ -224,7 +457,7 @@ def main(args):
 	out_comp2= param['OutImage_cluster_complete']
 	out_nets=param['OutImage_network_AllNets']
 
-	if args.steps.lower() not in {'load','summary'}:
+	if args.steps.lower() not in {'summary'}:
 		print("Generate_figure option set to:",args.figure)
 	
 		if args.figure.lower() == "yes":
@@ -268,8 +501,6 @@ def main(args):
 	if args.steps.lower() in {'singleplot'}:
 		if (args.net is None or args.dbname is None):
 			parser.error("-s singleplot requires -n Network and -d DatabaseEntry.")
-		with open('ptf_pyINETAObj.pickle', 'rb') as handle:
-				spec = pickle.loads(handle.read())
 		# Plot selected Network with a target metabolite
 		plotting.plotIndividualMatch(spec,inetaDb,args.net,args.dbname,Xrng,Yrng)#"bmse000794")
 
@@ -281,12 +512,20 @@ if __name__ == '__main__':
 	parser.add_argument('-o', '--outdir', default=os.getcwd(),
 		help='Optional: Full path to the output folder.(Default: Current folder)')
 	parser.add_argument('-s', '--steps', default="all",
-		help='Optional: Specify which steps you want to run. Can be one of {all,load,pick,cluster,find,match,plot,summary,singleplot,load+,pick+,cluster+,find+,match+}. Adding a + to the end of option runs all steps after the specified step.')
+		help='Optional: Specify which steps you want to run. Can be one of {all,pick,cluster,find,match,plot,summary,singleplot,sweep,overlay1d,overlayjres,cohort1d,cohortjres,load+,pick+,cluster+,find+,match+}. Adding a + to the end of option runs all steps after the specified step, and load+ runs them all. Steps are reused from the step cache when their inputs and parameters are unchanged; plot, summary, singleplot and the overlay and cohort steps only read cached results and stop with an error if a step has not been run.')
 	parser.add_argument('-n', '--net', default=None,
 		help='Required with -s singlePlot: Specify which Network you want to plot.')
 	parser.add_argument('-d', '--dbname', default=None,
 		help='Required with -s singlePlot: Specify which database metabolite you want to plot.')
 	parser.add_argument('-f', '--figure', default="yes",
 		help='Optional: Generate figures- yes or no. Default: Yes')
+	parser.add_argument('-b', '--batch', default=None,
+		help='Optional: Run the pipeline for many spectra. Either a manifest file with one Ft file per line (optionally followed by a tab and a sample name), a folder with Ft files or a quoted glob pattern. The Ft_File option in the config file is ignored and each sample is written to its own subfolder of the output folder.')
+	parser.add_argument('-j', '--procs', type=int, default=1,
+		help='Optional: Number of samples processed in parallel in batch mode, of parameter combinations with -s sweep, or of spectra with -s cohort1d and cohortjres. Default: 1')
+	parser.add_argument('-g', '--grid', action='append', default=[],
+		help='Required with -s sweep: A parameter grid as NAME=value1,value2,... Use once per swept parameter. Can be any of LevelPointsDistance, DQT, SumXY, SDT, CST, CSMT, Match_tolerance, Topology_tolerance, Hit_Score_threshold and Coverage_Score_threshold; other parameters keep their config file values.')
+	parser.add_argument('--profile', action='store_true',
+		help='Optional: Also write a cProfile dump of every step to a profile subfolder of the output folder, one .prof file per step.')
 	args = parser.parse_args()
 	main(args)
\ No newline at end of file
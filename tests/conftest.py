@@ -0,0 +1,27 @@
+"""Shared test data."""
+
+import numpy as np
+import pytest
+
+@pytest.fixture
+def jsonDb ():
+	"""A random INETA database in json format.
+
+	Atoms have one to three chemical shift values and network sides one or two points, so mean shifts and the first matching point of a side matter.
+	Some entries have no networks and the ambiguity varies, so the entry filters matter too.
+	"""
+
+	rng=np.random.default_rng(7)
+	db={}
+	for e in range(300):
+		atoms=["C%d" % (i+1) for i in range(rng.integers(2,9))]
+		shifts={a:np.round(rng.uniform(10,190)+rng.uniform(-0.1,0.1,rng.integers(1,4)),2).tolist() for a in atoms}
+		mean=[float(np.mean(shifts[a])) for a in atoms]
+		networks=[]
+		for i in range(len(atoms)-1):
+			dq=round(mean[i]+mean[i+1],2)
+			networks.append([[atoms[j],[[round(mean[j]+d,2),round(dq+d,2)] for d in rng.uniform(-0.3,0.3,rng.integers(1,3))]] for j in (i,i+1)])
+		name="rnd%d" % (e+1)
+		db["%s::%s::%s::1::D2O" % (name,name,name)]={"BMRBName":name,"InternalID":"%s::%s::%s::1::D2O" % (name,name,name),"Version":"1","Solvent":"D2O",
+			"ChemicalShifts":shifts,"Bonds":[[atoms[i],atoms[i+1]] for i in range(len(atoms)-1)],"Networks":networks if rng.uniform() > 0.1 else [],"Ambiguity":float(rng.choice([0,0.5,1,2.5]))}
+	return(db)
@@ -0,0 +1,59 @@
+"""Checks for the step cache."""
+
+import os
+import pickle
+import pytest
+import numpy as np
+from pyineta.cache import StepCache, stepKey
+
+def test_stepKey_param_order ():
+	a=stepKey('parent','find',[0.5,{'DQT':0.3,'SumXY':1,'SDT':0.5}])
+	b=stepKey('parent','find',[0.5,{'SDT':0.5,'DQT':0.3,'SumXY':1}])
+	assert a == b
+	assert a.startswith('find-')
+	assert stepKey('parent','find',[0.5,{'DQT':0.3,'SumXY':1,'SDT':0.6}]) != a
+	assert stepKey('other','find',[0.5,{'DQT':0.3,'SumXY':1,'SDT':0.5}]) != a
+	assert stepKey('parent','find',[{'SumXY':1,'DQT':0.3,'SDT':0.5},0.5]) != a	# Lists keep their order
+
+def test_put_get_atomic (tmp_path):
+	cache=StepCache(str(tmp_path),2**20)
+	value={'mergedPts':np.arange(10.0).reshape(5,2),'Networks':[[(1.0,2.0),(3.0,4.0)]]}
+	cache.put('find-a',value)
+	assert os.listdir(str(tmp_path)) == ['find-a.pickle']	# No temporary files left
+	got=cache.get('find-a')
+	np.testing.assert_array_equal(got['mergedPts'],value['mergedPts'])
+	assert got['Networks'] == value['Networks']
+	cache.put('find-a',{'Networks':[]})
+	assert cache.get('find-a') == {'Networks':[]}
+	assert cache.get('find-b') is None
+
+def test_evict_lru (tmp_path):
+	cache=StepCache(str(tmp_path),2**30)
+	for i in range(5):
+		cache.put('pick-%d' % (i),bytes(1000))
+		os.utime(cache._path('pick-%d' % (i)),(1000+i,1000+i))
+	os.utime(cache._path('pick-0'),(2000,2000))	# Used last
+	size=os.path.getsize(cache._path('pick-0'))
+	cache.maxBytes=3*size
+	cache.evict(keep=cache._path('pick-1'))
+	assert sorted(os.listdir(str(tmp_path))) == ['pick-0.pickle','pick-1.pickle','pick-4.pickle']
+	cache.maxBytes=size
+	cache.evict()
+	assert os.listdir(str(tmp_path)) == ['pick-0.pickle']
+
+@pytest.mark.parametrize("cut", [0,1,10,-1])
+def test_get_truncated (tmp_path,cut):
+	cache=StepCache(str(tmp_path),2**20)
+	cache.put('match-a',{'NetTag':[['C1','C2']],'NetMatch':[np.arange(100.0)]})
+	with open(cache._path('match-a'), 'rb') as handle:
+		data=handle.read()
+	with open(cache._path('match-a'), 'wb') as handle:
+		handle.write(data[:cut])
+	assert cache.get('match-a') is None
+
+def test_get_corrupt (tmp_path):
+	cache=StepCache(str(tmp_path),2**20)
+	for k, data in enumerate([b'not a pickle',bytes(range(256)),pickle.dumps(1)[:-1]+b'x',b'\x80\x04\x95\xff\xff\xff\xff']):
+		with open(cache._path('find-%d' % (k)), 'wb') as handle:
+			handle.write(data)
+		assert cache.get('find-%d' % (k)) is None
@@ -0,0 +1,73 @@
+"""Regression checks for clustering peaks with array labels."""
+
+import numpy as np
+import pytest
+from collections import defaultdict
+import pyineta.clustering as clustering
+
+def listGather (Points,thres,ax):	# gather as it was before gatherLabels, one list of points per cluster
+	sets=defaultdict(list)
+	sPts=sorted(Points, key=lambda tup: tup[ax])
+	i=0
+	sets[i].append(sPts.pop(0))
+	for elem in sPts:
+		minval=min(sets[i], key = lambda t: t[0])
+		if (abs(minval[ax]-elem[ax]) < float(thres)):
+			sets[i].append(elem)
+		else:
+			i=i+1
+			sets[i].append(elem)
+	return(sets)
+
+def listSplit (Points,thres,ax):	# splitY as it was before splitLabels
+	sets=defaultdict(list)
+	i=0
+	for k, Group in list(Points.items()):
+		sPts=sorted(Group, key=lambda tup: tup[ax])
+		sets[i].append(sPts[0])
+		for first, second in zip(sPts, sPts[1:]):
+			if (abs(first[1]-second[1]) < float(thres)):
+				sets[i].append(second)
+			else:
+				i=i+1
+				sets[i].append(second)
+		i=i+1
+	return(sets)
+
+def randomPoints (rng,n):	# Picked points sit on the spectrum grid, so many share a 13C or DQ value
+	return(np.column_stack((np.round(rng.uniform(0,50,n)*20)/20,np.round(rng.uniform(0,100,n)*10)/10)))
+
+def labelClusters (P,PPcs,PPdq,metric,I=None):	# As Pyineta.clusterPoints
+	I=np.zeros(len(P)) if I is None else I
+	(order,labels)=clustering.gatherLabels(P,PPcs,0)
+	(P,I)=(P[order],I[order])
+	(order,labels)=clustering.splitLabels(P,labels,PPdq,1)
+	return(P[order],I[order],labels,clustering.centers(P[order],labels,metric,I[order]))
+
+@pytest.mark.parametrize("PPcs,PPdq", [(1,2),(0.05,0.1),(0.3,5),(2.5,0.5)])
+def test_labels_match_lists (PPcs,PPdq):
+	rng=np.random.default_rng(0)
+	for s in range(20):
+		P=randomPoints(rng,rng.integers(1,300))
+		expected=listSplit(listGather([tuple(p) for p in P],PPcs,0),PPdq,1)
+		(sP,sI,labels,C)=labelClusters(P,PPcs,PPdq,"median")
+		assert [[tuple(p) for p in sP[labels == k]] for k in range(labels[-1]+1)] == list(expected.values())
+		np.testing.assert_array_equal(C,np.asarray([(np.median([v[0] for v in c]),np.median([v[1] for v in c])) for c in expected.values()]))
+		(sP,sI,labels,C)=labelClusters(P,PPcs,PPdq,"mean")
+		np.testing.assert_allclose(C,np.asarray([(sum(v[0] for v in c)/float(len(c)),sum(v[1] for v in c)/float(len(c))) for c in expected.values()]),rtol=1e-12)
+
+def test_weighted_centers ():
+	rng=np.random.default_rng(1)
+	for s in range(20):
+		P=randomPoints(rng,rng.integers(1,300))
+		I=rng.uniform(-1e9,1e9,len(P))
+		(sP,sI,labels,C)=labelClusters(P,1,2,"weighted",I)
+		expected=[np.average(sP[labels == k],axis=0,weights=np.abs(sI[labels == k])) for k in range(labels[-1]+1)]
+		np.testing.assert_allclose(C,np.asarray(expected),rtol=1e-12)
+
+def test_centerMass_weighted_dict ():
+	Clusters={0:[(1.0,2.0),(3.0,4.0)],1:[(5.0,6.0)]}
+	weights={0:[1.0,-3.0],1:[2.0]}
+	np.testing.assert_allclose(clustering.centerMass(Clusters,"weighted",weights),[[2.5,3.5],[5.0,6.0]])
+	with pytest.raises(SystemExit):
+		clustering.centers(np.zeros((2,2)),np.array([0,0]),"weighted")
@@ -0,0 +1,40 @@
+"""Regression checks for the compiled columnar database."""
+
+import pickle
+import numpy as np
+import pyineta.database as database
+import pyineta.matching as matching
+
+def test_compiled_entries (jsonDb,tmp_path):
+	dbfile=str(tmp_path/"db.npz")
+	database.writeCompiled(jsonDb,dbfile)
+	db=database.loadDatabase(dbfile)
+	assert isinstance(db,database.CompiledDb)
+	assert list(db) == list(jsonDb)
+	assert len(db) == len(jsonDb)
+	for k in jsonDb:
+		assert db[k] == jsonDb[k]
+	assert "missing" not in db
+
+def test_compiled_mmap_pickle (jsonDb,tmp_path):
+	dbfile=str(tmp_path/"db.npz")
+	database.writeCompiled(jsonDb,dbfile)
+	db=database.CompiledDb(dbfile)
+	assert isinstance(db.pointVal,np.memmap) and isinstance(db.csVal,np.memmap)
+	assert not db.pointVal.flags.writeable
+	data=pickle.dumps(db)
+	assert len(data) < 200	# Only the filename
+	copy=pickle.loads(data)
+	assert isinstance(copy.pointVal,np.memmap)
+	assert all(copy[k] == jsonDb[k] for k in jsonDb)
+
+def test_compiled_match_index (jsonDb,tmp_path):
+	dbfile=str(tmp_path/"db.npz")
+	database.writeCompiled(jsonDb,dbfile)
+	for amb_tol in (0,1,2.5):
+		expected=matching.MatchIndex(jsonDb,amb_tol)
+		index=matching.MatchIndex.fromFile(dbfile,amb_tol)
+		assert index.keys == expected.keys
+		assert index.groupAtom == expected.groupAtom
+		for name in ('shifts','entries','groupStart','points','pointGroup','pointOrder'):
+			np.testing.assert_array_equal(getattr(index,name),getattr(expected,name))
@@ -0,0 +1,82 @@
+"""Regression checks for the network finding functions."""
+
+import itertools
+import numpy as np
+import pytest
+import pyineta.finding as finding
+
+def kdtreeMerge (Clist,levdist):	# mergeLevels as it was before the grid hash, one KDTree query per point
+	mergedClist=Clist[list(Clist.keys())[0]]
+	for k, C in list(Clist.items()):
+		for P in C:
+			res=finding.findClosestPoints(mergedClist,P)
+			if (res[0]>float(levdist)):
+				mergedClist=np.vstack([mergedClist, P])
+			else:
+				avgP=np.mean([mergedClist[res[1]], P],0)
+				mergedClist=np.delete(mergedClist, (res[1]), axis=0)
+				mergedClist=np.vstack([mergedClist, avgP])
+	mergedClist.view('i8,i8').sort(order=['f0'], axis=0)
+	return(mergedClist)
+
+@pytest.mark.parametrize("grid,levdist", [(0.25,0.5),(0.5,0.5),(0.1,0.3),(0.125,1.0)])
+def test_mergeLevels_grid_ties (grid,levdist):
+	rng=np.random.default_rng(0)
+	for s in range(50):	# Points on a grid are often equally close to two merged points
+		Clist={k:np.round(rng.uniform(0,5,(rng.integers(5,40),2))/grid)*grid for k in range(4)}
+		expected=kdtreeMerge({k:v.copy() for k, v in Clist.items()},levdist)
+		merged=finding.mergeLevels({k:v.copy() for k, v in Clist.items()},levdist)
+		np.testing.assert_array_equal(merged,expected)
+
+def networkxNetworks (P,groups):	# buildNetwork as it was before the union-find, a networkx graph keyed on point coordinates
+	nx=pytest.importorskip('networkx')
+	g=nx.Graph()
+	for grp in groups:
+		for edge in finding.getPairs(tuple(tuple(P[i]) for i in grp)):
+			g.add_edge(*edge)
+	return([list(net) for net in nx.connected_components(g)])
+
+def randomGroups (rng,n):	# Points on a coarse grid, so some of them are equal, linked in vertical groups then pairs
+	P=np.round(rng.uniform(0,5,(n,2))*2)/2
+	groups=[rng.choice(n,rng.integers(1,4),replace=False).tolist() for k in range(n//4)]
+	groups+=[rng.choice(n,2,replace=False).tolist() for k in range(n//3)]
+	return(P,groups)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_linkNetworks_networkx_order (seed):
+	(P,groups)=randomGroups(np.random.default_rng(seed),40)
+	(Net,pairs,links)=finding.linkNetworks(P,groups,order='networkx')
+	assert [[tuple(P[i]) for i in net] for net in Net] == networkxNetworks(P,groups)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_linkNetworks_index_order (seed):
+	(P,groups)=randomGroups(np.random.default_rng(seed),40)
+	(Net,pairs,links)=finding.linkNetworks(P,groups)
+	assert all(net == sorted(net) for net in Net)
+	expected=networkxNetworks(P,groups)
+	assert [sorted(tuple(P[i]) for i in net) for net in Net] == [sorted(net) for net in expected]
+	expectedPairs=[[P[a],P[b]] for grp in groups for a, b in itertools.combinations(grp,2)]	# listPairs on the coordinates
+	np.testing.assert_array_equal(P[pairs].reshape(-1,2,2),np.reshape(expectedPairs,(-1,2,2)))
+
+@pytest.mark.parametrize("order", ['index','networkx'])
+def test_linkNetworks_add_pair (order):
+	pytest.importorskip('networkx')
+	rng=np.random.default_rng(1)
+	for s in range(20):
+		(P,groups)=randomGroups(rng,30)
+		pair=rng.choice(len(P),2,replace=False).tolist()
+		(Net,pairs,links)=finding.linkNetworks(P,groups,order)
+		links.add(pair)
+		(expectedNet,expectedPairs,expectedLinks)=finding.linkNetworks(P,groups+[pair],order)
+		assert links.networks() == expectedNet
+		np.testing.assert_array_equal(links.pairArray(),expectedPairs)
+
+def test_networkPairs_linear_scan ():
+	rng=np.random.default_rng(2)
+	for s in range(20):
+		(P,groups)=randomGroups(rng,40)
+		(Net,pairs,links)=finding.linkNetworks(P,groups)
+		index=finding.pairIndex(pairs,len(P))
+		for net in Net:
+			expected=[k for k, (a,b) in enumerate(pairs.tolist()) if a in net or b in net]
+			assert finding.networkPairs(index,net).tolist() == expected
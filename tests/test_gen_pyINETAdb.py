@@ -0,0 +1,70 @@
+"""Regression checks for building the database from NMR-STAR files and drawing its images."""
+
+import os
+import random
+import pytest
+import pynmrstar
+import matplotlib.image as mpimg
+import gen_pyINETAdb as gen
+
+imageEntry={"Networks":[[["C1",[[30.5,75.2]]],["C2",[[44.7,75.2]]]],[["C2",[[44.7,104.9]]],["C3",[[60.2,104.9]]]]]}
+
+def writeStar (filename,e,rng):	# A small NMR-STAR entry for a chain of carbons, in one or two solvents
+	ent=pynmrstar.Entry.from_scratch('bmse%06d' % (e))
+	sf=pynmrstar.Saveframe.from_scratch('entry_information','_Entry')
+	for tag, val in [('Sf_category','entry_information'),('ID','bmse%06d' % (e)),('BMRB_internal_directory_name','Compound (R) %d' % (e)),('NMR_STAR_version','3.1.1.31')]:
+		sf.add_tag(tag,val)
+	ent.add_saveframe(sf)
+	sf=pynmrstar.Saveframe.from_scratch('sample_1','_Sample')
+	sf.add_tag('Sf_category','sample')
+	lp=pynmrstar.Loop.from_scratch('_Sample_component')
+	lp.add_tag(['Type','Mol_common_name','Concentration_val','Concentration_val_units','Concentration_val_err'])
+	for s in ['D2O','DMSO'][:1+(e%3==0)]:
+		lp.add_data(['Solvent',s,'1','mM','.'])
+	sf.add_loop(lp)
+	ent.add_saveframe(sf)
+	na=rng.randint(2,6)
+	sf=pynmrstar.Saveframe.from_scratch('cs_1','_Assigned_chem_shift_list')
+	sf.add_tag('Sf_category','assigned_chemical_shifts')
+	lp=pynmrstar.Loop.from_scratch('_Atom_chem_shift')
+	lp.add_tag(['Atom_type','Atom_ID','Auth_atom_ID','Val','Val_err','Ambiguity_code'])
+	for a in range(na):
+		lp.add_data(['C','C%d' % (a+1),'C%d' % (a+1),'%.2f' % (rng.uniform(10,180)),'.','1'])
+	sf.add_loop(lp)
+	ent.add_saveframe(sf)
+	sf=pynmrstar.Saveframe.from_scratch('chem_comp','_Chem_comp')
+	sf.add_tag('Sf_category','chem_comp')
+	lp=pynmrstar.Loop.from_scratch('_Chem_comp_bond')
+	lp.add_tag(['Atom_ID_1','Atom_ID_2'])
+	for a in range(na-1):
+		lp.add_data(['C%d' % (a+1),'C%d' % (a+2)])
+	sf.add_loop(lp)
+	ent.add_saveframe(sf)
+	with open(filename, 'w') as outf:
+		outf.write(str(ent))
+	return(filename)
+
+def test_parse_entries_pool (tmp_path):
+	rng=random.Random(0)
+	filelocs=[writeStar(os.path.join(str(tmp_path),"e%03d.str" % (e)),e,rng) for e in range(12)]
+	with open(os.path.join(str(tmp_path),"bad.str"), 'w') as outf:
+		outf.write("not a star file\n")
+	filelocs.insert(5,os.path.join(str(tmp_path),"bad.str"))
+	serial=[(vars(entry) if entry is not None else None,failed) for entry, failed in gen.parse_entries(filelocs,1)]
+	pooled=[(vars(entry) if entry is not None else None,failed) for entry, failed in gen.parse_entries(filelocs,3)]
+	assert pooled == serial
+	assert serial[5][0] is None and serial[5][1][0] == "read"
+	assert all(entry is not None and entry['networks'] for entry, failed in serial[:5]+serial[6:])
+
+@pytest.mark.parametrize("imgformat", ['eps','png','svg'])
+def test_plot_db_formats (tmp_path,imgformat):
+	gen.plot_db(str(tmp_path),{"bmse000001::Test::Test::1::D2O":imageEntry},imgformat=imgformat)
+	imgname=os.path.join(str(tmp_path),"db_images_constXYlim","bmse000001-Test-Test-1-D2O."+imgformat)
+	assert os.path.getsize(imgname) > 0
+	if imgformat == 'png':
+		(size,dpi)=gen.imageDefaults['png']
+		assert mpimg.imread(imgname).shape[:2] == (size*dpi,size*dpi)
+
+def test_plot_db_png_too_large (tmp_path):
+	with pytest.raises(SystemExit):
+		gen.plot_db(str(tmp_path),{"bmse000001::Test::Test::1::D2O":imageEntry},imgformat='png',size=70,dpi=1800)
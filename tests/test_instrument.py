@@ -0,0 +1,61 @@
+"""Checks for recording the PyINETA steps."""
+
+import os
+import json
+import pytest
+import pyineta.instrument as instrument
+
+@instrument.timed('inner',lambda out, args: {'items':len(out)})
+def inner (n):
+	instrument.count('calls')
+	return(list(range(n)))
+
+@instrument.timed('outer')
+def outer (n):
+	instrument.count('calls',2)
+	return(inner(n)+inner(n+1))
+
+@instrument.timed('failing')
+def failing ():
+	inner(1)
+	raise ValueError("stop")
+
+def test_timed_depth_counts ():
+	instrument.reset()
+	assert outer(3) == [0,1,2,0,1,2,3]
+	assert [(r['step'],r['depth']) for r in instrument.records] == [('outer',0),('inner',1),('inner',1)]
+	assert [r['counts'] for r in instrument.records] == [{'calls':2},{'calls':1,'items':3},{'calls':1,'items':4}]
+	assert all(r['wall'] >= 0 and r['cpu'] >= 0 for r in instrument.records)
+	assert instrument.records[0]['function'] == 'outer'
+	assert instrument.running == []
+	instrument.count('calls')	# No step running
+	assert instrument.records[0]['counts'] == {'calls':2}
+
+def test_timed_exception ():
+	instrument.reset()
+	with pytest.raises(ValueError):
+		failing()
+	assert [(r['step'],r['depth']) for r in instrument.records] == [('failing',0),('inner',1)]
+	assert 'wall' in instrument.records[0]
+	assert instrument.running == []
+
+def test_profile_dumps (tmp_path):
+	instrument.reset(str(tmp_path/"profile"))
+	outer(2)
+	outer(2)
+	instrument.reset()
+	assert sorted(os.listdir(str(tmp_path/"profile"))) == ['outer.prof','outer_2.prof']
+
+def test_writeReport (tmp_path):
+	instrument.reset()
+	outer(2)
+	inner(5)
+	outfilename=str(tmp_path/"timings.json")
+	instrument.writeReport(outfilename,{'Ft_File':'s.ft'})
+	with open(outfilename, 'r') as handle:
+		report=json.load(handle)
+	assert report['Ft_File'] == 's.ft'
+	assert [r['step'] for r in report['steps']] == ['outer','inner','inner','inner']
+	top=[r for r in report['steps'] if r['depth'] == 0]
+	assert report['total_wall'] == pytest.approx(sum(r['wall'] for r in top),abs=1e-5)
+	assert report['total_cpu'] == pytest.approx(sum(r['cpu'] for r in top),abs=1e-5)
@@ -0,0 +1,88 @@
+"""Regression checks for matching networks against the preindexed database."""
+
+import numpy as np
+import pytest
+import pyineta.matching as matching
+
+def scanCandidates (json_db,X,amb_tol,near_tol,match_tol):	# Candidate entries as matchDatabase found them before MatchIndex, scanning every entry
+	keys=[]
+	for i in json_db:
+		if (len(json_db[i]['Networks']) >=1) and (json_db[i]['Ambiguity'] <= float(amb_tol)):
+			matchCS=[]
+			for xval in X:
+				for CS in json_db[i]['ChemicalShifts']:
+					CSlist=json_db[i]['ChemicalShifts'][CS]
+					if CS not in matchCS and abs(xval-sum(CSlist)/float(len(CSlist))) <= float(near_tol):
+						matchCS.append(CS)
+			if (len(matchCS) >= float(match_tol)):
+				keys.append(i)
+	return(keys)
+
+def scanDatabase (json_db,Pval,tag,unknown_conn,amb_tol,near_tol,match_tol,top_tol,hit_tol,cov_tol,NetNum,Pts):	# matchDatabase before MatchIndex
+	X=[float(i[0]) for i in Pval]
+	Y=[float(i[1]) for i in Pval]
+	hitList=["Network"+str(NetNum),X,Y,tag,Pts]
+	for i in scanCandidates(json_db,X,amb_tol,near_tol,match_tol):
+		found={}
+		matchPeaks={}
+		for j in json_db[i]['Networks']:
+			for k in j:
+				break_outer_loop=False
+				for l in k[1]:
+					for ind,xval in enumerate(X):
+						if (((xval-l[0])**2 + (Y[ind]-l[1])**2)**(1/2.0) <= float(top_tol)):
+							matchPeaks[tag[ind]]=k[0]
+							found[tag[ind]]=1
+							break_outer_loop=True
+							break
+					if break_outer_loop: break
+		(fin_match,no_match,hitCount)=matching.matchTag(matchPeaks,unknown_conn)
+		hitScore=float("{0:.3f}".format(float(hitCount)/float(len(json_db[i]['Networks']))))
+		CovScore=float("{0:.3f}".format(float(len(found))/float(len(tag))))
+		if (hitScore >= float(hit_tol) and CovScore >= float(cov_tol)):
+			hitList.append([i,[json_db[i]['Networks']],fin_match,no_match,json_db[i]['Ambiguity'],hitScore,CovScore])
+	return(hitList)
+
+def randomNetworks (json_db,rng,n):	# Networks near the points of database entries, with some unrelated peaks
+	keys=[k for k in json_db if json_db[k]['Networks']]
+	nets=[]
+	for k in rng.choice(len(keys),n):
+		pts=[p for net in json_db[keys[k]]['Networks'] for side in net for p in side[1]]
+		pts=np.asarray(pts)+rng.uniform(-0.6,0.6,(len(pts),2))
+		nets.append(np.round(np.vstack((pts,rng.uniform(10,380,(rng.integers(0,3),2)))),2))
+	return(nets)
+
+@pytest.mark.parametrize("amb_tol,near_tol,match_tol", [(1,1,2),(0.5,0.2,1),(2.5,2,3),(0,0.5,2)])
+def test_candidates_linear_scan (jsonDb,amb_tol,near_tol,match_tol):
+	index=matching.MatchIndex(jsonDb,amb_tol)
+	for P in randomNetworks(jsonDb,np.random.default_rng(0),30):
+		assert index.candidates(P[:,0],near_tol,match_tol) == scanCandidates(jsonDb,P[:,0],amb_tol,near_tol,match_tol)
+
+@pytest.mark.parametrize("top_tol", [0.2,0.5,2])
+def test_matchDatabase_linear_scan (jsonDb,top_tol):
+	index=matching.MatchIndex(jsonDb,1)
+	for num, P in enumerate(randomNetworks(jsonDb,np.random.default_rng(1),30)):
+		Pval=[tuple(p) for p in P]
+		tag=["CX%d" % (i+1) for i in range(len(Pval))]
+		conn=[[tag[i],tag[i+1]] for i in range(len(tag)-1)]
+		args=(Pval,tag,conn,1,1,2,top_tol,0,0.2,num+1,[])
+		assert matching.matchDatabase(index,*args) == scanDatabase(jsonDb,*args)
+		assert matching.matchDatabase(jsonDb,*args) == scanDatabase(jsonDb,*args)
+
+@pytest.mark.parametrize("top_tol", [0.2,0.5,2])
+def test_topology_linear_scan (jsonDb,top_tol):
+	index=matching.MatchIndex(jsonDb,1)
+	for P in randomNetworks(jsonDb,np.random.default_rng(2),30):
+		expected=[]
+		g=0
+		for i in index.keys:	# Every side of every network is a group, in database order
+			for net in jsonDb[i]['Networks']:
+				for side in net:
+					for l in side[1]:
+						near=np.nonzero(((P[:,0]-l[0])**2 + (P[:,1]-l[1])**2)**(1/2.0) <= top_tol)[0]
+						if len(near):
+							expected.append((g,near[0]))
+							break
+					g+=1
+		(groups,peaks)=index.topology(P[:,0],P[:,1],top_tol)
+		assert list(zip(groups.tolist(),peaks.tolist())) == expected
@@ -0,0 +1,39 @@
+"""Regression checks for the overlay areas under the curve."""
+
+import numpy as np
+import pytest
+import pyineta.overlays as overlays
+
+def loopAUC (In,Xs,pts,aucTol):	# Areas as overlaySpec computed them before peakAUC, one argmin scan and index list per point
+	auc=[]
+	for Pt in pts:
+		idxMin=(np.abs(Xs-(Pt-aucTol/2))).argmin()
+		idxMax=(np.abs(Xs-(Pt+aucTol/2))).argmin()
+		indices=list(range(idxMin,idxMax,-1))
+		auc.append(In[indices].sum())
+	return(auc)
+
+@pytest.mark.parametrize("n,dtype", [(1001,np.float32),(65536,np.float32),(4096,np.float64)])
+def test_peakAUC_identical (n,dtype):
+	rng=np.random.default_rng(n)
+	Xs=np.linspace(200,0,n)
+	In=(rng.standard_normal(n)*1e6+rng.uniform(0,1e8,n)).astype(dtype)
+	pts=np.concatenate((np.round(rng.uniform(-5,205,300),2),Xs[rng.integers(0,n,50)]))
+	for aucTol in (0.01,0.5,1,5):
+		auc=overlays.peakAUC(In,Xs,pts,aucTol)
+		expected=loopAUC(In,Xs,pts,aucTol)
+		assert auc.dtype == In.dtype
+		assert [str(a) for a in auc] == [str(a) for a in expected]
+
+def test_writeOverlays_rows (tmp_path):
+	peaks=[('Network1','C1',30.5,75.2),('Network1','C2',44.7,75.2),('Network3','C1',60.2,104.9)]
+	aucs=[np.array([1.5,20.0,3.0],dtype=np.float32),np.array([12.0,0.5,30.0],dtype=np.float32)]
+	outfilename=str(tmp_path/"overlay.txt")
+	overlays.writeOverlays(['a.ft','b.ft'],['Network1','Network2','Network3'],peaks,aucs,10,outfilename)
+	with open(outfilename, 'r') as handle:
+		lines=handle.read().split('\n')
+	assert lines == [
+		"Network1\ta.ft=C1[Absent](30.5,75.2):1.5;C2[Present](44.7,75.2):20.0;\tb.ft=C1[Present](30.5,75.2):12.0;C2[Absent](44.7,75.2):0.5;",
+		"Network2\ta.ft=\tb.ft=",
+		"Network3\ta.ft=C1[Absent](60.2,104.9):3.0;\tb.ft=C1[Present](60.2,104.9):30.0;",
+		""]
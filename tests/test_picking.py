@@ -0,0 +1,62 @@
+"""Regression checks for peak picking by connected regions."""
+
+import numpy as np
+import pytest
+from scipy import ndimage
+import pyineta.picking as picking
+
+def randomSpectrum (rng,shape,n):	# Gaussian peaks of both signs over a noisy baseline, rounded so that some maxima are flat
+	(gx,gy)=np.mgrid[0:shape[0],0:shape[1]]
+	In=rng.standard_normal(shape)*1e5
+	for k in range(n):
+		(cx,cy)=(rng.uniform(0,shape[0]),rng.uniform(0,shape[1]))
+		(sx,sy)=rng.uniform(0.6,3,2)
+		In+=rng.choice([-1,1])*rng.uniform(1e6,1e8)*np.exp(-((gx-cx)/sx)**2-((gy-cy)/sy)**2)
+	return(np.round(In,-5))
+
+def denseRegions (In,level):	# Local maxima of the connected regions above a level, found on the dense matrix with ndimage
+	A=np.abs(In)
+	mask=A > int(level)
+	masked=np.where(mask,A,-np.inf)
+	footprint=np.ones((3,3),dtype=bool)
+	footprint[1,1]=False
+	nbMax=ndimage.maximum_filter(masked,footprint=footprint,mode='constant',cval=-np.inf)
+	isMax=mask & (masked >= nbMax)
+	(plateau,n)=ndimage.label(isMax,structure=np.ones((3,3)))
+	(region,m)=ndimage.label(mask,structure=np.ones((3,3)))
+	peaks=np.asarray([A[plateau == k].max() for k in range(1,n+1)])
+	counts=np.asarray([len(np.unique(plateau[(region == k) & isMax])) for k in range(1,m+1)])	# Number of peaks in each region
+	return(mask,region,counts,peaks)
+
+@pytest.mark.parametrize("shape,n", [((40,60),8),((120,80),30),((64,64),0)])
+def test_pickRegions_dense_reference (shape,n):
+	rng=np.random.default_rng(sum(shape)+n)
+	In=randomSpectrum(rng,shape,n)
+	xppm=np.linspace(200,0,shape[0])
+	yppm=np.linspace(400,0,shape[1])
+	(PPmin,PPmax,steps)=(5e5,5e7,6)
+	(Pts,X,Y,I,Area)=picking.pickRegions(In,xppm,yppm,PPmin,PPmax,steps)
+	for j, level in enumerate(picking.frange(PPmin,PPmax,steps)):
+		(mask,region,counts,peaks)=denseRegions(In,level)
+		np.testing.assert_array_equal(np.sort(np.abs(I[j])),np.sort(peaks))
+		assert Area[j].sum() == mask.sum()
+		assert Pts[j] == list(zip(X[j],Y[j]))
+		# Regions with a single peak own all of their cells, so the peak is the weighted centroid of the region
+		for k in np.nonzero(counts == 1)[0]:
+			(cx,cy)=np.nonzero(region == k+1)
+			w=np.abs(In[cx,cy])
+			(ex,ey)=(np.average(xppm[cx],weights=w),np.average(yppm[cy],weights=w))
+			hit=np.nonzero(np.isclose(X[j],ex,rtol=1e-12) & np.isclose(Y[j],ey,rtol=1e-12))[0]
+			assert len(hit) == 1 and Area[j][hit[0]] == len(cx)
+
+def test_pickRegions_sparse ():
+	rng=np.random.default_rng(3)
+	In=randomSpectrum(rng,(90,70),20)
+	xppm=np.linspace(200,0,90)
+	yppm=np.linspace(400,0,70)
+	dense=picking.pickRegions(In,xppm,yppm,5e5,5e7,5)
+	sparse=picking.pickRegions(picking.sparsify(In,xppm,yppm,5e5),xppm,yppm,5e5,5e7,5)
+	for (a,b) in zip(dense,sparse):
+		assert a.keys() == b.keys()
+		for j in a:
+			np.testing.assert_array_equal(np.asarray(a[j]),np.asarray(b[j]))
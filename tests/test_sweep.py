@@ -0,0 +1,32 @@
+"""Regression checks for the parameter sweep on a process pool."""
+
+import multiprocessing
+import numpy as np
+import pytest
+import pyineta.sweep as sweep
+import pyineta.matching as matching
+
+param={'LevelPointsDistance':0.5,'DQT':0.3,'SumXY':1,'SDT':0.5,'CST':0.02,'CSMT':1,'Match_tolerance':2,'Topology_tolerance':2,'Hit_Score_threshold':0.2,'Coverage_Score_threshold':0.5,'Ambiguity':1,'Network_order':'index'}
+
+def clusterState (jsonDb):	# Clustered points of two picking levels at the network points of some database entries
+	rng=np.random.default_rng(3)
+	keys=list(jsonDb)[:40]
+	P=np.asarray([p for k in keys for net in jsonDb[k]['Networks'] for side in net for p in side[1]],dtype=float)
+	return({'clusteredPts':{0:P,1:P+rng.uniform(-0.1,0.1,P.shape)}})
+
+@pytest.mark.parametrize("grid", [{'DQT':[0.2,0.5],'CSMT':[0.5,1,2]},{'CSMT':[0.5,1,1.5,2],'Topology_tolerance':[1,2]},{'LevelPointsDistance':[0.3,0.5,1]}])
+def test_runSweep_pools (jsonDb,tmp_path,monkeypatch,grid):
+	state=clusterState(jsonDb)
+	index=matching.MatchIndex(jsonDb,param['Ambiguity'])
+	tables=[]
+	for method, procs in [(None,1),('fork',2),('spawn',2)]:
+		if method is not None:
+			monkeypatch.setattr(sweep,'Pool',multiprocessing.get_context(method).Pool)
+		outfilename=str(tmp_path/("sweep_%s.tsv" % (method)))
+		ct=sweep.runSweep(state,index,param,grid,outfilename,procs)
+		with open(outfilename, 'r') as handle:
+			tables.append(handle.read())
+	assert ct == np.prod([len(v) for v in grid.values()])
+	assert len(tables[0].splitlines()) == ct+1
+	assert tables[1] == tables[0] and tables[2] == tables[0]
+	assert any(int(line.split('\t')[len(sweep.findParams)+len(sweep.matchParams)+2]) > 0 for line in tables[0].splitlines()[1:])	# Networks were found